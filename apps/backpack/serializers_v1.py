@@ -50,7 +50,7 @@ class LocalBadgeInstanceUploadSerializerV1(serializers.Serializer):
                 "id": "{}{}?type=png".format(OriginSetting.HTTP, reverse('issuer_image', kwargs={'entity_id': obj.cached_issuer.entity_id}))
             }
 
-        if obj.image:
+        if obj.image or obj.bake_status == obj.BAKE_STATUS_PENDING:
             representation['image'] = obj.image_url()
 
         representation['shareUrl'] = obj.share_url
@@ -5,6 +5,7 @@ from itertools import chain
 
 import cachemodel
 from allauth.account.models import EmailAddress, EmailConfirmation
+from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -30,7 +31,8 @@ from mainsite.exceptions import BadgrApiException400, BadgrValidationError
 from mainsite.models import ApplicationInfo, EmailBlacklist, BaseAuditedModel, BadgrApp
 from mainsite.utils import send_mail, EmailMessageMaker
 from signing.models import AssertionTimeStamp
-from staff.models import InstitutionStaff, FacultyStaff, IssuerStaff, BadgeClassStaff
+from staff.managers import LEVELS, ENTITY_MODELS
+from staff.models import InstitutionStaff, FacultyStaff, IssuerStaff, BadgeClassStaff, EntityClosure, STAFF_MODELS
 
 
 class UserProvisionment(BaseAuditedModel, BaseVersionedEntity, cachemodel.CacheModel):
@@ -293,29 +295,24 @@ class UserCachedObjectGetterMixin(object):
         :param type: string that represent class.__name__ ('Institution', 'Faculty', 'Issuer', 'BadgeClass' or None)
         :return: list of objects for which this user has the given permissions for.
         """
-        permissioned_objects = []
-
-        def object_tree_walker(obj, permissions, looking_for=type, override_permissions=False):
-            """
-            Recursively walks the object tree to find objects of which the user has all the given permissions for.
-            """
-            if obj.check_local_permissions(self, permissions) or override_permissions:
-                if looking_for:
-                    if obj.__class__.__name__ == looking_for:
-                        permissioned_objects.append(obj)
-                else:
-                    permissioned_objects.append(obj)
-                override_permissions = True
-            try:
-                for child in obj.children:
-                    object_tree_walker(child, permissions, looking_for, override_permissions)
-            except AttributeError:  # no more kids
-                pass
-
         if not self.is_teacher:
             raise ValueError('User must be teacher to walk the permission tree')
-        tree_root = self.institution
-        object_tree_walker(tree_root, permissions)
+        institution = ('Institution', self.institution_id)
+        if permissions:
+            # the entities with a staff membership that has all permissions, and everything below them
+            roots = [(level, entity_id) for staff_model, level, field in STAFF_MODELS
+                     for entity_id in staff_model.objects.filter(user=self, **{perm: True for perm in permissions})
+                     .values_list(field, flat=True)]
+        else:
+            roots = [institution]
+        permissioned_objects = []
+        if not roots:
+            return permissioned_objects
+        for level in [type] if type else LEVELS:
+            model = apps.get_model(*ENTITY_MODELS[level])
+            permissioned_objects += list(model.objects.filter(
+                pk__in=EntityClosure.objects.descendant_ids(roots, level, include_self=True)).filter(
+                pk__in=EntityClosure.objects.descendant_ids([institution], level, include_self=True)))
         return permissioned_objects
 
     def get_all_objects_with_permissions(self, permissions):
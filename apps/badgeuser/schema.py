@@ -4,6 +4,7 @@ from graphene_django.types import DjangoObjectType
 from badgeuser.models import BadgeUser, Terms, TermsAgreement, TermsUrl
 from directaward.schema import DirectAwardType
 from lti_edu.schema import StudentsEnrolledType
+from mainsite.graphql_loaders import get_loaders, foreign_key_resolver
 from mainsite.graphql_utils import UserProvisionmentType, resolver_blocker_only_for_current_user, resolver_blocker_for_students
 from mainsite.exceptions import GraphQLException
 from staff.schema import InstitutionStaffType, FacultyStaffType, IssuerStaffType, BadgeClassStaffType
@@ -24,8 +25,10 @@ class TermsType(DjangoObjectType):
     institution = graphene.Field('institution.schema.InstitutionType')
     terms_url = graphene.List(TermsUrlType)
 
+    resolve_institution = foreign_key_resolver('institution')
+
     def resolve_terms_url(self, info):
-        return list(self.terms_urls.all())
+        return get_loaders(info).load_related(TermsUrl, 'terms', self.pk)
 
 
 class TermsAgreementType(DjangoObjectType):
@@ -36,6 +39,8 @@ class TermsAgreementType(DjangoObjectType):
 
     terms = graphene.Field(TermsType)
 
+    resolve_terms = foreign_key_resolver('terms')
+
 
 class BadgeUserType(DjangoObjectType):
 
@@ -54,6 +59,8 @@ class BadgeUserType(DjangoObjectType):
     terms_agreements = graphene.List(TermsAgreementType)
     schac_homes = graphene.List(graphene.String)
 
+    resolve_institution = foreign_key_resolver('institution')
+
     def resolve_institution_staff(self, info):
         return self.cached_institution_staff()
 
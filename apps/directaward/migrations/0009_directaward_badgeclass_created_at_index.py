@@ -0,0 +1,17 @@
+# Generated by Django 2.2.18 on 2021-07-26 10:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('directaward', '0008_directaward_revocation_reason'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='directaward',
+            index_together={('badgeclass', 'created_at')},
+        ),
+    ]
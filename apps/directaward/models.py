@@ -2,7 +2,7 @@ import urllib
 
 import cachemodel
 from django.conf import settings
-from django.db import models, IntegrityError
+from django.db import models, transaction, IntegrityError
 from django.utils.html import strip_tags
 
 from entity.models import BaseVersionedEntity
@@ -27,6 +27,11 @@ class DirectAward(BaseAuditedModel, BaseVersionedEntity, cachemodel.CacheModel):
     status = models.CharField(max_length=254, choices=STATUS_CHOICES, default=STATUS_UNACCEPTED)
     revocation_reason = models.CharField(max_length=255, blank=True, null=True, default=None)
 
+    class Meta:
+        index_together = (
+            ('badgeclass', 'created_at'),
+        )
+
     def validate_unique(self, exclude=None):
         if self.__class__.objects \
                 .filter(eppn=self.eppn, badgeclass=self.badgeclass, status='Unaccepted') \
@@ -38,7 +43,24 @@ class DirectAward(BaseAuditedModel, BaseVersionedEntity, cachemodel.CacheModel):
 
     def save(self, *args, **kwargs):
         self.validate_unique()
-        return super(DirectAward, self).save(*args, **kwargs)
+        with transaction.atomic():
+            previous_status = DirectAward.objects.filter(pk=self.pk).values_list('status', flat=True).first() \
+                if self.pk else None
+            result = super(DirectAward, self).save(*args, **kwargs)
+            self._update_stats(previous_status, self.status)
+        return result
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super(DirectAward, self).delete(*args, **kwargs)
+            self._update_stats(self.status, None)
+        return result
+
+    def _update_stats(self, previous_status, status):
+        from issuer.models import BadgeClassStats
+        BadgeClassStats.objects.add(self.badgeclass_id,
+                                    pending_direct_award_count=(status == DirectAward.STATUS_UNACCEPTED) -
+                                                               (previous_status == DirectAward.STATUS_UNACCEPTED))
 
     def revoke(self, revocation_reason):
         if self.status == DirectAward.STATUS_REVOKED:
@@ -51,7 +73,7 @@ class DirectAward(BaseAuditedModel, BaseVersionedEntity, cachemodel.CacheModel):
 
     def award(self, recipient):
         """Accept the direct award and make an assertion out of it"""
-        from issuer.models import BadgeInstance
+        from issuer.models import BadgeClassStats, BadgeInstance
         if self.eppn not in recipient.eppns:
             raise BadgrValidationError('Cannot award, eppn does not match', 999)
 
@@ -65,16 +87,17 @@ class DirectAward(BaseAuditedModel, BaseVersionedEntity, cachemodel.CacheModel):
             allowed = any(identifier in schac_homes for identifier in identifiers) or recipient.validated_name
         if not allowed:
             raise BadgrValidationError('Cannot award, you are not a member of the institution of the badgeclass', 999)
-        assertion = self.badgeclass.issue(recipient=recipient,
-                                     created_by=self.created_by,
-                                     acceptance=BadgeInstance.ACCEPTANCE_ACCEPTED,
-                                     recipient_type=BadgeInstance.RECIPIENT_TYPE_EDUID,
-                                     send_email=False,
-                                     award_type=BadgeInstance.AWARD_TYPE_DIRECT_AWARD,
-                                     direct_award_bundle=self.bundle)
+        assertion, = self.badgeclass.issue_many([{'recipient': recipient,
+                                                  'acceptance': BadgeInstance.ACCEPTANCE_ACCEPTED,
+                                                  'recipient_type': BadgeInstance.RECIPIENT_TYPE_EDUID,
+                                                  'award_type': BadgeInstance.AWARD_TYPE_DIRECT_AWARD,
+                                                  'direct_award_bundle': self.bundle}],
+                                                created_by=self.created_by,
+                                                send_email=False)
         # delete any pending enrollments for this badgeclass and user
         recipient.cached_pending_enrollments().filter(badge_class=self.badgeclass).delete()
         recipient.remove_cached_data(['cached_pending_enrollments'])
+        BadgeClassStats.objects.rebuild([self.badgeclass_id], assertions=False, direct_awards=False)
         return assertion
 
     def get_permissions(self, user):
@@ -2,6 +2,8 @@ import graphene
 from graphene_django.types import DjangoObjectType
 
 from directaward.models import DirectAward, DirectAwardBundle
+from mainsite.graphql_loaders import get_loaders, foreign_key_resolver
+from mainsite.graphql_pagination import CountableConnection
 
 
 class DirectAwardType(DjangoObjectType):
@@ -9,6 +11,13 @@ class DirectAwardType(DjangoObjectType):
         model = DirectAward
         fields = ('entity_id', 'eppn', 'status', 'recipient_email', 'badgeclass', 'created_at', 'updated_at')
 
+    resolve_badgeclass = foreign_key_resolver('badgeclass')
+
+
+class DirectAwardConnection(CountableConnection):
+    class Meta:
+        node = DirectAwardType
+
 
 class DirectAwardBundleType(DjangoObjectType):
     class Meta:
@@ -23,8 +32,10 @@ class DirectAwardBundleType(DjangoObjectType):
     direct_award_revoked_count = graphene.Int()
     direct_awards = graphene.List(DirectAwardType)
 
+    resolve_badgeclass = foreign_key_resolver('badgeclass')
+
     def resolve_direct_awards(self, info, **kwargs):
-        return self.cached_direct_awards()
+        return get_loaders(info).load_related(DirectAward, 'bundle', self.pk)
 
 
 class Query(object):
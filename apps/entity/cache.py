@@ -0,0 +1,217 @@
+# encoding: utf-8
+import bisect
+import inspect
+import json
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from cachemodel.utils import generate_cache_key
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def revision_cache_key(class_name, pk):
+    return generate_cache_key(['EntityRevision', class_name, pk])
+
+
+def bump_revision(class_name, pk):
+    """
+    Replaces the revision token of an entity, which orphans every cached document that was built from it.
+    When called inside a transaction the token is replaced again after commit, so a document built from
+    uncommitted data in between can never be served.
+    """
+    bump_revisions([(class_name, pk)])
+
+
+def bump_revisions(dependencies):
+    """
+    Replaces the revision tokens for a list of (class_name, pk) tuples in one cache round trip
+    """
+    keys = [revision_cache_key(class_name, pk) for class_name, pk in dependencies]
+
+    def _bump():
+        cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+    _bump()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(_bump)
+
+
+def publish_on_commit(instance):
+    """
+    Publishes an instance and bumps its revision once when the current transaction commits, however often it
+    is called within that transaction. Outside of a transaction the instance is published immediately.
+    """
+    publish_key = (instance.__class__, instance.pk)
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        instance.publish()
+        instance.bump_revision()
+        return
+
+    # every call registers a callback and the first one that runs publishes the latest instance, so the publish
+    # still happens when django discards the callbacks of a rolled back savepoint
+    pending = connection.__dict__.setdefault('pending_publishes', {})
+    pending[publish_key] = instance
+
+    def _publish():
+        pending_instance = pending.pop(publish_key, None)
+        if pending_instance is not None:
+            pending_instance.publish()
+            pending_instance.bump_revision()
+    transaction.on_commit(_publish)
+
+
+def get_revisions(dependencies):
+    """
+    Returns the revision tokens for a list of (class_name, pk) tuples in one cache round trip
+    """
+    keys = [revision_cache_key(class_name, pk) for class_name, pk in dependencies]
+    revisions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in revisions}
+    if missing:
+        cache.set_many(missing, None)
+        revisions.update(missing)
+    return [revisions[key] for key in keys]
+
+
+def _cache_key_value(value):
+    if hasattr(value, '_meta') and hasattr(value, 'pk'):
+        return '{}:{}'.format(value.__class__.__name__, value.pk)
+    return value
+
+
+def cached_json_document(dependencies):
+    """
+    Caches the JSON document returned by a get_json method.
+
+    `dependencies` is called with the instance and the (defaulted) arguments of the call and returns the
+    (class_name, pk) tuples the document is built from. The cache key contains the current revision of each
+    dependency, so saving any of them makes the cached document unreachable.
+    Documents are stored serialized, callers always get a fresh OrderedDict they are free to mutate.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.pk is None or not getattr(settings, 'JSON_DOCUMENT_CACHE_ENABLED', True):
+                return method(self, *args, **kwargs)
+            arguments = signature.bind(self, *args, **kwargs)
+            arguments.apply_defaults()
+            options = OrderedDict((name, value) for name, value in arguments.arguments.items() if name != 'self')
+
+            revisions = get_revisions(dependencies(self, options))
+            key_kwargs = OrderedDict((name, _cache_key_value(value)) for name, value in sorted(options.items()))
+            key = generate_cache_key([self.__class__.__name__, method.__name__, self.pk],
+                                     revisions='|'.join(revisions), **key_kwargs)
+
+            document = cache.get(key)
+            if document is not None:
+                return json.loads(document, object_pairs_hook=OrderedDict)
+            result = method(self, *args, **kwargs)
+            try:
+                document = json.dumps(result)
+            except (TypeError, ValueError):
+                return result
+            cache.set(key, document, getattr(settings, 'JSON_DOCUMENT_CACHE_TIMEOUT', 60 * 60 * 24))
+            return result
+        return wrapper
+    return decorator
+
+
+class SegmentedQuerysetCache(object):
+    """
+    Caches the objects of a queryset that can grow beyond the 1 MB item limit of memcached.
+
+    The objects are stored ordered by primary key in chunks of at most chunk_size objects. A manifest holds the
+    primary key at which every chunk starts, the last chunk is open ended. New objects are appended to the last
+    chunk, which is split up when it is loaded again and has grown over chunk_size. Saving or deleting an object
+    only invalidates the chunk it belongs to.
+    """
+    GET_MANY_SIZE = 20
+
+    def __init__(self, key_prefix, queryset, chunk_size=None):
+        """
+        :param key_prefix: list that identifies the queryset, e.g. ['BadgeClass', pk, 'assertions']
+        """
+        self.key_prefix = ['SegmentedQuerysetCache'] + list(key_prefix)
+        self.queryset = queryset.order_by('pk')
+        self.chunk_size = chunk_size or getattr(settings, 'SEGMENTED_CACHE_CHUNK_SIZE', 200)
+        self.timeout = getattr(settings, 'SEGMENTED_CACHE_TIMEOUT', 60 * 60 * 24)
+
+    @property
+    def manifest_key(self):
+        return generate_cache_key(self.key_prefix + ['manifest'])
+
+    def _chunk_key(self, manifest, start, end):
+        return generate_cache_key(self.key_prefix + ['chunk'], generation=manifest['generation'], start=start,
+                                  end=end)
+
+    def _chunks(self, manifest):
+        starts = manifest['starts']
+        return list(zip(starts, starts[1:] + [None]))
+
+    def get_manifest(self):
+        manifest = cache.get(self.manifest_key)
+        if manifest is None:
+            pks = list(self.queryset.values_list('pk', flat=True))
+            manifest = {'generation': uuid.uuid4().hex,
+                        'starts': [0] + pks[self.chunk_size::self.chunk_size]}
+            cache.set(self.manifest_key, manifest, self.timeout)
+        return manifest
+
+    def _load_chunk(self, manifest, start, end):
+        chunk = self.queryset.filter(pk__gte=start)
+        if end is not None:
+            chunk = chunk.filter(pk__lt=end)
+        objects = list(chunk)
+        if end is None and len(objects) > self.chunk_size:
+            # the last chunk has grown too large, split it up at the end of the manifest
+            new_starts = [obj.pk for obj in objects[self.chunk_size::self.chunk_size]]
+            manifest = dict(manifest, starts=manifest['starts'] + new_starts)
+            cache.set(self.manifest_key, manifest, self.timeout)
+            bounds = [start] + new_starts
+            for index, chunk_start in enumerate(bounds):
+                chunk_end = bounds[index + 1] if index + 1 < len(bounds) else None
+                cache.set(self._chunk_key(manifest, chunk_start, chunk_end),
+                          objects[index * self.chunk_size:(index + 1) * self.chunk_size], self.timeout)
+        else:
+            cache.set(self._chunk_key(manifest, start, end), objects, self.timeout)
+        return objects
+
+    def __iter__(self):
+        manifest = self.get_manifest()
+        chunks = self._chunks(manifest)
+        for offset in range(0, len(chunks), self.GET_MANY_SIZE):
+            batch = [(chunk, self._chunk_key(manifest, *chunk)) for chunk in chunks[offset:offset + self.GET_MANY_SIZE]]
+            cached = cache.get_many([key for chunk, key in batch])
+            for chunk, key in batch:
+                objects = cached.get(key)
+                if objects is None:
+                    objects = self._load_chunk(manifest, *chunk)
+                yield from objects
+
+    def invalidate(self, pks):
+        """
+        Removes the chunks that contain the given primary keys from the cache, call after objects are saved,
+        created or deleted. When called inside a transaction the chunks are removed again after commit.
+        """
+        pks = list(pks)
+
+        def _invalidate():
+            manifest = cache.get(self.manifest_key)
+            if manifest is None:
+                return
+            chunks = self._chunks(manifest)
+            indexes = {bisect.bisect_right(manifest['starts'], pk) - 1 for pk in pks}
+            cache.delete_many([self._chunk_key(manifest, *chunks[index]) for index in indexes])
+
+        _invalidate()
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(_invalidate)
+
+    def clear(self):
+        cache.delete(self.manifest_key)
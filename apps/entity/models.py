@@ -4,6 +4,8 @@ from cachemodel.utils import generate_cache_key
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
+
+from entity.cache import bump_revision
 from mainsite.utils import generate_entity_uri
 
 
@@ -40,14 +42,23 @@ class _AbstractVersionedEntity(BadgrCacheModel):
         if self.entity_id is None:
             self.entity_id = generate_entity_uri()
 
-        return super(_AbstractVersionedEntity, self).save(*args, **kwargs)
+        result = super(_AbstractVersionedEntity, self).save(*args, **kwargs)
+        self.bump_revision()
+        return result
 
     def publish(self):
         super(_AbstractVersionedEntity, self).publish()
         self.publish_by('entity_id')
 
+    def bump_revision(self):
+        """
+        Invalidates all cached documents that depend on this entity, see entity.cache
+        """
+        bump_revision(self.__class__.__name__, self.pk)
+
     def delete(self, *args, **kwargs):
         self.publish_delete('entity_id')
+        self.bump_revision()
         return super(_AbstractVersionedEntity, self).delete(*args, **kwargs)
 
 
@@ -2,24 +2,29 @@ import cachemodel
 from collections import OrderedDict
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import m2m_changed
 from django.urls import reverse
 
+from entity.cache import bump_revision
 from entity.models import BaseVersionedEntity, EntityUserProvisionmentMixin
+from institution.reports import HierarchyReport
 from mainsite.exceptions import BadgrValidationFieldError, BadgrValidationMultipleFieldError
 from mainsite.models import BaseAuditedModel, ArchiveMixin
-from mainsite.mixins import ImageUrlGetterMixin, DefaultLanguageMixin
+from mainsite.mixins import ImageUrlGetterMixin, ImageDerivativesMixin, DefaultLanguageMixin
 from mainsite.utils import OriginSetting
+from staff.managers import PermissionedManager
 from staff.mixins import PermissionedModelMixin
 from staff.models import FacultyStaff, InstitutionStaff
 
 
 class Institution(EntityUserProvisionmentMixin, PermissionedModelMixin,
-                  ImageUrlGetterMixin, BaseVersionedEntity, BaseAuditedModel):
+                  ImageUrlGetterMixin, ImageDerivativesMixin, BaseVersionedEntity, BaseAuditedModel):
     
     def __str__(self):
         return self.name or ''
 
     DUTCH_NAME = "instelling"
+    derivative_image_fields = ('image_english', 'image_dutch')
 
     identifier = models.CharField(max_length=255, unique=True, null=True, help_text="This is the schac_home, must be set when creating")
     name_english = models.CharField(max_length=255, blank=True, null=True, default=None)
@@ -36,6 +41,8 @@ class Institution(EntityUserProvisionmentMixin, PermissionedModelMixin,
                                                         help_text='Allow awards to this institutions')
     award_allow_all_institutions = models.BooleanField(default=False, help_text='Allow awards to all institutions')
 
+    objects = PermissionedManager()
+
 
     GRONDSLAG_UITVOERING_OVEREENKOMST = 'uitvoering_overeenkomst'
     GRONDSLAG_GERECHTVAARDIGD_BELANG = 'gerechtvaardigd_belang'
@@ -67,33 +74,17 @@ class Institution(EntityUserProvisionmentMixin, PermissionedModelMixin,
     default_language = models.CharField(max_length=254, choices=DEFAULT_LANGUAGE_CHOICES, default=DEFAULT_LANGUAGE_DUTCH)
 
     def get_report(self):
-        total_assertions_formal = 0
-        total_assertions_informal = 0
-        total_assertions_revoked = 0
-        total_enrollments = 0
-        unique_recipients = set()
-        for badgeclass in self.cached_badgeclasses():
-            for assertion in badgeclass.cached_assertions():
-                if badgeclass.formal:
-                    total_assertions_formal += 1
-                else:
-                    total_assertions_informal += 1
-                if assertion.revoked:
-                    total_assertions_revoked += 1
-                unique_recipients.add(assertion.user)
-            total_enrollments += badgeclass.cached_enrollments().__len__()
-        return {'name': self.name,
-                'type': self.__class__.__name__.capitalize(),
-                'id': self.pk,
-                'total_badgeclasss': self.cached_badgeclasses().__len__(),
-                'total_issuers': self.cached_issuers().__len__(),
-                'total_faculties': self.cached_faculties().__len__(),
-                'total_enrollments': total_enrollments,
-                'total_recipients': unique_recipients.__len__(),
-                'total_admins': [staff for staff in self.cached_staff() if staff.permissions == staff.full_permissions()].__len__(),
-                'total_assertions_formal': total_assertions_formal,
-                'total_assertions_informal': total_assertions_informal,
-                'total_assertions_revoked': total_assertions_revoked}
+        return HierarchyReport(self).get_report(self)
+
+    def get_stats(self):
+        """
+        Returns the summed BadgeClassStats counters of the badgeclasses of this institution
+        """
+        from issuer.models import BadgeClassStats
+        return BadgeClassStats.objects.rollup(badgeclass__issuer__faculty__institution=self,
+                                              badgeclass__issuer__faculty__archived=False,
+                                              badgeclass__issuer__archived=False,
+                                              badgeclass__archived=False)
 
     @property
     def name(self):
@@ -116,7 +107,10 @@ class Institution(EntityUserProvisionmentMixin, PermissionedModelMixin,
 
     def save(self, *args, **kwargs):
         self.validate_unique()
-        return super(Institution, self).save(*args, **kwargs)
+        result = super(Institution, self).save(*args, **kwargs)
+        # documents listing the names of other institutions depend on all institutions
+        bump_revision(self.__class__.__name__, '*')
+        return result
 
     def validate_unique(self, exclude=None):
         if self.name_dutch and self.name_english:
@@ -157,10 +151,12 @@ class Institution(EntityUserProvisionmentMixin, PermissionedModelMixin,
         """return all assertions, also assertions belonging to archived entities
         this is used to check if an entity can be archived / deleted
         """
-        assertions = []
+        return list(self.iter_assertions())
+
+    def iter_assertions(self):
+        """lazily generates all assertions, also assertions belonging to archived entities"""
         for faculty in self.faculty_set.all():
-            assertions += faculty.assertions
-        return assertions
+            yield from faculty.iter_assertions()
 
     @cachemodel.cached_method(auto_publish=True)
     def cached_staff(self):
@@ -246,6 +242,8 @@ class Faculty(EntityUserProvisionmentMixin,
     description_english = models.TextField(blank=True, null=True, default=None)
     description_dutch = models.TextField(blank=True, null=True, default=None)
 
+    objects = PermissionedManager()
+
     @property
     def name(self):
         return self.return_value_according_to_language(self.name_english, self.name_dutch)
@@ -255,31 +253,16 @@ class Faculty(EntityUserProvisionmentMixin,
         return self.return_value_according_to_language(self.description_english, self.description_dutch)
 
     def get_report(self):
-        total_assertions_formal = 0
-        total_assertions_informal = 0
-        total_assertions_revoked = 0
-        total_enrollments = 0
-        unique_recipients = set()
-        for badgeclass in self.cached_badgeclasses():
-            for assertion in badgeclass.cached_assertions():
-                if badgeclass.formal:
-                    total_assertions_formal += 1
-                else:
-                    total_assertions_informal += 1
-                if assertion.revoked:
-                    total_assertions_revoked += 1
-                unique_recipients.add(assertion.user)
-            total_enrollments += badgeclass.cached_enrollments().__len__()
-        return {'name': self.name,
-                'type': self.__class__.__name__.capitalize(),
-                'id': self.pk,
-                'total_badgeclasss': self.cached_badgeclasses().__len__(),
-                'total_issuers': self.cached_issuers().__len__(),
-                'total_enrollments': total_enrollments,
-                'total_recipients': unique_recipients.__len__(),
-                'total_assertions_formal': total_assertions_formal,
-                'total_assertions_informal': total_assertions_informal,
-                'total_assertions_revoked': total_assertions_revoked}
+        return HierarchyReport(self).get_report(self)
+
+    def get_stats(self):
+        """
+        Returns the summed BadgeClassStats counters of the badgeclasses of this faculty
+        """
+        from issuer.models import BadgeClassStats
+        return BadgeClassStats.objects.rollup(badgeclass__issuer__faculty=self,
+                                              badgeclass__issuer__archived=False,
+                                              badgeclass__archived=False)
 
     def validate_unique(self, exclude=None):
         if not self.archived:
@@ -342,10 +325,12 @@ class Faculty(EntityUserProvisionmentMixin,
         """return all assertions, also assertions belonging to archived entities
         this is used to check if an entity can be archived / deleted
         """
-        assertions = []
+        return list(self.iter_assertions())
+
+    def iter_assertions(self):
+        """lazily generates all assertions, also assertions belonging to archived entities"""
         for issuer in self.issuer_set.all():
-            assertions += issuer.assertions
-        return assertions
+            yield from issuer.iter_assertions()
 
     @cachemodel.cached_method(auto_publish=True)
     def cached_staff(self):
@@ -370,3 +355,11 @@ class Faculty(EntityUserProvisionmentMixin,
             if badgeclasses:
                 r += badgeclasses
         return r
+
+
+def award_allowed_institutions_changed(sender, instance, **kwargs):
+    if kwargs['action'] in ('post_add', 'post_remove', 'post_clear'):
+        bump_revision(Institution.__name__, '*')
+
+
+m2m_changed.connect(award_allowed_institutions_changed, sender=Institution.award_allowed_institutions.through)
@@ -0,0 +1,211 @@
+# encoding: utf-8
+import csv
+import json
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.db import connections
+from django.db.models import Count, Q
+
+LEVELS = ('Institution', 'Faculty', 'Issuer', 'BadgeClass')
+
+# lookup path from a model to its ancestor on each level of the hierarchy
+PATHS = {
+    'BadgeClass': {'Institution': 'issuer__faculty__institution',
+                   'Faculty': 'issuer__faculty',
+                   'Issuer': 'issuer',
+                   'BadgeClass': ''},
+    'Issuer': {'Institution': 'faculty__institution',
+               'Faculty': 'faculty',
+               'Issuer': ''},
+    'Faculty': {'Institution': 'institution',
+                'Faculty': ''},
+}
+
+
+# columns of the application report, in the order pandas used to write them
+REPORT_FIELDS = ('institution', 'name', 'type', 'id', 'total_badgeclasss', 'total_issuers', 'total_faculties',
+                 'total_enrollments', 'total_recipients', 'total_admins', 'total_assertions_formal',
+                 'total_assertions_informal', 'total_assertions_revoked', 'total_badgeclasses')
+REPORT_FORMATS = ('csv', 'ndjson')
+
+
+def _path(*parts):
+    return '__'.join(part for part in parts if part)
+
+
+class HierarchyReport(object):
+    """
+    Computes the get_report dictionaries of all entities under root (or of all institutions if root is None)
+    with a fixed number of aggregate queries, regardless of the number of entities and assertions.
+    Like the cached_* methods the reports only include non archived faculties, issuers and badgeclasses
+    below the entity that is reported on.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.root_level = root.__class__.__name__ if root is not None else None
+        self.levels = LEVELS[LEVELS.index(self.root_level):] if root is not None else LEVELS
+        self.counts = defaultdict(lambda: defaultdict(int))
+        self._build()
+
+    def _filter(self, model_name, prefix=''):
+        """
+        Returns the filter kwargs that limit model_name (or the model_name at prefix) to the tree under root
+        """
+        kwargs = {}
+        below_root = self.root is None
+        for level, path in PATHS[model_name].items():
+            if level == self.root_level:
+                kwargs[_path(prefix, path, 'pk')] = self.root.pk
+                below_root = True
+            elif below_root and level != 'Institution':
+                kwargs[_path(prefix, path, 'archived')] = False
+        return kwargs
+
+    def _add(self, ancestors, name, value):
+        for level in self.levels:
+            self.counts[(level, ancestors[level])][name] += value
+
+    def _build(self):
+        BadgeClass = apps.get_model('issuer', 'BadgeClass')
+        BadgeInstance = apps.get_model('issuer', 'BadgeInstance')
+        StudentsEnrolled = apps.get_model('lti_edu', 'StudentsEnrolled')
+
+        badgeclasses = {}
+        for row in BadgeClass.objects.filter(**self._filter('BadgeClass')) \
+                .values('pk', 'formal', *[PATHS['BadgeClass'][level] for level in LEVELS[:-1]]):
+            ancestors = {level: row[PATHS['BadgeClass'][level] or 'pk'] for level in LEVELS}
+            badgeclasses[row['pk']] = (row['formal'], ancestors)
+            self._add(ancestors, 'badgeclasses', 1)
+
+        assertions = BadgeInstance.objects.filter(**self._filter('BadgeClass', prefix='badgeclass'))
+        for row in assertions.values('badgeclass').annotate(total=Count('pk'),
+                                                            revoked=Count('pk', filter=Q(revoked=True))):
+            formal, ancestors = badgeclasses[row['badgeclass']]
+            self._add(ancestors, 'assertions_formal' if formal else 'assertions_informal', row['total'])
+            self._add(ancestors, 'assertions_revoked', row['revoked'])
+
+        for level in self.levels:
+            group_by = _path('badgeclass', PATHS['BadgeClass'][level])
+            for row in assertions.values(group_by).annotate(recipients=Count('user', distinct=True)):
+                self.counts[(level, row[group_by])]['recipients'] = row['recipients']
+
+        enrollments = StudentsEnrolled.objects.filter(**self._filter('BadgeClass', prefix='badge_class'))
+        for row in enrollments.values('badge_class').annotate(total=Count('pk')):
+            self._add(badgeclasses[row['badge_class']][1], 'enrollments', row['total'])
+
+        if 'Faculty' in self.levels:
+            Issuer = apps.get_model('issuer', 'Issuer')
+            for row in Issuer.objects.filter(**self._filter('Issuer')).values('faculty', 'faculty__institution'):
+                self.counts[('Faculty', row['faculty'])]['issuers'] += 1
+                if 'Institution' in self.levels:
+                    self.counts[('Institution', row['faculty__institution'])]['issuers'] += 1
+
+        if 'Institution' in self.levels:
+            Faculty = apps.get_model('institution', 'Faculty')
+            InstitutionStaff = apps.get_model('staff', 'InstitutionStaff')
+            for row in Faculty.objects.filter(**self._filter('Faculty')).values('institution') \
+                    .annotate(total=Count('pk')):
+                self.counts[('Institution', row['institution'])]['faculties'] = row['total']
+            admins = InstitutionStaff.objects.filter(**InstitutionStaff.full_permissions())
+            if self.root is not None:
+                admins = admins.filter(institution=self.root)
+            for row in admins.values('institution').annotate(total=Count('pk')):
+                self.counts[('Institution', row['institution'])]['admins'] = row['total']
+
+    def get_report(self, entity):
+        """
+        Returns the report of an entity under root, with the keys the get_report methods have always returned
+        """
+        level = entity.__class__.__name__
+        counts = self.counts[(level, entity.pk)]
+        report = {'name': entity.name,
+                  'type': level.capitalize(),
+                  'id': entity.pk}
+        if level == 'Issuer':
+            report['total_badgeclasses'] = counts['badgeclasses']
+        elif level in ('Faculty', 'Institution'):
+            report['total_badgeclasss'] = counts['badgeclasses']
+            report['total_issuers'] = counts['issuers']
+        if level == 'Institution':
+            report['total_faculties'] = counts['faculties']
+        report['total_enrollments'] = counts['enrollments']
+        report['total_recipients'] = counts['recipients']
+        if level == 'Institution':
+            report['total_admins'] = counts['admins']
+        report['total_assertions_formal'] = counts['assertions_formal']
+        report['total_assertions_informal'] = counts['assertions_informal']
+        report['total_assertions_revoked'] = counts['assertions_revoked']
+        return report
+
+
+def _institution_rows(institution, close_connection=False):
+    """
+    Returns the report rows of all entities in the branch of an institution
+    :param close_connection: close the database connection of the current thread when done
+    """
+    try:
+        hierarchy_report = HierarchyReport(institution)
+        rows = []
+        for entity in institution.get_all_entities_in_branch():
+            row = {'institution': institution.name}
+            row.update(hierarchy_report.get_report(entity))
+            rows.append(row)
+        return rows
+    finally:
+        if close_connection:
+            connections.close_all()
+
+
+def iter_report_rows(institutions, workers=1):
+    """
+    Generates the rows of the application report one institution at a time.
+    With more than one worker the institutions are reported on in a thread pool, at most twice the number of
+    workers ahead of the consumer, and the rows are still generated in the order of institutions.
+    """
+    if workers <= 1:
+        for institution in institutions:
+            yield from _institution_rows(institution)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for institution in institutions:
+            # every worker thread opens its own database connection
+            pending.append(executor.submit(_institution_rows, institution, close_connection=True))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def write_report(rows, file, report_format='csv'):
+    """
+    Writes report rows to a text file as they are generated
+    :return: the number of rows written
+    """
+    if report_format not in REPORT_FORMATS:
+        raise ValueError('Unknown report format {}'.format(report_format))
+    count = 0
+    if report_format == 'csv':
+        writer = csv.DictWriter(file, fieldnames=REPORT_FIELDS, restval='')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            file.write(json.dumps(row))
+            file.write('\n')
+            count += 1
+    return count
+
+
+def report_dataframe(rows):
+    """
+    Returns the report rows as a pandas DataFrame, pandas is only imported when this is used
+    """
+    import pandas
+    return pandas.DataFrame.from_records(rows, columns=REPORT_FIELDS)
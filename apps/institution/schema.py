@@ -1,11 +1,14 @@
 import graphene
 from graphene_django.types import DjangoObjectType
 
+from issuer.models import Issuer
 from issuer.schema import IssuerType
+from mainsite.graphql_loaders import get_loaders, foreign_key_resolver
 from mainsite.graphql_utils import UserProvisionmentResolverMixin, ContentTypeIdResolverMixin, StaffResolverMixin, \
-    ImageResolverMixin, PermissionsResolverMixin, DefaultLanguageResolverMixin
+    ImageResolverMixin, PermissionsResolverMixin, DefaultLanguageResolverMixin, paginate, permitted
 from mainsite.utils import generate_image_url
-from staff.schema import InstitutionStaffType, FacultyStaffType
+from mainsite.graphql_pagination import KeysetConnectionField
+from staff.schema import InstitutionStaffType, FacultyStaffType, InstitutionStaffConnection, FacultyStaffConnection
 from .models import Institution, Faculty
 
 
@@ -22,26 +25,33 @@ class FacultyType(UserProvisionmentResolverMixin, PermissionsResolverMixin, Staf
     pending_enrollment_count = graphene.Int()
     public_issuers = graphene.List(IssuerType)
     staff = graphene.List(FacultyStaffType)
+    staff_paginated = KeysetConnectionField(FacultyStaffConnection, ordering=('id',))
     name = graphene.String()
     has_unrevoked_assertions = graphene.Boolean()
 
+    # reads all assertions of the faculty, see mainsite.graphql_cost
+    field_costs = {'has_unrevoked_assertions': {'cost': 20}}
+
+    resolve_institution = foreign_key_resolver('institution')
+
     def resolve_name(self, info):
         return self.name
 
     def resolve_issuers(self, info):
-        return self.get_issuers(info.context.user, ['may_read'])
+        return get_loaders(info).load_related(Issuer, 'faculty', self.pk, archived=False) \
+            .then(permitted(info.context.user, ['may_read']))
 
     def resolve_issuer_count(self, info):
-        return self.get_issuers(info.context.user, ['may_read']).__len__()
+        return FacultyType.resolve_issuers(self, info).then(len)
 
     def resolve_pending_enrollment_count(self, info):
-        return self.cached_pending_enrollments().__len__()
+        return self.get_stats()['pending_enrollment_count']
 
     def resolve_public_issuers(self, info):
-        return self.cached_issuers()
+        return get_loaders(info).load_related(Issuer, 'faculty', self.pk, archived=False)
 
     def resolve_has_unrevoked_assertions(self, info):
-        return any([assertion.revoked is False for assertion in self.assertions])
+        return any(assertion.revoked is False for assertion in self.iter_assertions())
 
 
 class InstitutionType(UserProvisionmentResolverMixin, PermissionsResolverMixin, StaffResolverMixin, ImageResolverMixin,
@@ -53,9 +63,10 @@ class InstitutionType(UserProvisionmentResolverMixin, PermissionsResolverMixin,
                   'content_type_id', 'grondslag_formeel', 'grondslag_informeel', 'default_language', 'id',
                   'direct_awarding_enabled', 'award_allow_all_institutions')
 
-    faculties = graphene.List(FacultyType)
+    faculties = graphene.List(FacultyType, first=graphene.Int(), offset=graphene.Int())
     public_faculties = graphene.List(FacultyType)
     staff = graphene.List(InstitutionStaffType)
+    staff_paginated = KeysetConnectionField(InstitutionStaffConnection, ordering=('id',))
     image = graphene.String()
     name = graphene.String()
     award_allowed_institutions = graphene.List(graphene.String)
@@ -73,10 +84,11 @@ class InstitutionType(UserProvisionmentResolverMixin, PermissionsResolverMixin,
         return generate_image_url(self.image)
 
     def resolve_faculties(self, info):
-        return self.get_faculties(info.context.user, ['may_read'])
+        return get_loaders(info).load_related(Faculty, 'institution', self.pk, archived=False) \
+            .then(permitted(info.context.user, ['may_read']))
 
     def resolve_public_faculties(self, info):
-        return self.cached_faculties()
+        return get_loaders(info).load_related(Faculty, 'institution', self.pk, archived=False)
 
     def resolve_award_allowed_institutions(self, info):
         institutions = Institution.objects.all() if self.award_allow_all_institutions else self.award_allowed_institutions.all()
@@ -86,7 +98,7 @@ class InstitutionType(UserProvisionmentResolverMixin, PermissionsResolverMixin,
 class Query(object):
     public_institution = graphene.Field(InstitutionType, id=graphene.String())
     current_institution = graphene.Field(InstitutionType)
-    institutions = graphene.List(InstitutionType)
+    institutions = graphene.List(InstitutionType, first=graphene.Int(), offset=graphene.Int())
     public_institutions = graphene.List(InstitutionType)
     faculties = graphene.List(FacultyType)
     faculty = graphene.Field(FacultyType, id=graphene.String())
@@ -94,8 +106,8 @@ class Query(object):
     def resolve_current_institution(self, info, **kwargs):
         return info.context.user.institution
 
-    def resolve_institutions(self, info, **kwargs):
-        return [inst for inst in Institution.objects.all() if inst.has_permissions(info.context.user, ['may_read'])]
+    def resolve_institutions(self, info, first=None, offset=None, **kwargs):
+        return paginate(Institution.objects.with_permission(info.context.user, 'may_read'), first, offset)
 
     def resolve_public_institution(self, info, **kwargs):
         id = kwargs.get('id')
@@ -106,8 +118,8 @@ class Query(object):
     def resolve_public_institutions(self, info, **kwargs):
         return Institution.objects.all()
 
-    def resolve_faculties(self, info, **kwargs):
-        return [fac for fac in Faculty.objects.all() if fac.has_permissions(info.context.user, ['may_read'])]
+    def resolve_faculties(self, info, first=None, offset=None, **kwargs):
+        return paginate(Faculty.objects.with_permission(info.context.user, 'may_read'), first, offset)
 
     def resolve_faculty(self, info, **kwargs):
         id = kwargs.get('id')
@@ -1,10 +1,17 @@
+import gzip
 import json
+import os
+import tempfile
+
+from django.core.management import call_command
 from django.db import IntegrityError
 
 from institution.models import Institution
+from institution.reports import HierarchyReport
 from institution.testfiles.helper import faculty_json, institution_json
 from mainsite.tests import BadgrTestCase
 from mainsite.exceptions import BadgrValidationFieldError, BadgrValidationMultipleFieldError
+from staff.models import InstitutionStaff
 
 
 class InstitutionTest(BadgrTestCase):
@@ -77,6 +84,60 @@ class InstitutionModelsTest(BadgrTestCase):
         self.setup_faculty(**setup_faculty_kwargs)
         faculty.archive()
 
+    def test_get_report(self):
+        teacher1 = self.setup_teacher()
+        self.setup_staff_membership(teacher1, teacher1.institution, **InstitutionStaff.full_permissions())
+        student1 = self.setup_student(affiliated_institutions=[teacher1.institution])
+        student2 = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        self.setup_faculty(institution=teacher1.institution, archived=True)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        self.setup_issuer(faculty=faculty, created_by=teacher1)
+        formal_badgeclass = self.setup_badgeclass(issuer=issuer)
+        formal_badgeclass.formal = True
+        formal_badgeclass.save()
+        informal_badgeclass = self.setup_badgeclass(issuer=issuer)
+        archived_badgeclass = self.setup_badgeclass(issuer=issuer, archived=True)
+        self.setup_assertion(recipient=student1, badgeclass=formal_badgeclass, created_by=teacher1)
+        self.setup_assertion(recipient=student2, badgeclass=formal_badgeclass, created_by=teacher1)
+        assertion = self.setup_assertion(recipient=student1, badgeclass=informal_badgeclass, created_by=teacher1)
+        assertion.revoke('revocation reason')
+        self.setup_assertion(recipient=student1, badgeclass=archived_badgeclass, created_by=teacher1)
+        self.enroll_user(student2, informal_badgeclass)
+        institution_report = teacher1.institution.get_report()
+        self.assertEqual(institution_report['total_faculties'], 1)
+        self.assertEqual(institution_report['total_issuers'], 2)
+        self.assertEqual(institution_report['total_badgeclasss'], 2)
+        self.assertEqual(institution_report['total_admins'], 1)
+        self.assertEqual(institution_report['total_recipients'], 2)
+        self.assertEqual(institution_report['total_enrollments'], 1)
+        self.assertEqual(institution_report['total_assertions_formal'], 2)
+        self.assertEqual(institution_report['total_assertions_informal'], 1)
+        self.assertEqual(institution_report['total_assertions_revoked'], 1)
+        self.assertEqual(faculty.get_report()['total_issuers'], 2)
+        self.assertEqual(issuer.get_report()['total_badgeclasses'], 2)
+        badgeclass_report = informal_badgeclass.get_report()
+        self.assertEqual(badgeclass_report['total_recipients'], 1)
+        self.assertEqual(badgeclass_report['total_enrollments'], 1)
+        self.assertEqual(archived_badgeclass.get_report()['total_assertions_informal'], 1)
+        hierarchy_report = HierarchyReport()
+        for entity in teacher1.institution.get_all_entities_in_branch():
+            self.assertEqual(hierarchy_report.get_report(entity), entity.get_report())
+
+    def test_send_app_report(self):
+        teacher1 = self.setup_teacher()
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        self.setup_badgeclass(issuer=issuer)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'report.ndjson.gz')
+            call_command('send_app_report', format='ndjson', gzip=True, output=output, no_email=True, workers=2)
+            with gzip.open(output, 'rt', encoding='utf-8') as report_file:
+                rows = [json.loads(line) for line in report_file]
+        branch_rows = [row for row in rows if row['institution'] == teacher1.institution.name]
+        self.assertEqual([row['type'] for row in branch_rows], ['Institution', 'Faculty', 'Issuer', 'Badgeclass'])
+        self.assertEqual(branch_rows[2]['total_badgeclasses'], 1)
+
     def test_institution_uniquenss_constraint(self):
         setup_institution_kwargs = {'name_english': 'same'}
         self.setup_institution(**setup_institution_kwargs)
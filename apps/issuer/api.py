@@ -9,7 +9,7 @@ from entity.api import BaseEntityListView, BaseEntityDetailView, VersionedObject
 from issuer.models import Issuer, BadgeClass, BadgeInstance
 from issuer.permissions import AwardedAssertionsBlock
 from issuer.serializers import IssuerSerializer, BadgeClassSerializer, BadgeInstanceSerializer
-from mainsite.exceptions import BadgrApiException400, BadgrValidationFieldError
+from mainsite.exceptions import BadgrApiException400, BadgrValidationError, BadgrValidationFieldError
 from mainsite.permissions import AuthenticatedWithVerifiedEmail
 from signing import tsob
 from signing.models import AssertionTimeStamp
@@ -130,11 +130,10 @@ class BatchSignAssertions(BaseEntityListView):
             if len(matching_assertion) > 1:
                 raise ValidationError('Signing failed: Signed json could not be matched to a BadgeInstance')
             matching_assertion = matching_assertion[0]
-            matching_assertion.rebake(signature=signature, replace_image=True, save=False)
             matching_assertion.signature = signature
             matching_assertion.public_key_issuer.public_key = private_key.public_key
             matching_assertion.public_key_issuer.save()
-            matching_assertion.save()
+            matching_assertion.rebake(replace_image=True)
             AssertionTimeStamp.objects.get(badge_instance=matching_assertion).delete()
             # matching_assertion.notify_earner(attach_image=True)
             successful_assertions.append(matching_assertion)
@@ -173,7 +172,6 @@ class BatchAwardEnrollments(VersionedObjectMixin, BaseEntityView):
         # Clear cache for the enrollments of this badgeclass
         badgeclass.remove_cached_data(['cached_pending_enrollments'])
         badgeclass.remove_cached_data(['cached_pending_enrollments_including_denied'])
-        badgeclass.remove_cached_data(['cached_assertions'])
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
@@ -192,10 +190,16 @@ class BadgeInstanceRevoke(BaseEntityDetailView):
         assertions = request.data.get('assertions', None)
         if not assertions:
             raise BadgrValidationFieldError('assertions', "This field is required", 999)
-        for assertion in assertions:
-            badgeinstance = BadgeInstance.objects.get(entity_id=assertion['entity_id'])
-            if badgeinstance.get_permissions(request.user)['may_award']:
-                badgeinstance.revoke(revocation_reason)
-            else:
+        entity_ids = {assertion['entity_id'] for assertion in assertions}
+        badgeinstances = list(BadgeInstance.objects.select_related('badgeclass', 'user')
+                              .filter(entity_id__in=entity_ids))
+        if len(badgeinstances) != len(entity_ids):
+            raise BadgeInstance.DoesNotExist('BadgeInstance matching query does not exist.')
+        badgeclasses = {badgeinstance.badgeclass_id: badgeinstance.badgeclass for badgeinstance in badgeinstances}
+        for badgeclass in badgeclasses.values():
+            if not badgeclass.get_permissions(request.user)['may_award']:
                 raise BadgrApiException400("You do not have permission", 100)
+        if any(badgeinstance.revoked for badgeinstance in badgeinstances):
+            raise BadgrValidationError("Assertion is already revoked", 999)
+        BadgeInstance.objects.revoke_many(badgeinstances, revocation_reason)
         return Response({"result":"ok"}, status=status.HTTP_200_OK)
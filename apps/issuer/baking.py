@@ -0,0 +1,125 @@
+"""
+Front-end for openbadges_bakery that keeps the decoded image of a badgeclass in memory.
+
+All assertions of a badgeclass are baked into the same image, so the image is read from storage and split
+once, after which baking an assertion only splices the iTXt chunk (PNG) or openbadges:assertion element (SVG)
+into the cached parts. The output is byte for byte what openbadges_bakery.bake produces.
+"""
+import hashlib
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from xml.dom.minidom import Document, parseString
+
+from django.conf import settings
+from openbadges_bakery.svg_bakery import _populate_assertion_node
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_ASSERTION_CHUNK_HEADER = b'openbadges\x00\x00\x00\x00\x00'
+SVG_ASSERTION_PLACEHOLDER = '<!--openbadges-assertion-->'
+
+
+class PngTemplate(object):
+
+    def __init__(self, data):
+        head, tail = [], []
+        position = len(PNG_SIGNATURE)
+        while position < len(data):
+            length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+            end = position + 12 + length
+            chunk = data[position:end]
+            if not head:
+                head.append(chunk)
+            elif not data[position + 8:end - 4].startswith(b'openbadges\x00'):
+                # leave out previously baked assertions
+                tail.append(chunk)
+            position = end
+            if chunk_type == b'IEND':
+                break
+        self.head = PNG_SIGNATURE + b''.join(head)
+        self.tail = b''.join(tail)
+
+    def bake(self, assertion_string):
+        chunk_type = b'iTXt'
+        chunk_data = PNG_ASSERTION_CHUNK_HEADER + assertion_string.encode('utf-8')
+        chunk = struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data + \
+            struct.pack('>I', zlib.crc32(chunk_type + chunk_data) & 0xffffffff)
+        return self.head + chunk + self.tail
+
+
+class SvgTemplate(object):
+
+    def __init__(self, data):
+        svg_doc = parseString(data)
+        svg_body = svg_doc.getElementsByTagName('svg')[0]
+        svg_body.setAttribute('xmlns:openbadges', "http://openbadges.org")
+        svg_body.insertBefore(svg_doc.createComment(SVG_ASSERTION_PLACEHOLDER[4:-3]), svg_body.firstChild)
+        self.head, self.tail = svg_doc.toxml('utf-8').split(SVG_ASSERTION_PLACEHOLDER.encode('utf-8'), 1)
+
+    def bake(self, assertion_string):
+        document = Document()
+        assertion_node = _populate_assertion_node(document.createElement('openbadges:assertion'), assertion_string,
+                                                  document)
+        return self.head + assertion_node.toxml().encode('utf-8') + self.tail
+
+
+def create_template(data):
+    if data[:len(PNG_SIGNATURE)] == PNG_SIGNATURE:
+        return PngTemplate(data)
+    if re.search(b'<svg', data[:256]):
+        return SvgTemplate(data)
+    raise ValueError('Only PNG and SVG images can be baked')
+
+
+class TemplateCache(object):
+    """
+    LRU cache of image templates keyed by image name and content hash
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.templates = OrderedDict()
+        self.content_hashes = {}
+        self.lock = threading.Lock()
+
+    def get(self, image):
+        """
+        :param image: FieldFile of the image to bake into, stored images are never overwritten so the content hash
+                      of a name only has to be established once
+        """
+        with self.lock:
+            key = (image.name, self.content_hashes.get(image.name))
+            if key in self.templates:
+                self.templates.move_to_end(key)
+                return self.templates[key]
+
+        image.open('rb')
+        try:
+            data = image.read()
+        finally:
+            image.close()
+        content_hash = hashlib.sha256(data).hexdigest()
+        template = create_template(data)
+
+        with self.lock:
+            key = (image.name, content_hash)
+            self.content_hashes[image.name] = content_hash
+            self.templates[key] = template
+            self.templates.move_to_end(key)
+            while len(self.templates) > self.max_size:
+                (name, _), _ = self.templates.popitem(last=False)
+                self.content_hashes.pop(name, None)
+        return template
+
+
+template_cache = TemplateCache(getattr(settings, 'BAKERY_TEMPLATE_CACHE_SIZE', 32))
+
+
+def bake(image, assertion_string):
+    """
+    Returns the bytes of image with assertion_string baked into it
+    :param image: FieldFile of the badgeclass image
+    """
+    return template_cache.get(image).bake(assertion_string)
@@ -5,11 +5,13 @@ import uuid
 from collections import MutableMapping
 
 import openbadges
+import openbadges_bakery
 from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import transaction
 from issuer.models import Issuer, BadgeClass, BadgeInstance
+from issuer.verification import resolve_local_assertion, verify_assertion
 from mainsite.utils import first_node_match
 from requests_cache.backends import BaseCache
 
@@ -106,7 +108,7 @@ class BadgeCheckHelper(object):
             'name': "VERIFY_SIGNATURE",
             "description": "Could not verify signature",
         }),
-        (['VERIFY_SIGNED_ASSERTION_NOT_REVOKED'], {
+        (['VERIFY_SIGNED_ASSERTION_NOT_REVOKED', 'VERIFY_HOSTED_ASSERTION_NOT_REVOKED'], {
             'name': "ASSERTION_REVOKED",
             "description": "This assertion has been revoked",
         }),
@@ -155,6 +157,14 @@ class BadgeCheckHelper(object):
         else:
             badgecheck_recipient_profile = None
 
+        local_instance = cls.get_local_assertion(query)
+        if local_instance is not None:
+            # hosted by this server, verified in process instead of fetched over HTTP
+            report = verify_assertion(local_instance, recipient_profile=badgecheck_recipient_profile)['report']
+            if not report['valid']:
+                raise ValidationError(list(cls.translate_errors(report['messages'])))
+            return local_instance, False
+
         try:
             response = openbadges.verify(query, recipient_profile=badgecheck_recipient_profile, **cls.badgecheck_options())
         except ValueError as e:
@@ -211,6 +221,18 @@ class BadgeCheckHelper(object):
             badgeclass, badgeclass_created = BadgeClass.objects.get_or_create_from_ob2(issuer, badgeclass_obo, original_json=original_json.get(badgeclass_obo.get('id')))
             return BadgeInstance.objects.get_or_create_from_ob2(badgeclass, assertion_obo, recipient_identifier=recipient_identifier, original_json=original_json.get(assertion_obo.get('id')))
 
+    @classmethod
+    def get_local_assertion(cls, query):
+        """:return: the BadgeInstance hosted by this server the url, baked image or assertion refers to, or None"""
+        if hasattr(query, 'read'):
+            imagefile = query
+            try:
+                query = openbadges_bakery.unbake(imagefile)
+            except Exception:
+                query = None
+            imagefile.seek(0)  # read again by openbadges.verify when the assertion is not local
+        return resolve_local_assertion(query) if query else None
+
     @classmethod
     def get_assertion_obo(cls, badge_instance):
         try:
@@ -0,0 +1,15 @@
+# encoding: utf-8
+from django.core.management import BaseCommand
+
+from issuer.models import BadgeInstance
+
+
+class Command(BaseCommand):
+    """Stores the hashed recipient identity of the assertions that were awarded before it was persisted."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of assertions updated per query')
+
+    def handle(self, *args, **options):
+        updated = BadgeInstance.objects.backfill_recipient_hashes(chunk_size=options['chunk_size'])
+        self.stdout.write("Stored the recipient hash of {} assertions".format(updated))
@@ -0,0 +1,19 @@
+# encoding: utf-8
+from django.core.management import BaseCommand
+
+from issuer.models import BadgeClass, BadgeClassStats
+
+
+class Command(BaseCommand):
+    """Recounts the BadgeClassStats of all or the given badgeclasses and repairs any drift."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('badgeclass_entity_ids', nargs='*', help='Only rebuild the stats of these badgeclasses')
+
+    def handle(self, *args, **options):
+        badgeclass_ids = None
+        if options['badgeclass_entity_ids']:
+            badgeclass_ids = list(BadgeClass.objects.filter(entity_id__in=options['badgeclass_entity_ids'])
+                                  .values_list('pk', flat=True))
+        repaired = BadgeClassStats.objects.rebuild(badgeclass_ids)
+        self.stdout.write("Repaired the stats of {} badgeclasses".format(repaired))
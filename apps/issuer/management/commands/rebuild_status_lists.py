@@ -0,0 +1,22 @@
+# encoding: utf-8
+from django.core.management import BaseCommand
+
+from issuer.models import Issuer, IssuerStatusList
+
+
+class Command(BaseCommand):
+    """
+    Hands out status indexes to the assertions that were awarded before the revocation status lists existed and
+    rebuilds the status lists of all or the given issuers.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('issuer_entity_ids', nargs='*', help='Only rebuild the status lists of these issuers')
+
+    def handle(self, *args, **options):
+        issuer_ids = None
+        if options['issuer_entity_ids']:
+            issuer_ids = list(Issuer.objects.filter(entity_id__in=options['issuer_entity_ids'])
+                              .values_list('pk', flat=True))
+        repaired = IssuerStatusList.objects.rebuild(issuer_ids)
+        self.stdout.write("Repaired the status lists of {} issuers".format(repaired))
@@ -1,12 +1,22 @@
 # encoding: utf-8
 import json
 import urllib.parse
+from collections import defaultdict
+
 import dateutil.parser
+from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.files.storage import DefaultStorage
 from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum
 from django.urls import resolve, Resolver404
-from mainsite.utils import fetch_remote_file_to_storage, list_of, OriginSetting
+from django.utils import timezone
+from mainsite.utils import fetch_remote_file_to_storage, list_of, OriginSetting, schedule_task_on_commit, batched
+from staff.managers import PermissionedManagerMixin
+
+BULK_BATCH_SIZE = 500
 
 
 def resolve_source_url_referencing_local_object(source_url):
@@ -28,7 +38,7 @@ class BaseOpenBadgeObjectManager(models.Manager):
                 return None
 
 
-class IssuerManager(BaseOpenBadgeObjectManager):
+class IssuerManager(PermissionedManagerMixin, BaseOpenBadgeObjectManager):
 
     @transaction.atomic
     def get_or_create_from_ob2(self, issuer_obo, source=None, original_json=None):
@@ -57,7 +67,7 @@ class IssuerManager(BaseOpenBadgeObjectManager):
         )
 
 
-class BadgeClassManager(BaseOpenBadgeObjectManager):
+class BadgeClassManager(PermissionedManagerMixin, BaseOpenBadgeObjectManager):
 
     @transaction.atomic
     def create(self, **kwargs):
@@ -205,6 +215,370 @@ class BadgeInstanceManager(BaseOpenBadgeObjectManager):
 
         return new_instance
 
+    def create_many(self, badgeclass, awards, allow_uppercase=False, **kwargs):
+        """
+        Bulk version of create(), awards the badgeclass once for every item in awards
+        :param awards: list of dicts with the recipient_identifier, the optional evidence and extensions and any other
+                       BadgeInstance field for that specific award
+        :param kwargs: BadgeInstance fields shared by all awards
+        :return: the new BadgeInstances with their evidence and extensions saved, in the order of awards
+        """
+        from issuer.models import BadgeClassStats, BadgeInstanceEvidence, BadgeInstanceExtension, IssuerStatusList
+        issuer = kwargs.pop('issuer', badgeclass.issuer)
+        new_instances, evidence_items, extension_items = [], [], []
+        for award in awards:
+            values = dict(kwargs, **award)
+            evidence_items.append(values.pop('evidence', None) or [])
+            extension_items.append(values.pop('extensions', None) or {})
+            recipient_identifier = values.pop('recipient_identifier')
+            if not values.pop('allow_uppercase', allow_uppercase):
+                recipient_identifier = recipient_identifier.lower()
+            new_instance = self.model(
+                public=False,
+                recipient_identifier=recipient_identifier,
+                badgeclass=badgeclass,
+                issuer=issuer,
+                **values
+            )
+            new_instance.prepare_new()
+            if not new_instance.image:
+                new_instance.bake_status = self.model.BAKE_STATUS_PENDING
+            new_instances.append(new_instance)
+
+        with transaction.atomic():
+            user_ids = {new_instance.user_id for new_instance in new_instances} - {None}
+            existing_user_ids = set(self.filter(badgeclass=badgeclass, user_id__in=user_ids)
+                                    .values_list('user_id', flat=True).distinct())
+            hosted_instances = [new_instance for new_instance in new_instances if not new_instance.source_url]
+            if hosted_instances:
+                start = IssuerStatusList.objects.allocate(issuer.pk, len(hosted_instances))
+                for offset, new_instance in enumerate(hosted_instances):
+                    new_instance.status_index = start + offset
+                IssuerStatusList.objects.set_revoked(issuer.pk, [i.status_index for i in hosted_instances if i.revoked])
+            self.bulk_create(new_instances, batch_size=BULK_BATCH_SIZE)
+            # not all databases return the primary keys of bulk inserted rows
+            pks = dict(self.filter(entity_id__in=[i.entity_id for i in new_instances]).values_list('entity_id', 'pk'))
+            for new_instance in new_instances:
+                new_instance.pk = pks[new_instance.entity_id]
+
+            BadgeInstanceEvidence.objects.bulk_create([
+                BadgeInstanceEvidence(badgeinstance=new_instance,
+                                      evidence_url=evidence_obj.get('evidence_url'),
+                                      narrative=evidence_obj.get('narrative'),
+                                      name=evidence_obj.get('name'),
+                                      description=evidence_obj.get('description'))
+                for new_instance, evidence in zip(new_instances, evidence_items) for evidence_obj in evidence
+            ], batch_size=BULK_BATCH_SIZE)
+            BadgeInstanceExtension.objects.bulk_create([
+                BadgeInstanceExtension(badgeinstance=new_instance, name=name, original_json=json.dumps(ext))
+                for new_instance, extensions in zip(new_instances, extension_items)
+                for name, ext in list(extensions.items())
+            ], batch_size=BULK_BATCH_SIZE)
+
+            BadgeClassStats.objects.add(
+                badgeclass.pk,
+                assertion_count=len(new_instances),
+                revoked_count=sum(1 for i in new_instances if i.revoked),
+                accepted_count=sum(1 for i in new_instances
+                                   if not i.revoked and i.acceptance == self.model.ACCEPTANCE_ACCEPTED),
+                recipient_count=len(user_ids - existing_user_ids))
+            _add_email_variants(new_instances)
+            badgeclass.assertions_cache.invalidate([i.pk for i in new_instances])
+            self.schedule_bake([i for i in new_instances if i.bake_status == self.model.BAKE_STATUS_PENDING])
+        return new_instances
+
+    def revoke_many(self, instances, revocation_reason):
+        """
+        Bulk version of BadgeInstance.revoke(): revokes the assertions with a single UPDATE and deletes their images
+        in the background, the caches are invalidated once per badgeclass and recipient
+        :param instances: BadgeInstances, all not revoked
+        """
+        from issuer.models import BadgeClassStats, IssuerStatusList
+        from entity.cache import bump_revisions
+        from issuer.validation import invalidate_validations
+        if not instances:
+            return
+        pks = [instance.pk for instance in instances]
+        image_names = [instance.image.name for instance in instances if instance.image]
+        publish_keys = [instance.publish_key(*fields) for instance in instances
+                        for fields in (('pk',), ('entity_id',), ('entity_id', 'revoked'))]
+        with transaction.atomic():
+            revoked = self.filter(pk__in=pks, revoked=False).update(revoked=True,
+                                                                     revocation_reason=revocation_reason,
+                                                                     image='',
+                                                                     updated_at=timezone.now())
+            if revoked != len(set(pks)):
+                raise ValidationError("Assertion is already revoked")
+
+            instances_by_badgeclass, status_indexes_by_issuer = defaultdict(list), defaultdict(list)
+            for instance in instances:
+                instance.revoked, instance.revocation_reason, instance.image = True, revocation_reason, ''
+                instances_by_badgeclass[instance.badgeclass_id].append(instance)
+                status_indexes_by_issuer[instance.issuer_id].append(instance.status_index)
+            for issuer_id, status_indexes in status_indexes_by_issuer.items():
+                IssuerStatusList.objects.set_revoked(issuer_id, status_indexes)
+            for badgeclass_id, badgeclass_instances in instances_by_badgeclass.items():
+                BadgeClassStats.objects.add(
+                    badgeclass_id,
+                    revoked_count=len(badgeclass_instances),
+                    accepted_count=-sum(1 for i in badgeclass_instances
+                                        if i.acceptance == self.model.ACCEPTANCE_ACCEPTED))
+
+            if apps.is_installed('badgebook'):
+                from badgebook.models import BadgeObjectiveAward
+                BadgeObjectiveAward.objects.filter(badge_instance_id__in=pks).delete()
+
+            bump_revisions([(self.model.__name__, pk) for pk in pks])
+            invalidate_validations(pks)
+            cache.delete_many(publish_keys)
+            for badgeclass_instances in instances_by_badgeclass.values():
+                badgeclass = badgeclass_instances[0].badgeclass
+                badgeclass.assertions_cache.invalidate([instance.pk for instance in badgeclass_instances])
+                badgeclass.publish()
+            recipients = {instance.user_id: instance.user for instance in instances if instance.user_id}
+            for recipient in recipients.values():
+                recipient.remove_cached_data(['cached_badgeinstances'])
+                recipient.publish()
+            self.schedule_image_deletion(image_names)
+
+    def schedule_image_deletion(self, image_names):
+        """
+        Deletes image files from storage in the background once the current transaction is committed
+        """
+        if not image_names:
+            return
+
+        def _schedule():
+            if getattr(settings, 'CELERY_ALWAYS_EAGER', False):
+                storage = DefaultStorage()
+                for name in image_names:
+                    storage.delete(name)
+            else:
+                from issuer.tasks import delete_images
+                batch_size = getattr(settings, 'BAKE_TASK_BATCH_SIZE', 50)
+                for start in range(0, len(image_names), batch_size):
+                    delete_images.delay(image_names[start:start + batch_size])
+
+        transaction.on_commit(_schedule)
+
+    def schedule_bake(self, instances, replace_image=False):
+        """
+        Bakes the images of saved BadgeInstances in the background once the current transaction is committed
+        """
+        from issuer.tasks import bake_assertions
+        batch_size = getattr(settings, 'BAKE_TASK_BATCH_SIZE', 50)
+        schedule_task_on_commit(bake_assertions, [(pks,) for pks in batched([i.pk for i in instances], batch_size)],
+                                replace_image=replace_image)
+
+    def get_by_recipient_hashes(self, recipient_hashes):
+        """
+        Looks up the assertions of hashed recipient identities with one query on the recipient_hash index,
+        e.g. to verify a batch of assertions
+        :return: dict of recipient hash -> BadgeInstance
+        """
+        return {instance.recipient_hash: instance for instance in self.filter(recipient_hash__in=set(recipient_hashes))}
+
+    def backfill_recipient_hashes(self, chunk_size=1000):
+        """
+        Stores the recipient_hash of the assertions that do not have one, a chunk of primary keys at a time
+        :return: the number of assertions updated
+        """
+        updated, last_pk = 0, 0
+        while True:
+            chunk = list(self.filter(pk__gt=last_pk, recipient_hash__isnull=True).order_by('pk')
+                         .only('pk', 'recipient_identifier', 'salt')[:chunk_size])
+            if not chunk:
+                return updated
+            for instance in chunk:
+                instance.recipient_hash = instance.get_hashed_identity()
+            self.bulk_update(chunk, ['recipient_hash'], batch_size=BULK_BATCH_SIZE)
+            updated += len(chunk)
+            last_pk = chunk[-1].pk
+
+
+def _add_email_variants(instances):
+    """
+    Registers the recipient addresses of the assertions as variants of the matching student email address,
+    the bulk equivalent of the lookup in BadgeInstance.save()
+    """
+    from badgeuser.models import CachedEmailAddress
+    email_addresses = {instance.get_email_address() for instance in instances} - {None}
+    if not email_addresses:
+        return
+    student_emails = defaultdict(list)
+    for email in CachedEmailAddress.objects.filter(email__in=email_addresses) \
+            .select_related('user').prefetch_related('emailaddressvariant_set'):
+        if email.user.is_student:
+            student_emails[email.email.lower()].append(email)
+    for email_address in email_addresses:
+        matches = student_emails[email_address.lower()]
+        if len(matches) != 1:
+            continue
+        existing_email = matches[0]
+        if email_address != existing_email.email and \
+                email_address not in [e.email for e in existing_email.emailaddressvariant_set.all()]:
+            existing_email.add_variant(email_address)
+
+
+class BadgeClassStatsManager(models.Manager):
+    use_in_migrations = True
+    ASSERTION_COUNTERS = ('assertion_count', 'revoked_count', 'accepted_count', 'recipient_count')
+    ENROLLMENT_COUNTERS = ('pending_enrollment_count', 'denied_enrollment_count')
+    DIRECT_AWARD_COUNTERS = ('pending_direct_award_count',)
+
+    def add(self, badgeclass_id, **deltas):
+        """
+        Adds the deltas to the counters of a badgeclass with a single UPDATE in the current transaction,
+        the counters are rebuilt if the badgeclass has no stats yet
+        """
+        deltas = {counter: delta for counter, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        updated = self.filter(badgeclass_id=badgeclass_id) \
+            .update(**{counter: F(counter) + delta for counter, delta in deltas.items()})
+        if not updated:
+            self.rebuild([badgeclass_id])
+
+    def rebuild(self, badgeclass_ids=None, assertions=True, enrollments=True, direct_awards=True):
+        """
+        Recounts the counters of the badgeclasses (all when badgeclass_ids is None) from the source tables
+        :return: the number of badgeclasses for which the stored counters were wrong
+        """
+        # resolved through the app registry of the model, so this also works on the models of a migration
+        BadgeClass = self.model._meta.apps.get_model('issuer', 'BadgeClass')
+        BadgeInstance = self.model._meta.apps.get_model('issuer', 'BadgeInstance')
+        DirectAward = self.model._meta.apps.get_model('directaward', 'DirectAward')
+        StudentsEnrolled = self.model._meta.apps.get_model('lti_edu', 'StudentsEnrolled')
+        if badgeclass_ids is None:
+            badgeclass_ids = list(BadgeClass.objects.values_list('pk', flat=True))
+        repaired = 0
+        for start in range(0, len(badgeclass_ids), BULK_BATCH_SIZE):
+            batch = badgeclass_ids[start:start + BULK_BATCH_SIZE]
+            current = {stats['badgeclass_id']: stats for stats in self.filter(badgeclass_id__in=batch).values()}
+            missing = [pk for pk in batch if pk not in current]
+            if missing:
+                self.bulk_create([self.model(badgeclass_id=pk) for pk in missing], ignore_conflicts=True)
+                current.update({stats['badgeclass_id']: stats for stats in self.filter(badgeclass_id__in=missing).values()})
+
+            counters = []
+            counts = defaultdict(dict)
+            if assertions or missing:
+                counters += self.ASSERTION_COUNTERS
+                for row in BadgeInstance.objects.filter(badgeclass_id__in=batch).values('badgeclass_id').annotate(
+                        assertion_count=Count('pk'),
+                        revoked_count=Count('pk', filter=Q(revoked=True)),
+                        accepted_count=Count('pk', filter=Q(revoked=False,
+                                                            acceptance='Accepted')),
+                        recipient_count=Count('user', distinct=True)):
+                    counts[row.pop('badgeclass_id')].update(row)
+            if enrollments or missing:
+                counters += self.ENROLLMENT_COUNTERS
+                for row in StudentsEnrolled.objects.filter(badge_class_id__in=batch).values('badge_class_id').annotate(
+                        pending_enrollment_count=Count('pk', filter=Q(badge_instance=None, denied=False)),
+                        denied_enrollment_count=Count('pk', filter=Q(denied=True))):
+                    counts[row.pop('badge_class_id')].update(row)
+            if direct_awards or missing:
+                counters += self.DIRECT_AWARD_COUNTERS
+                for row in DirectAward.objects.filter(badgeclass_id__in=batch).values('badgeclass_id').annotate(
+                        pending_direct_award_count=Count('pk', filter=Q(status='Unaccepted'))):
+                    counts[row.pop('badgeclass_id')].update(row)
+
+            for pk in batch:
+                values = {counter: counts[pk].get(counter, 0) for counter in counters}
+                if any(current[pk][counter] != value for counter, value in values.items()):
+                    self.filter(badgeclass_id=pk).update(**values)
+                    if pk not in missing:
+                        repaired += 1
+        return repaired
+
+    def rollup(self, **filters):
+        """
+        Sums the counters of the badgeclasses matching filters, e.g. badgeclass__issuer=issuer, in one query.
+        Assertions are split in formal and informal at read time, so changing BadgeClass.formal needs no update.
+        recipient_count is a sum as well and counts a user once for every badgeclass awarded to them.
+        """
+        counters = self.ASSERTION_COUNTERS + self.ENROLLMENT_COUNTERS + self.DIRECT_AWARD_COUNTERS
+        aggregates = {counter: Sum(counter) for counter in counters}
+        aggregates['assertion_count_formal'] = Sum('assertion_count', filter=Q(badgeclass__formal=True))
+        aggregates['assertion_count_informal'] = Sum('assertion_count', filter=Q(badgeclass__formal=False))
+        return {counter: total or 0 for counter, total in self.filter(**filters).aggregate(**aggregates).items()}
+
+
+class IssuerStatusListManager(models.Manager):
+    use_in_migrations = True
+
+    def allocate(self, issuer_id, count=1):
+        """
+        Hands out count consecutive status indexes of the status list of an issuer with a single UPDATE in the current
+        transaction, the list is created on first use
+        :return: the first of the indexes
+        """
+        from entity.cache import bump_revision
+        with transaction.atomic():
+            if not self.filter(issuer_id=issuer_id).update(size=F('size') + count):
+                self.bulk_create([self.model(issuer_id=issuer_id)], ignore_conflicts=True)
+                self.filter(issuer_id=issuer_id).update(size=F('size') + count)
+            start = self.filter(issuer_id=issuer_id).values_list('size', flat=True).get() - count
+        # the size and the length of the bitstring changed
+        bump_revision(self.model.__name__, issuer_id)
+        return start
+
+    def set_revoked(self, issuer_id, indexes, revoked=True):
+        """Sets or clears the bits of the indexes in the status list of an issuer, the other bits are left as they are"""
+        from entity.cache import bump_revision
+        indexes = [index for index in indexes if index is not None]
+        if not indexes:
+            return
+        with transaction.atomic():
+            status_list = self.select_for_update().get(issuer_id=issuer_id)
+            bitstring = status_list.get_bitstring()
+            for index in indexes:
+                status_list.set_bit(bitstring, index, revoked)
+            status_list.set_bitstring(bitstring)
+            status_list.save()
+        bump_revision(self.model.__name__, issuer_id)
+
+    def rebuild(self, issuer_ids=None):
+        """
+        Hands out status indexes to the hosted assertions of the issuers (all when issuer_ids is None) that have none,
+        and rebuilds the status lists from the revoked flag of the assertions
+        :return: the number of issuers for which the stored status list was wrong
+        """
+        from entity.cache import bump_revision, bump_revisions
+        from issuer.models import BadgeInstance, Issuer
+        if issuer_ids is None:
+            issuer_ids = list(Issuer.objects.values_list('pk', flat=True))
+        repaired = 0
+        for issuer_id in issuer_ids:
+            with transaction.atomic():
+                assertions = BadgeInstance.objects.filter(issuer_id=issuer_id, source_url__isnull=True)
+                missing = [BadgeInstance(pk=pk, entity_id=entity_id, revoked=revoked) for pk, entity_id, revoked in
+                           assertions.filter(status_index__isnull=True).order_by('pk')
+                           .values_list('pk', 'entity_id', 'revoked')]
+                if missing:
+                    start = self.allocate(issuer_id, len(missing))
+                    for offset, instance in enumerate(missing):
+                        instance.status_index = start + offset
+                    BadgeInstance.objects.bulk_update(missing, ['status_index'], batch_size=BULK_BATCH_SIZE)
+                    # the cached assertions and their json do not have the status index yet
+                    bump_revisions([(BadgeInstance.__name__, instance.pk) for instance in missing])
+                    cache.delete_many([instance.publish_key(*fields) for instance in missing
+                                       for fields in (('pk',), ('entity_id',), ('entity_id', 'revoked'))])
+                status_list = self.select_for_update().filter(issuer_id=issuer_id).first()
+                if status_list is None:
+                    continue
+                stored = status_list.get_bitstring()
+                bitstring = bytearray(len(stored))
+                for index in assertions.filter(revoked=True, status_index__isnull=False) \
+                        .values_list('status_index', flat=True):
+                    status_list.set_bit(bitstring, index, True)
+                if bitstring != stored:
+                    status_list.set_bitstring(bitstring)
+                    status_list.save()
+                    repaired += 1
+            bump_revision(self.model.__name__, issuer_id)
+        return repaired
+
 
 class BadgeInstanceEvidenceManager(models.Manager):
     @transaction.atomic
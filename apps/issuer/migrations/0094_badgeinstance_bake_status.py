@@ -0,0 +1,18 @@
+# Generated by Django 2.2.18 on 2021-07-05 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0093_migrate_studyload_time_investment_extensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='badgeinstance',
+            name='bake_status',
+            field=models.CharField(choices=[('pending', 'pending'), ('baked', 'baked'), ('failed', 'failed')], default='baked', max_length=254),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.18 on 2021-07-12 09:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import issuer.managers
+
+
+def rebuild_stats(apps, schema_editor):
+    apps.get_model('issuer', 'BadgeClassStats').objects.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('directaward', '0008_directaward_revocation_reason'),
+        ('lti_edu', '0026_auto_20191225_0316'),
+        ('issuer', '0094_badgeinstance_bake_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BadgeClassStats',
+            fields=[
+                ('badgeclass', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='issuer.BadgeClass')),
+                ('assertion_count', models.IntegerField(default=0)),
+                ('revoked_count', models.IntegerField(default=0)),
+                ('accepted_count', models.IntegerField(default=0)),
+                ('recipient_count', models.IntegerField(default=0)),
+                ('pending_enrollment_count', models.IntegerField(default=0)),
+                ('denied_enrollment_count', models.IntegerField(default=0)),
+                ('pending_direct_award_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            managers=[
+                ('objects', issuer.managers.BadgeClassStatsManager()),
+            ],
+        ),
+        migrations.RunPython(rebuild_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.18 on 2021-07-26 10:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0095_badgeclassstats'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='badgeinstance',
+            index_together={('badgeclass', 'created_at'), ('recipient_identifier', 'badgeclass', 'revoked')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.18 on 2021-08-09 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0096_badgeinstance_badgeclass_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='badgeinstance',
+            name='recipient_hash',
+            field=models.CharField(blank=True, db_index=True, default=None, max_length=254, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.18 on 2021-08-16 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import issuer.managers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0097_badgeinstance_recipient_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='badgeinstance',
+            name='status_index',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.CreateModel(
+            name='IssuerStatusList',
+            fields=[
+                ('issuer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='status_list', serialize=False, to='issuer.Issuer')),
+                ('size', models.IntegerField(default=0)),
+                ('encoded_list', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            managers=[
+                ('objects', issuer.managers.IssuerStatusListManager()),
+            ],
+        ),
+    ]
@@ -1,17 +1,21 @@
+import base64
 import datetime
+import gzip
+import hashlib
 import io
 import logging
 import os
 import uuid
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
+from itertools import chain
 from json import dumps as json_dumps
 from json import loads as json_loads
 from urllib.parse import urljoin
 
 import cachemodel
-import requests
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
@@ -20,21 +24,26 @@ from django.db.models import Q
 from django.urls import reverse
 from django.utils import timezone
 from jsonfield import JSONField
-from openbadges_bakery import bake
 from rest_framework import serializers
 
 from directaward.models import DirectAward, DirectAwardBundle
+from entity.cache import SegmentedQuerysetCache, cached_json_document, publish_on_commit
 from entity.models import BaseVersionedEntity, EntityUserProvisionmentMixin
-from issuer.managers import BadgeInstanceManager, IssuerManager, BadgeClassManager, BadgeInstanceEvidenceManager
+from institution.reports import HierarchyReport
+from issuer.managers import BadgeInstanceManager, IssuerManager, BadgeClassManager, BadgeInstanceEvidenceManager, \
+    BadgeClassStatsManager, IssuerStatusListManager
 from mainsite.exceptions import BadgrValidationError, BadgrValidationFieldError, BadgrValidationMultipleFieldError
-from mainsite.mixins import ImageUrlGetterMixin, DefaultLanguageMixin
-from mainsite.models import BadgrApp, BaseAuditedModel, ArchiveMixin
-from mainsite.utils import OriginSetting, generate_entity_uri, EmailMessageMaker
+from mainsite.mixins import ImageUrlGetterMixin, ImageDerivativesMixin, DefaultLanguageMixin
+from mainsite.models import BadgrApp, BaseAuditedModel, ArchiveMixin, EmailBlacklist
+from mainsite.utils import OriginSetting, generate_entity_uri, EmailMessageMaker, send_mass_html_mail, \
+    schedule_task_on_commit, batched
 from signing import tsob
 from signing.models import AssertionTimeStamp, PublicKeyIssuer
 from signing.models import PublicKey
 from staff.mixins import PermissionedModelMixin
 from staff.models import BadgeClassStaff, IssuerStaff
+from . import baking
+from .validation import validate_assertions, invalidate_validations
 from .utils import generate_sha256_hashstring, CURRENT_OBI_VERSION, get_obi_context, add_obi_version_ifneeded, \
     UNVERSIONED_BAKED_VERSION
 
@@ -61,6 +70,47 @@ class OriginalJsonMixin(models.Model):
             return {key: original[key] for key in [k for k in list(original.keys()) if k not in excluded_fields]}
 
 
+def sync_related_items(owner, queryset, items, identity, cached_method_name, update_fields=()):
+    """
+    Makes the related objects in queryset match items with at most one bulk_create, one bulk_update and one
+    delete query, instead of a save or delete (and a publish of owner) per object.
+
+    :param items: unsaved model instances that should exist afterwards
+    :param identity: function that returns the key that matches an item with an existing object
+    :param update_fields: fields that are copied onto an existing object with the same identity
+    :return: True if anything changed
+    """
+    existing = {identity(obj): obj for obj in queryset}
+    desired = OrderedDict((identity(item), item) for item in items)
+
+    to_create = [item for key, item in desired.items() if key not in existing]
+    to_update = []
+    for key, item in desired.items():
+        obj = existing.get(key)
+        if obj is not None and any(getattr(obj, f) != getattr(item, f) for f in update_fields):
+            for field in update_fields:
+                setattr(obj, field, getattr(item, field))
+            to_update.append(obj)
+    to_delete = [obj for key, obj in existing.items() if key not in desired]
+
+    if not (to_create or to_update or to_delete):
+        return False
+
+    model = queryset.model
+    if to_create:
+        model.objects.bulk_create(to_create)
+    if to_update:
+        model.objects.bulk_update(to_update, update_fields)
+    if to_delete:
+        # a queryset delete bypasses the publish of owner in every object's delete
+        model.objects.filter(pk__in=[obj.pk for obj in to_delete]).delete()
+    cache.delete_many([obj.publish_key('pk') for obj in chain(to_update, to_delete)])
+
+    owner.remove_cached_data([cached_method_name])
+    publish_on_commit(owner)
+    return True
+
+
 class BaseOpenBadgeObjectModel(OriginalJsonMixin, cachemodel.CacheModel):
     source = models.CharField(max_length=254, default='local')
     source_url = models.CharField(max_length=254, blank=True, null=True, default=None)
@@ -83,27 +133,18 @@ class BaseOpenBadgeObjectModel(OriginalJsonMixin, cachemodel.CacheModel):
     def extension_items(self, value):
         if value is None:
             value = {}
-        touched_idx = []
 
         with transaction.atomic():
-            if not self.pk and value:
+            if not self.pk:
+                if not value:
+                    return
                 self.save()
 
-            # add new
-            for ext_name, ext in list(value.items()):
-                ext_json = json_dumps(ext)
-                ext, ext_created = self.get_extensions_manager().get_or_create(name=ext_name, defaults=dict(
-                    original_json=ext_json
-                ))
-                if not ext_created:
-                    ext.original_json = ext_json
-                    ext.save()
-                touched_idx.append(ext.pk)
-
-            # remove old
-            for extension in self.cached_extensions():
-                if extension.pk not in touched_idx:
-                    extension.delete()
+            manager = self.get_extensions_manager()
+            items = [manager.model(name=ext_name, original_json=json_dumps(ext), **{manager.field.name: self})
+                     for ext_name, ext in value.items()]
+            sync_related_items(self, manager.all(), items, identity=lambda e: e.name,
+                               cached_method_name='cached_extensions', update_fields=['original_json'])
 
 
 class BaseOpenBadgeExtension(cachemodel.CacheModel):
@@ -117,16 +158,54 @@ class BaseOpenBadgeExtension(cachemodel.CacheModel):
         abstract = True
 
 
+def _public_key_issuer_dependencies(options):
+    public_key_issuer = options.get('public_key_issuer')
+    if public_key_issuer is None:
+        return []
+    return [('PublicKeyIssuer', public_key_issuer.pk)]
+
+
+def _hierarchy_dependencies(issuer_id):
+    """the issuer and the faculty and institution it belongs to, resolved from cache"""
+    issuer = Issuer.cached.get(pk=issuer_id)
+    faculty = apps.get_model('institution', 'Faculty').cached.get(pk=issuer.faculty_id)
+    return [('Issuer', issuer.pk), ('Faculty', faculty.pk), ('Institution', faculty.institution_id)]
+
+
+def _issuer_json_dependencies(issuer, options):
+    dependencies = _hierarchy_dependencies(issuer.pk)
+    if options['expand_awards']:
+        # the names of the institutions awards are allowed to
+        dependencies.append(('Institution', '*'))
+    return dependencies + _public_key_issuer_dependencies(options)
+
+
+def _badgeclass_json_dependencies(badgeclass, options):
+    return [('BadgeClass', badgeclass.pk), ('Issuer', badgeclass.issuer_id)] + \
+           _public_key_issuer_dependencies(options)
+
+
+def _badgeinstance_json_dependencies(badgeinstance, options):
+    dependencies = [('BadgeInstance', badgeinstance.pk), ('BadgeClass', badgeinstance.badgeclass_id)]
+    if options['expand_issuer']:
+        dependencies += _hierarchy_dependencies(badgeinstance.issuer_id)
+    else:
+        dependencies.append(('Issuer', badgeinstance.issuer_id))
+    return dependencies + _public_key_issuer_dependencies(options)
+
+
 class Issuer(EntityUserProvisionmentMixin,
              ArchiveMixin,
              PermissionedModelMixin,
              ImageUrlGetterMixin,
+             ImageDerivativesMixin,
              BaseAuditedModel,
              DefaultLanguageMixin,
              BaseVersionedEntity,
              BaseOpenBadgeObjectModel):
     entity_class_name = 'Issuer'
     DUTCH_NAME = "issuer"
+    derivative_image_fields = ('image_english', 'image_dutch')
 
     staff = models.ManyToManyField('badgeuser.BadgeUser', through='staff.IssuerStaff')
     badgrapp = models.ForeignKey('mainsite.BadgrApp', on_delete=models.SET_NULL, blank=True, null=True, default=None)
@@ -164,30 +243,7 @@ class Issuer(EntityUserProvisionmentMixin,
         return self.return_value_according_to_language(self.url_english, self.url_dutch)
 
     def get_report(self):
-        total_assertions_formal = 0
-        total_assertions_informal = 0
-        total_assertions_revoked = 0
-        total_enrollments = 0
-        unique_recipients = set()
-        for badgeclass in self.cached_badgeclasses():
-            for assertion in badgeclass.cached_assertions():
-                if badgeclass.formal:
-                    total_assertions_formal += 1
-                else:
-                    total_assertions_informal += 1
-                if assertion.revoked:
-                    total_assertions_revoked += 1
-                unique_recipients.add(assertion.user)
-            total_enrollments += badgeclass.cached_enrollments().__len__()
-        return {'name': self.name,
-                'type': self.__class__.__name__.capitalize(),
-                'id': self.pk,
-                'total_badgeclasses': self.cached_badgeclasses().__len__(),
-                'total_enrollments': total_enrollments,
-                'total_recipients': unique_recipients.__len__(),
-                'total_assertions_formal': total_assertions_formal,
-                'total_assertions_informal': total_assertions_informal,
-                'total_assertions_revoked': total_assertions_revoked}
+        return HierarchyReport(self).get_report(self)
 
     def validate_unique(self, exclude=None):
         if not self.archived:
@@ -248,10 +304,12 @@ class Issuer(EntityUserProvisionmentMixin,
         """return all assertions, also assertions belonging to archived entities
         this is used to check if an entity can be archived / deleted
         """
-        assertions = []
+        return list(self.iter_assertions())
+
+    def iter_assertions(self):
+        """lazily generates all assertions, also assertions belonging to archived entities"""
         for bc in self.badgeclasses.all():
-            assertions += bc.assertions
-        return assertions
+            yield from bc.iter_assertions()
 
     @cachemodel.cached_method(auto_publish=True)
     def cached_staff(self):
@@ -268,16 +326,20 @@ class Issuer(EntityUserProvisionmentMixin,
         return BadgeClass.objects.filter(issuer=self,
                                          archived=False).count()
 
+    def get_stats(self):
+        """
+        Returns the summed BadgeClassStats counters of the badgeclasses of this issuer
+        """
+        return BadgeClassStats.objects.rollup(badgeclass__issuer=self, badgeclass__archived=False)
+
     @cachemodel.cached_method(auto_publish=True)
     def cached_badgeclasses(self):
         return list(self.badgeclasses.filter(archived=False))
 
     @cachemodel.cached_method(auto_publish=True)
     def cached_assertions(self):
-        r = []
-        for bc in self.cached_badgeclasses():
-            r += bc.cached_assertions()
-        return r
+        """the assertions of the badgeclasses, read from the segmented cache of each badgeclass"""
+        return list(chain.from_iterable(bc.iter_assertions() for bc in self.cached_badgeclasses()))
 
     @cachemodel.cached_method(auto_publish=True)
     def cached_pending_enrollments(self):
@@ -294,6 +356,10 @@ class Issuer(EntityUserProvisionmentMixin,
             raise ValueError('Public key issuer does not belong to this Issuer.')
         return self.jsonld_id + '/pubkey/{}'.format(public_key_issuer.entity_id)
 
+    @property
+    def status_list_url(self):
+        return self.jsonld_id + '/status-list'
+
     def create_empty_key_address(self):
         """
         Creates a PublicKeyIssuer instance which has a public api url address. This address is needed at the time
@@ -339,6 +405,7 @@ class Issuer(EntityUserProvisionmentMixin,
         symmetric_key.validate_password(password)
         return tsob.create_new_private_key(password, symmetric_key, self)
 
+    @cached_json_document(_issuer_json_dependencies)
     def get_json(self, obi_version=CURRENT_OBI_VERSION, include_extra=True, use_canonical_id=False, signed=False,
                  public_key_issuer=None, expand_public_key=False, expand_institution=False, expand_awards=False):
         if signed and not public_key_issuer:
@@ -468,6 +535,7 @@ class BadgeClass(EntityUserProvisionmentMixin,
                  ArchiveMixin,
                  PermissionedModelMixin,
                  ImageUrlGetterMixin,
+                 ImageDerivativesMixin,
                  BaseAuditedModel,
                  DefaultLanguageMixin,
                  BaseVersionedEntity,
@@ -496,26 +564,7 @@ class BadgeClass(EntityUserProvisionmentMixin,
         verbose_name_plural = "Badge classes"
 
     def get_report(self):
-        total_assertions_formal = 0
-        total_assertions_informal = 0
-        total_assertions_revoked = 0
-        unique_recipients = set()
-        for assertion in self.cached_assertions():
-            if self.formal:
-                total_assertions_formal += 1
-            else:
-                total_assertions_informal += 1
-            if assertion.revoked:
-                total_assertions_revoked += 1
-            unique_recipients.add(assertion.user)
-        return {'name': self.name,
-                'type': self.__class__.__name__.capitalize(),
-                'id': self.pk,
-                'total_recipients': unique_recipients.__len__(),
-                'total_enrollments': self.cached_enrollments().__len__(),
-                'total_assertions_formal': total_assertions_formal,
-                'total_assertions_informal': total_assertions_informal,
-                'total_assertions_revoked': total_assertions_revoked}
+        return HierarchyReport(self).get_report(self)
 
     def validate_unique(self, exclude=None):
         if not self.archived:
@@ -528,7 +577,11 @@ class BadgeClass(EntityUserProvisionmentMixin,
 
     def save(self, *args, **kwargs):
         self.validate_unique()
-        return super(BadgeClass, self).save(*args, **kwargs)
+        created = self.pk is None
+        result = super(BadgeClass, self).save(*args, **kwargs)
+        if created:
+            BadgeClassStats.objects.create(badgeclass=self)
+        return result
 
     @property
     def institution(self):
@@ -543,9 +596,16 @@ class BadgeClass(EntityUserProvisionmentMixin,
     def cached_staff(self):
         return BadgeClassStaff.objects.filter(badgeclass=self)
 
-    @cachemodel.cached_method(auto_publish=True)
+    @property
+    def assertions_cache(self):
+        return SegmentedQuerysetCache(['BadgeClass', self.pk, 'assertions'], self.badgeinstances.all())
+
+    def iter_assertions(self):
+        """lazily generates the assertions chunk by chunk from the cache"""
+        return iter(self.assertions_cache)
+
     def cached_assertions(self):
-        return list(self.badgeinstances.all())
+        return list(self.iter_assertions())
 
     @cachemodel.cached_method(auto_publish=True)
     def cached_direct_awards(self):
@@ -564,8 +624,14 @@ class BadgeClass(EntityUserProvisionmentMixin,
         """return all assertions this is used to check if an entity can be archived / deleted"""
         return self.cached_assertions()
 
-    def publish(self):
+    def publish(self, clear_assertions=True):
+        """
+        :param clear_assertions: drop the cached assertion segments, an assertion that publishes its badgeclass
+        has already invalidated its own segment
+        """
         super(BadgeClass, self).publish()
+        if clear_assertions:
+            self.assertions_cache.clear()
         self.issuer.publish()
 
     def _get_terms(self):
@@ -645,9 +711,17 @@ class BadgeClass(EntityUserProvisionmentMixin,
 
     @property
     def assertions_count(self):
-        return BadgeInstance.objects.filter(badgeclass=self,
-                                            revoked=False,
-                                            acceptance='Accepted').count()
+        return self.get_stats().accepted_count
+
+    def get_stats(self):
+        """
+        Returns the BadgeClassStats of this badgeclass, read from the database as the stats are not part of the cache
+        """
+        try:
+            return BadgeClassStats.objects.get(badgeclass_id=self.pk)
+        except BadgeClassStats.DoesNotExist:
+            BadgeClassStats.objects.rebuild([self.pk])
+            return BadgeClassStats.objects.get(badgeclass_id=self.pk)
 
     @cachemodel.cached_method(auto_publish=True)
     def cached_alignments(self):
@@ -663,31 +737,18 @@ class BadgeClass(EntityUserProvisionmentMixin,
             value = []
         keys = ['target_name', 'target_url', 'target_description', 'target_framework', 'target_code']
 
-        def _identity(align):
-            """build a unique identity from alignment json"""
-            return "&".join("{}={}".format(k, align.get(k, None)) for k in keys)
-
-        def _obj_identity(alignment):
-            """build a unique identity from alignment json"""
-            return "&".join("{}={}".format(k, getattr(alignment, k)) for k in keys)
-
-        existing_idx = {_obj_identity(a): a for a in self.alignment_items}
-        new_idx = {_identity(a): a for a in value}
+        def _identity(alignment):
+            """build a unique identity from an alignment"""
+            return tuple(getattr(alignment, k) for k in keys)
 
         with transaction.atomic():
             # HACKY, but force a save to self otherwise we can't create related objects here
             if not self.pk:
                 self.save()
 
-            # add missing records
-            for align in value:
-                if _identity(align) not in existing_idx:
-                    alignment = self.badgeclassalignment_set.create(**align)
-
-            # remove old records
-            for alignment in self.alignment_items:
-                if _obj_identity(alignment) not in new_idx:
-                    alignment.delete()
+            items = [BadgeClassAlignment(badgeclass=self, **align) for align in value]
+            sync_related_items(self, self.badgeclassalignment_set.all(), items, identity=_identity,
+                               cached_method_name='cached_alignments')
 
     @cachemodel.cached_method(auto_publish=True)
     def cached_tags(self):
@@ -701,40 +762,76 @@ class BadgeClass(EntityUserProvisionmentMixin,
     def tag_items(self, value):
         if value is None:
             value = []
-        existing_idx = [t.name for t in self.tag_items]
-        new_idx = value
 
         with transaction.atomic():
             if not self.pk:
                 self.save()
 
-            # add missing
-            for t in value:
-                if t not in existing_idx:
-                    tag = self.badgeclasstag_set.create(name=t)
-
-            # remove old
-            for tag in self.tag_items:
-                if tag.name not in new_idx:
-                    tag.delete()
+            items = [BadgeClassTag(badgeclass=self, name=name) for name in value]
+            sync_related_items(self, self.badgeclasstag_set.all(), items, identity=lambda t: t.name,
+                               cached_method_name='cached_tags')
 
     def get_extensions_manager(self):
         return self.badgeclassextension_set
 
     def issue(self, recipient, created_by=None, allow_uppercase=False, extensions=None, send_email=True,
               enforce_validated_name=True, include_evidence=True, **kwargs):
-        if not recipient.validated_name and enforce_validated_name:
+        award = dict(kwargs, recipient=recipient, extensions=extensions)
+        return self.issue_many([award], created_by=created_by, allow_uppercase=allow_uppercase,
+                               send_email=send_email, enforce_validated_name=enforce_validated_name,
+                               include_evidence=include_evidence)[0]
+
+    def issue_many(self, awards, created_by=None, allow_uppercase=False, send_email=True,
+                   enforce_validated_name=True, include_evidence=True):
+        """
+        Awards this badgeclass to a batch of recipients. The assertions, evidence and extensions are inserted in bulk,
+        the caches of the badgeclass and the recipients are cleared once and the emails go out over one connection.
+        :param awards: list of dicts with the recipient (BadgeUser) and the optional evidence, extensions and other
+                       BadgeInstance fields (narrative, expires_at, acceptance, ...) of that award
+        :return: the new assertions in the order of awards
+        """
+        from allauth.socialaccount.models import SocialAccount
+        if not awards:
+            return []
+        recipients = [award['recipient'] for award in awards]
+        if enforce_validated_name and not all(recipient.validated_name for recipient in recipients):
             raise serializers.ValidationError('You need a validated_name from an Institution to issue badges.')
-        assertion = BadgeInstance.objects.create(
-            badgeclass=self, recipient_identifier=recipient.get_recipient_identifier(), created_by=created_by,
-            allow_uppercase=allow_uppercase, include_evidence=include_evidence,
-            user=recipient, extensions=extensions,
-            **kwargs
-        )
-        message = EmailMessageMaker.create_earned_badge_mail(assertion)
+        recipient_identifiers = dict(SocialAccount.objects.filter(user__in=recipients).values_list('user_id', 'uid'))
+
+        instance_awards = []
+        for award in awards:
+            award = dict(award)
+            recipient = award.pop('recipient')
+            award.update(user=recipient, recipient_identifier=recipient_identifiers.get(recipient.pk))
+            instance_awards.append(award)
+        assertions = BadgeInstance.objects.create_many(self, instance_awards, created_by=created_by,
+                                                       allow_uppercase=allow_uppercase,
+                                                       include_evidence=include_evidence)
+
+        self.publish()
+        for recipient in {recipient.pk: recipient for recipient in recipients}.values():
+            recipient.remove_cached_data(['cached_badgeinstances'])
         if send_email:
-            recipient.email_user(subject='Congratulations, you earned an edubadge!', html_message=message)
-        return assertion
+            self.schedule_earned_badge_mails(assertions)
+        return assertions
+
+    def schedule_earned_badge_mails(self, assertions):
+        """
+        Sends the earned badge mails of the assertions in the background once the current transaction is committed
+        """
+        from issuer.tasks import send_earned_badge_mails
+        batch_size = getattr(settings, 'EARNED_BADGE_MAIL_TASK_BATCH_SIZE', 100)
+        schedule_task_on_commit(send_earned_badge_mails,
+                                [(self.pk, pks) for pks in batched([a.pk for a in assertions], batch_size)])
+
+    def send_earned_badge_mails(self, assertions):
+        recipients = {assertion.pk: assertion.user.primary_email for assertion in assertions}
+        blacklisted = set(EmailBlacklist.objects.filter(email__in=recipients.values()).values_list('email', flat=True))
+        badgeclass_image = EmailMessageMaker._create_example_image(self)
+        messages = [(EmailMessageMaker.create_earned_badge_mail(assertion, badgeclass_image=badgeclass_image),
+                     [recipients[assertion.pk]])
+                    for assertion in assertions if recipients[assertion.pk] not in blacklisted]
+        send_mass_html_mail('Congratulations, you earned an edubadge!', messages)
 
     def issue_signed(self, recipient, created_by=None, allow_uppercase=False, signer=None, extensions=None, **kwargs):
         perms = self.get_permissions(signer)
@@ -748,6 +845,7 @@ class BadgeClass(EntityUserProvisionmentMixin,
         assertion.submit_for_timestamping(signer=signer)
         return assertion
 
+    @cached_json_document(_badgeclass_json_dependencies)
     def get_json(self, obi_version=CURRENT_OBI_VERSION, include_extra=True, use_canonical_id=False, signed=False,
                  public_key_issuer=None):
         if not public_key_issuer and signed:
@@ -834,6 +932,88 @@ class BadgeClass(EntityUserProvisionmentMixin,
         return self.cached_issuer.cached_badgrapp
 
 
+class BadgeClassStats(models.Model):
+    """
+    Counters of a badgeclass that are updated in the same transaction as the assertions, enrollments and
+    direct awards they count, so counts can be shown without counting rows.
+    Repair drift with the rebuild_stats management command.
+    """
+    badgeclass = models.OneToOneField(BadgeClass, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    assertion_count = models.IntegerField(default=0)
+    revoked_count = models.IntegerField(default=0)
+    accepted_count = models.IntegerField(default=0)  # accepted and not revoked
+    recipient_count = models.IntegerField(default=0)
+    pending_enrollment_count = models.IntegerField(default=0)
+    denied_enrollment_count = models.IntegerField(default=0)
+    pending_direct_award_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BadgeClassStatsManager()
+
+    def __str__(self):
+        return 'Stats of {}'.format(self.badgeclass_id)
+
+
+class IssuerStatusList(models.Model):
+    """
+    Revocation status list of the assertions hosted for an issuer. Every assertion gets a status index at issue time,
+    the bit at that index is set when it is revoked, so relying parties fetch one list instead of the json of every
+    assertion. The bitstring is stored gzipped and base64url encoded as in the W3C Status List 2021, at least
+    STATUS_LIST_MIN_BITS long so the index does not tell how many assertions were issued.
+    Repair drift with the rebuild_status_lists management command.
+    """
+    STATUS_LIST_MIN_BITS = 16 * 1024 * 8
+
+    issuer = models.OneToOneField(Issuer, primary_key=True, related_name='status_list', on_delete=models.CASCADE)
+    size = models.IntegerField(default=0)  # the number of status indexes handed out
+    encoded_list = models.TextField(blank=True, default='')  # empty when no assertion was ever revoked
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = IssuerStatusListManager()
+
+    def __str__(self):
+        return 'Status list of {}'.format(self.issuer_id)
+
+    def get_bitstring(self):
+        length = (max(self.size, self.STATUS_LIST_MIN_BITS) + 7) // 8
+        bitstring = bytearray()
+        if self.encoded_list:
+            padding = '=' * (-len(self.encoded_list) % 4)
+            bitstring += gzip.decompress(base64.urlsafe_b64decode(self.encoded_list + padding))
+        return bitstring + bytearray(max(length - len(bitstring), 0))
+
+    def set_bitstring(self, bitstring):
+        out = io.BytesIO()
+        with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as compressed:
+            compressed.write(bytes(bitstring))
+        self.encoded_list = base64.urlsafe_b64encode(out.getvalue()).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def set_bit(bitstring, index, value):
+        """The first index is the most significant bit of the first byte"""
+        mask = 0x80 >> (index % 8)
+        if value:
+            bitstring[index // 8] |= mask
+        else:
+            bitstring[index // 8] &= ~mask & 0xff
+
+    def is_revoked(self, index):
+        return bool(self.get_bitstring()[index // 8] & (0x80 >> (index % 8)))
+
+    def get_json(self):
+        if not self.encoded_list:
+            self.set_bitstring(self.get_bitstring())
+        return OrderedDict([
+            ('id', self.issuer.status_list_url),
+            ('type', 'StatusList2021'),
+            ('issuer', self.issuer.jsonld_id),
+            ('statusPurpose', 'revocation'),
+            ('size', self.size),
+            ('encodedList', self.encoded_list),
+            ('updatedAt', self.updated_at.isoformat()),
+        ])
+
+
 class BadgeInstance(BaseAuditedModel,
                     ImageUrlGetterMixin,
                     BaseVersionedEntity,
@@ -846,6 +1026,9 @@ class BadgeInstance(BaseAuditedModel,
 
     identifier = models.CharField(max_length=255, null=True, default=None)  # the uuid used to ID signed assertions
 
+    # bit in the IssuerStatusList of the issuer, handed out at issue time to hosted assertions
+    status_index = models.PositiveIntegerField(blank=True, null=True, default=None)
+
     badgeclass = models.ForeignKey(BadgeClass, blank=False, null=False, on_delete=models.PROTECT,
                                    related_name='badgeinstances')
     issuer = models.ForeignKey(Issuer, on_delete=models.PROTECT, blank=False, null=False)
@@ -897,8 +1080,20 @@ class BadgeInstance(BaseAuditedModel,
     acceptance = models.CharField(max_length=254, choices=ACCEPTANCE_CHOICES, default=ACCEPTANCE_UNACCEPTED)
     narrative = models.TextField(blank=True, null=True, default=None)
 
+    BAKE_STATUS_PENDING = 'pending'
+    BAKE_STATUS_BAKED = 'baked'
+    BAKE_STATUS_FAILED = 'failed'
+    BAKE_STATUS_CHOICES = (
+        (BAKE_STATUS_PENDING, 'pending'),
+        (BAKE_STATUS_BAKED, 'baked'),
+        (BAKE_STATUS_FAILED, 'failed'),
+    )
+    bake_status = models.CharField(max_length=254, choices=BAKE_STATUS_CHOICES, default=BAKE_STATUS_BAKED)
+
     hashed = models.BooleanField(default=True)
     salt = models.CharField(max_length=254, blank=True, null=True, default=None, db_index=True)
+    # the hashed recipient identity of the assertion json, None until backfilled for older assertions
+    recipient_hash = models.CharField(max_length=254, blank=True, null=True, default=None, db_index=True)
 
     old_json = JSONField()
 
@@ -914,14 +1109,11 @@ class BadgeInstance(BaseAuditedModel,
     class Meta:
         index_together = (
             ('recipient_identifier', 'badgeclass', 'revoked'),
+            ('badgeclass', 'created_at'),
         )
 
     def validate(self):
-        data = {'profile': {'id': self.recipient_identifier}, 'data': self.get_json()}
-        response = requests.post(json=data,
-                                 url=urljoin(settings.VALIDATOR_URL, 'results'),
-                                 headers={'Accept': 'application/json'})
-        return response.json()
+        return validate_assertions([self])[0]
 
     @property
     def extended_json(self):
@@ -1000,26 +1192,91 @@ class BadgeInstance(BaseAuditedModel,
         else:
             return None
 
+    def prepare_new(self):
+        """
+        Sets the values a new assertion needs before it is inserted, also used for bulk inserts
+        """
+        self.salt = uuid.uuid4().hex
+        self.recipient_hash = self.get_hashed_identity()
+        self.created_at = datetime.datetime.now()
+
+        # do this now instead of in AbstractVersionedEntity.save() so we can use it for image name
+        if self.entity_id is None:
+            self.entity_id = generate_entity_uri()
+
+        if self.revoked is False:
+            self.revocation_reason = None
+
+    def bake_image(self):
+        """
+        Bakes the assertion json, or the signature of a signed assertion, into the image of the badgeclass and stores
+        it as the image of this assertion, without saving the assertion itself
+        """
+        badgeclass_image = self.cached_badgeclass.image
+        badgeclass_name, ext = os.path.splitext(badgeclass_image.name)
+        if self.signature:
+            assertion_json_string = self.signature
+        else:
+            assertion_json_string = json_dumps(self.get_json(obi_version=UNVERSIONED_BAKED_VERSION), indent=2)
+        baked_image = baking.bake(badgeclass_image, assertion_json_string)
+        # the name contains the hash of the content, so the file at a url never changes
+        self.image.save(name='assertion-{id}.{hash}{ext}'.format(id=self.entity_id,
+                                                                  hash=hashlib.sha256(baked_image).hexdigest()[:16],
+                                                                  ext=ext),
+                        content=ContentFile(baked_image),
+                        save=False)
+
+    def bake(self, replace_image=False):
+        """
+        Bakes the image of this saved assertion unless that already happened, safe to call from several processes.
+        :param replace_image: delete the previous image file once the new one is stored
+        """
+        with transaction.atomic():
+            current = BadgeInstance.objects.select_for_update().only('image', 'bake_status', 'revoked').get(pk=self.pk)
+            if current.bake_status == self.BAKE_STATUS_BAKED or current.revoked:
+                self.image, self.bake_status = current.image.name, current.bake_status
+                return
+            previous_image_name = current.image.name
+            try:
+                self.bake_image()
+            except Exception:
+                logger.exception('Baking image of assertion {} failed'.format(self.entity_id))
+                self.bake_status = self.BAKE_STATUS_FAILED
+            else:
+                self.bake_status = self.BAKE_STATUS_BAKED
+            # update() skips auto_now, the public endpoints derive Last-Modified from updated_at
+            self.updated_at = timezone.now()
+            BadgeInstance.objects.filter(pk=self.pk).update(image=self.image.name, bake_status=self.bake_status,
+                                                            updated_at=self.updated_at)
+        invalidate_validations([self.pk])
+        if replace_image and previous_image_name and previous_image_name != self.image.name:
+            default_storage.delete(previous_image_name)
+        cache.delete_many([self.publish_key('pk'), self.publish_key('entity_id'),
+                           self.publish_key('entity_id', 'revoked')])
+        self.cached_badgeclass.assertions_cache.invalidate([self.pk])
+
+    def ensure_baked(self):
+        """
+        Bakes the image right away when it is needed before the background worker got to it. A failed bake is only
+        retried by the worker, so an image that cannot be baked does not lock the assertion on every request.
+        """
+        if self.bake_status == self.BAKE_STATUS_PENDING:
+            self.bake()
+
+    def image_url(self):
+        if self.bake_status != self.BAKE_STATUS_BAKED:
+            # the public image endpoint bakes the image when it is requested before the worker is done
+            return OriginSetting.HTTP + reverse('badgeinstance_image', kwargs={'entity_id': self.entity_id})
+        return super(BadgeInstance, self).image_url()
+
     def save(self, *args, **kwargs):
         created = False
         if self.pk is None:
             created = True
-            self.salt = uuid.uuid4().hex
-            self.created_at = datetime.datetime.now()
-
-            # do this now instead of in AbstractVersionedEntity.save() so we can use it for image name
-            if self.entity_id is None:
-                self.entity_id = generate_entity_uri()
+            self.prepare_new()
 
             if not self.image:
-                badgeclass_name, ext = os.path.splitext(self.badgeclass.image.file.name)
-                new_image = io.BytesIO()
-                bake(image_file=self.cached_badgeclass.image.file,
-                     assertion_json_string=json_dumps(self.get_json(obi_version=UNVERSIONED_BAKED_VERSION), indent=2),
-                     output_file=new_image)
-                self.image.save(name='assertion-{id}{ext}'.format(id=self.entity_id, ext=ext),
-                                content=ContentFile(new_image.read()),
-                                save=False)
+                self.bake_status = self.BAKE_STATUS_PENDING
 
             try:
                 from badgeuser.models import CachedEmailAddress
@@ -1033,51 +1290,80 @@ class BadgeInstance(BaseAuditedModel,
 
         if self.revoked is False:
             self.revocation_reason = None
+        self.recipient_hash = self.get_hashed_identity()
 
-        super(BadgeInstance, self).save(*args, **kwargs)
-        self.badgeclass.remove_cached_data(['cached_assertions'])
+        with transaction.atomic():
+            previous = None if created else \
+                BadgeInstance.objects.select_for_update().filter(pk=self.pk).values('revoked', 'acceptance').first()
+            if created and not self.source_url:
+                self.status_index = IssuerStatusList.objects.allocate(self.issuer_id)
+            super(BadgeInstance, self).save(*args, **kwargs)
+            if self.revoked != bool(previous and previous['revoked']):
+                IssuerStatusList.objects.set_revoked(self.issuer_id, [self.status_index], self.revoked)
+            self._update_stats(previous, self._get_stats_state())
+        if created and self.bake_status == self.BAKE_STATUS_PENDING:
+            BadgeInstance.objects.schedule_bake([self])
+        self.badgeclass.assertions_cache.invalidate([self.pk])
         self.user.remove_cached_data(['cached_badgeinstances'])
 
-    def rebake(self, obi_version=CURRENT_OBI_VERSION, save=True, signature=None, replace_image=False):
+    def rebake(self, save=True, replace_image=False):
+        """
+        Queues the image to be baked again, signed assertions get their signature baked in
+        :param save: save this assertion, otherwise only the bake status is written
+        :param replace_image: delete the current image file once the new one is baked
+        """
         if self.source_url:
             # dont rebake imported assertions
             return
 
-        new_image = io.BytesIO()
-        if not signature:
-            bake(
-                image_file=self.cached_badgeclass.image.file,
-                assertion_json_string=json_dumps(self.get_json(obi_version=obi_version), indent=2),
-                output_file=new_image
-            )
-        else:
-            bake(
-                image_file=self.cached_badgeclass.image.file,
-                assertion_json_string=signature,
-                output_file=new_image
-            )
-
-        new_name = default_storage.save(self.image.name, ContentFile(new_image.read()))
-        if not replace_image:
-            self.image.name = new_name
-        if replace_image:
-            self.image.delete()
-            self.image.name = new_name
+        self.bake_status = self.BAKE_STATUS_PENDING
         if save:
             self.save()
+        else:
+            BadgeInstance.objects.filter(pk=self.pk).update(bake_status=self.bake_status)
+            self.cached_badgeclass.assertions_cache.invalidate([self.pk])
+        invalidate_validations([self.pk])
+        BadgeInstance.objects.schedule_bake([self], replace_image=replace_image)
 
     def publish(self):
         super(BadgeInstance, self).publish()
-        self.badgeclass.publish()
+        self.badgeclass.publish(clear_assertions=False)
         if self.user:
             self.user.publish()
 
         self.publish_by('entity_id', 'revoked')
 
+    def _get_stats_state(self):
+        return {'revoked': self.revoked, 'acceptance': self.acceptance}
+
+    def _update_stats(self, previous, current):
+        """
+        Applies the change from the previous to the current state of this assertion to the BadgeClassStats,
+        a state is None when the assertion did not exist
+        """
+        if previous == current:
+            return
+        deltas = defaultdict(int)
+        for state, sign in ((previous, -1), (current, 1)):
+            if state is not None:
+                deltas['assertion_count'] += sign
+                deltas['revoked_count'] += sign * state['revoked']
+                deltas['accepted_count'] += sign * (not state['revoked'] and
+                                                    state['acceptance'] == self.ACCEPTANCE_ACCEPTED)
+        if self.user_id and (previous is None or current is None):
+            if not BadgeInstance.objects.filter(badgeclass_id=self.badgeclass_id, user_id=self.user_id) \
+                    .exclude(pk=self.pk).exists():
+                deltas['recipient_count'] += 1 if previous is None else -1
+        BadgeClassStats.objects.add(self.badgeclass_id, **deltas)
+
     def delete(self, *args, **kwargs):
         badgeclass = self.badgeclass
-        super(BadgeInstance, self).delete(*args, **kwargs)
-        badgeclass.publish()
+        pk = self.pk
+        with transaction.atomic():
+            super(BadgeInstance, self).delete(*args, **kwargs)
+            self._update_stats(self._get_stats_state(), None)
+        badgeclass.assertions_cache.invalidate([pk])
+        badgeclass.publish(clear_assertions=False)
         if self.user:
             self.user.publish()
         self.publish_delete('entity_id', 'revoked')
@@ -1093,6 +1379,7 @@ class BadgeInstance(BaseAuditedModel,
         self.revocation_reason = revocation_reason
         self.image.delete()
         self.save()
+        invalidate_validations([self.pk])
 
         # remove BadgeObjectiveAwards from badgebook if needed
         if apps.is_installed('badgebook'):
@@ -1113,6 +1400,7 @@ class BadgeInstance(BaseAuditedModel,
     def get_hashed_identity(self):
         return generate_sha256_hashstring(self.recipient_identifier.lower(), self.salt)
 
+    @cached_json_document(_badgeinstance_json_dependencies)
     def get_json(self, obi_version=CURRENT_OBI_VERSION, expand_badgeclass=False, expand_issuer=False,
                  include_extra=True, use_canonical_id=False, signed=False, public_key_issuer=None):
 
@@ -1181,6 +1469,15 @@ class BadgeInstance(BaseAuditedModel,
                 json["verification"] = {
                     "type": "HostedBadge"
                 }
+            if self.status_index is not None and not self.source_url:
+                status_list_url = self.cached_issuer.status_list_url
+                json["credentialStatus"] = OrderedDict([
+                    ("id", '{}#{}'.format(status_list_url, self.status_index)),
+                    ("type", "StatusList2021Entry"),
+                    ("statusPurpose", "revocation"),
+                    ("statusListIndex", str(self.status_index)),
+                    ("statusListCredential", status_list_url),
+                ])
 
         # evidence
         json['evidence'] = [e.get_json(obi_version) for e in self.cached_evidence()] if self.include_evidence else []
@@ -1254,6 +1551,10 @@ class BadgeInstance(BaseAuditedModel,
     def get_baked_image_url(self, obi_version=CURRENT_OBI_VERSION):
         if obi_version == UNVERSIONED_BAKED_VERSION:
             # requested version is the one referenced in assertion.image
+            self.ensure_baked()
+            if not self.image:
+                # baking failed, the badgeclass image will do until the worker baked it
+                return self.cached_badgeclass.image.url
             return self.image.url
 
         try:
@@ -1268,14 +1569,11 @@ class BadgeInstance(BaseAuditedModel,
                 expand_badgeclass=True,
                 include_extra=True
             )
-            badgeclass_name, ext = os.path.splitext(self.badgeclass.image.file.name)
-            new_image = io.StringIO()
-            bake(image_file=self.cached_badgeclass.image.file,
-                 assertion_json_string=json_dumps(json_to_bake, indent=2),
-                 output_file=new_image)
+            badgeclass_image = self.cached_badgeclass.image
+            badgeclass_name, ext = os.path.splitext(badgeclass_image.name)
             baked_image.image.save(
                 name='assertion-{id}-{version}{ext}'.format(id=self.entity_id, ext=ext, version=obi_version),
-                content=ContentFile(new_image.read()),
+                content=ContentFile(baking.bake(badgeclass_image, json_dumps(json_to_bake, indent=2))),
                 save=False
             )
             baked_image.save()
@@ -1295,6 +1593,7 @@ class BadgeInstanceEvidence(OriginalJsonMixin, cachemodel.CacheModel):
     def publish(self):
         super(BadgeInstanceEvidence, self).publish()
         self.badgeinstance.publish()
+        self.badgeinstance.bump_revision()
 
     def get_json(self, obi_version=CURRENT_OBI_VERSION, include_context=False):
         json = OrderedDict()
@@ -1346,10 +1645,12 @@ class BadgeClassAlignment(OriginalJsonMixin, cachemodel.CacheModel):
     def publish(self):
         super(BadgeClassAlignment, self).publish()
         self.badgeclass.publish()
+        self.badgeclass.bump_revision()
 
     def delete(self, *args, **kwargs):
         super(BadgeClassAlignment, self).delete(*args, **kwargs)
         self.badgeclass.publish()
+        self.badgeclass.bump_revision()
 
     def get_json(self, obi_version=CURRENT_OBI_VERSION, include_context=False):
         json = OrderedDict()
@@ -1379,10 +1680,12 @@ class BadgeClassTag(cachemodel.CacheModel):
     def publish(self):
         super(BadgeClassTag, self).publish()
         self.badgeclass.publish()
+        self.badgeclass.bump_revision()
 
     def delete(self, *args, **kwargs):
         super(BadgeClassTag, self).delete(*args, **kwargs)
         self.badgeclass.publish()
+        self.badgeclass.bump_revision()
 
 
 class IssuerExtension(BaseOpenBadgeExtension):
@@ -1391,10 +1694,12 @@ class IssuerExtension(BaseOpenBadgeExtension):
     def publish(self):
         super(IssuerExtension, self).publish()
         self.issuer.publish()
+        self.issuer.bump_revision()
 
     def delete(self, *args, **kwargs):
         super(IssuerExtension, self).delete(*args, **kwargs)
         self.issuer.publish()
+        self.issuer.bump_revision()
 
 
 class BadgeClassExtension(BaseOpenBadgeExtension):
@@ -1403,10 +1708,12 @@ class BadgeClassExtension(BaseOpenBadgeExtension):
     def publish(self):
         super(BadgeClassExtension, self).publish()
         self.badgeclass.publish()
+        self.badgeclass.bump_revision()
 
     def delete(self, *args, **kwargs):
         super(BadgeClassExtension, self).delete(*args, **kwargs)
         self.badgeclass.publish()
+        self.badgeclass.bump_revision()
 
 
 class BadgeInstanceExtension(BaseOpenBadgeExtension):
@@ -1415,7 +1722,9 @@ class BadgeInstanceExtension(BaseOpenBadgeExtension):
     def publish(self):
         super(BadgeInstanceExtension, self).publish()
         self.badgeinstance.publish()
+        self.badgeinstance.bump_revision()
 
     def delete(self, *args, **kwargs):
         super(BadgeInstanceExtension, self).delete(*args, **kwargs)
         self.badgeinstance.publish()
+        self.badgeinstance.bump_revision()
@@ -11,16 +11,14 @@ class AwardedAssertionsBlock(permissions.BasePermission):
     """Object can't have any assertions that are not revoked"""
 
     def has_object_permission(self, request, view, obj):
-        return not obj.assertions or len([ass for ass in obj.assertions if not ass.revoked]) == 0
+        return all(ass.revoked for ass in obj.iter_assertions())
 
 
 class NoUnrevokedAssertionsPermission(permissions.BasePermission):
     """Object must have no unrevoked assertions"""
 
     def has_object_permission(self, request, view, obj):
-        if not obj.assertions:
-            return True
-        return all([assertion.revoked for assertion in obj.assertions])
+        return all(assertion.revoked for assertion in obj.iter_assertions())
 
 
 class RecipientIdentifiersMatch(permissions.BasePermission):
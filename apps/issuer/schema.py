@@ -1,22 +1,27 @@
 import graphene
-from graphene.relay import ConnectionField
-from graphene_django.types import DjangoObjectType, Connection
+from graphene_django.types import DjangoObjectType
 
-from directaward.schema import DirectAwardType, DirectAwardBundleType
-from lti_edu.schema import StudentsEnrolledType
+from directaward.models import DirectAward, DirectAwardBundle
+from directaward.schema import DirectAwardType, DirectAwardBundleType, DirectAwardConnection
+from lti_edu.models import StudentsEnrolled
+from lti_edu.schema import StudentsEnrolledType, StudentsEnrolledConnection
 from mainsite.graphql_utils import JSONType, UserProvisionmentResolverMixin, ContentTypeIdResolverMixin, \
     StaffResolverMixin, ImageResolverMixin, PermissionsResolverMixin, resolver_blocker_for_students, \
-    DefaultLanguageResolverMixin
+    DefaultLanguageResolverMixin, paginate, permitted
+from mainsite.graphql_loaders import get_loaders, foreign_key_resolver
+from mainsite.graphql_pagination import CountableConnection, KeysetConnectionField
 from mainsite.utils import generate_image_url
-from staff.schema import IssuerStaffType, BadgeClassStaffType
+from staff.schema import IssuerStaffType, BadgeClassStaffType, IssuerStaffConnection, BadgeClassStaffConnection
 from .models import Issuer, BadgeClass, BadgeInstance, BadgeClassExtension, IssuerExtension, BadgeInstanceExtension, \
     BadgeClassAlignment, BadgeClassTag, BadgeInstanceEvidence
+from .validation import validate_assertions
 
 
 class ExtensionResolverMixin(object):
 
     def resolve_extensions(self, info):
-        return self.cached_extensions()
+        manager = self.get_extensions_manager()
+        return get_loaders(info).load_related(manager.model, manager.field.name, self.pk)
 
 
 class ExtensionTypeMetaMixin(object):
@@ -82,6 +87,7 @@ class IssuerType(ContentTypeIdResolverMixin, PermissionsResolverMixin, StaffReso
                   'email', 'created_at', 'content_type_id', 'public_url')
 
     staff = graphene.List(IssuerStaffType)
+    staff_paginated = KeysetConnectionField(IssuerStaffConnection, ordering=('id',))
     public_badgeclasses = graphene.List(badge_class_type)
     assertion_count = graphene.Int()
     badgeclass_count = graphene.Int()
@@ -112,23 +118,27 @@ class IssuerType(ContentTypeIdResolverMixin, PermissionsResolverMixin, StaffReso
     def resolve_description(self, info):
         return self.description
 
+    resolve_faculty = foreign_key_resolver('faculty')
+
     def resolve_assertion_count(self, info):
-        return self.cached_assertions().__len__()
+        return self.get_stats()['assertion_count']
 
     def resolve_badgeclasses(self, info):
-        return self.get_badgeclasses(info.context.user, ['may_read'])
+        return get_loaders(info).load_related(BadgeClass, 'issuer', self.pk, archived=False) \
+            .then(permitted(info.context.user, ['may_read']))
 
     def resolve_badgeclass_count(self, info):
-        return self.get_badgeclasses(info.context.user, ['may_read']).__len__()
+        return IssuerType.resolve_badgeclasses(self, info).then(len)
 
     def resolve_public_badgeclasses(self, info):
-        return [bc for bc in self.cached_badgeclasses() if not bc.is_private]
+        return get_loaders(info).load_related(BadgeClass, 'issuer', self.pk, archived=False) \
+            .then(lambda badgeclasses: [bc for bc in badgeclasses if not bc.is_private])
 
     def resolve_badgeclasses_count(self, info):
         return self.badgeclasses_count
 
     def resolve_pending_enrollment_count(self, info):
-        return self.cached_pending_enrollments().__len__()
+        return self.get_stats()['pending_enrollment_count']
 
 
 def badge_user_type():
@@ -148,6 +158,9 @@ class BadgeInstanceType(ImageResolverMixin, ExtensionResolverMixin, DjangoObject
     validation = graphene.Field(JSONType)
     evidences = graphene.List(BadgeInstanceEvidenceType)
 
+    # validation calls the external validator, see mainsite.graphql_cost
+    field_costs = {'validation': {'cost': 50}}
+
     class Meta:
         model = BadgeInstance
         fields = ('entity_id', 'badgeclass', 'identifier', 'image', 'updated_at',
@@ -155,14 +168,17 @@ class BadgeInstanceType(ImageResolverMixin, ExtensionResolverMixin, DjangoObject
                   'revocation_reason', 'expires_at', 'acceptance', 'created_at',
                   'public', 'award_type')
 
+    resolve_badgeclass = foreign_key_resolver('badgeclass')
+    resolve_user = foreign_key_resolver('user')
+
     def resolve_validation(self, info, **kwargs):
-        return self.validate()
+        return get_loaders(info).load_batched(validate_assertions, self)
 
     def resolve_evidences(self, info, **kwargs):
-        return self.cached_evidence()
+        return get_loaders(info).load_related(BadgeInstanceEvidence, 'badgeinstance', self.pk)
 
 
-class BadgeInstanceConnection(Connection):
+class BadgeInstanceConnection(CountableConnection):
     class Meta:
         node = BadgeInstanceType
 
@@ -179,15 +195,22 @@ class BadgeClassType(ContentTypeIdResolverMixin, PermissionsResolverMixin, Staff
 
     direct_awards = graphene.List(DirectAwardType)
     direct_award_bundles = graphene.List(DirectAwardBundleType)
+    direct_awards_paginated = KeysetConnectionField(DirectAwardConnection)
     staff = graphene.List(BadgeClassStaffType)
+    staff_paginated = KeysetConnectionField(BadgeClassStaffConnection, ordering=('id',))
     extensions = graphene.List(BadgeClassExtensionType)
     tags = graphene.List(BadgeClassTagType)
     alignments = graphene.List(BadgeClassAlignmentType)
     enrollments = graphene.List(StudentsEnrolledType)
     pending_enrollments = graphene.List(StudentsEnrolledType)
     pending_enrollments_including_denied = graphene.List(StudentsEnrolledType)
+    enrollments_paginated = KeysetConnectionField(StudentsEnrolledConnection, ordering=('date_created', 'id'))
+    pending_enrollments_paginated = KeysetConnectionField(
+        StudentsEnrolledConnection, ordering=('date_created', 'id'),
+        count=lambda badgeclass: badgeclass.get_stats().pending_enrollment_count)
     badge_assertions = graphene.List(BadgeInstanceType)
-    assertions_paginated = ConnectionField(BadgeInstanceConnection)
+    assertions_paginated = KeysetConnectionField(BadgeInstanceConnection,
+                                                 count=lambda badgeclass: badgeclass.get_stats().assertion_count)
     assertion_count = graphene.Int()
     pending_enrollment_count = graphene.Int()
     expiration_period = graphene.Int()
@@ -197,49 +220,66 @@ class BadgeClassType(ContentTypeIdResolverMixin, PermissionsResolverMixin, Staff
     terms = graphene.Field(terms_type())
     award_allowed_institutions = graphene.List(graphene.String)
 
+    field_costs = {'badge_assertions': {'multiplier': 100}}
+
+    resolve_issuer = foreign_key_resolver('issuer')
+
     def resolve_terms(self, info, **kwargs):
         return self._get_terms()
 
     def resolve_tags(self, info, **kwargs):
-        return self.cached_tags()
+        return get_loaders(info).load_related(BadgeClassTag, 'badgeclass', self.pk)
 
     def resolve_alignments(self, info, **kwargs):
-        return self.cached_alignments()
+        return get_loaders(info).load_related(BadgeClassAlignment, 'badgeclass', self.pk)
 
     @resolver_blocker_for_students
     def resolve_direct_awards(self, info, **kwargs):
-        return self.cached_direct_awards()
+        return get_loaders(info).load_related(DirectAward, 'badgeclass', self.pk)
+
+    @resolver_blocker_for_students
+    def resolve_direct_awards_paginated(self, info, **kwargs):
+        return DirectAward.objects.filter(badgeclass=self)
 
     @resolver_blocker_for_students
     def resolve_direct_award_bundles(self, info, **kwargs):
-        return self.cached_direct_award_bundles()
+        return get_loaders(info).load_related(DirectAwardBundle, 'badgeclass', self.pk)
 
     @resolver_blocker_for_students
     def resolve_enrollments(self, info, **kwargs):
-        return self.cached_enrollments()
+        return get_loaders(info).load_related(StudentsEnrolled, 'badge_class', self.pk)
 
     @resolver_blocker_for_students
     def resolve_pending_enrollments(self, info, **kwargs):
-        return self.cached_pending_enrollments()
+        return get_loaders(info).load_related(StudentsEnrolled, 'badge_class', self.pk, badge_instance=None,
+                                              denied=False)
 
     def resolve_pending_enrollments_including_denied(self, info, **kwargs):
-        return self.cached_pending_enrollments_including_denied()
+        return get_loaders(info).load_related(StudentsEnrolled, 'badge_class', self.pk, badge_instance=None)
+
+    @resolver_blocker_for_students
+    def resolve_enrollments_paginated(self, info, **kwargs):
+        return StudentsEnrolled.objects.filter(badge_class=self)
+
+    @resolver_blocker_for_students
+    def resolve_pending_enrollments_paginated(self, info, **kwargs):
+        return StudentsEnrolled.objects.filter(badge_class=self, badge_instance=None, denied=False)
 
     @resolver_blocker_for_students
     def resolve_pending_enrollment_count(self, info, **kwargs):
-        return self.cached_pending_enrollments().__len__()
+        return self.get_stats().pending_enrollment_count
 
     @resolver_blocker_for_students
     def resolve_badge_assertions(self, info, **kwargs):
-        return self.assertions
+        return self.iter_assertions()
 
     @resolver_blocker_for_students
     def resolve_assertions_paginated(self, info, **kwargs):
-        return self.assertions
+        return self.badgeinstances.all()
 
     @resolver_blocker_for_students
     def resolve_assertion_count(self, info, **kwargs):
-        return self.assertions.__len__()
+        return self.get_stats().assertion_count
 
     def resolve_expiration_period(self, info, **kwargs):
         if self.expiration_period:
@@ -253,9 +293,9 @@ class BadgeClassType(ContentTypeIdResolverMixin, PermissionsResolverMixin, Staff
 
 
 class Query(object):
-    issuers = graphene.List(IssuerType)
-    badge_classes = graphene.List(BadgeClassType)
-    badge_classes_to_award = graphene.List(BadgeClassType)
+    issuers = graphene.List(IssuerType, first=graphene.Int(), offset=graphene.Int())
+    badge_classes = graphene.List(BadgeClassType, first=graphene.Int(), offset=graphene.Int())
+    badge_classes_to_award = graphene.List(BadgeClassType, first=graphene.Int(), offset=graphene.Int())
     public_badge_classes = graphene.List(BadgeClassType)
     badge_instances = graphene.List(BadgeInstanceType)
     revoked_badge_instances = graphene.List(BadgeInstanceType)
@@ -266,9 +306,9 @@ class Query(object):
     badge_instances_count = graphene.Int()
     badge_classes_count = graphene.Int()
 
-    def resolve_issuers(self, info, **kwargs):
-        return [issuer for issuer in Issuer.objects.filter(archived=False)
-                if issuer.has_permissions(info.context.user, ['may_read'])]
+    def resolve_issuers(self, info, first=None, offset=None, **kwargs):
+        issuers = Issuer.objects.filter(archived=False).with_permission(info.context.user, 'may_read')
+        return paginate(issuers, first, offset)
 
     def resolve_issuer(self, info, **kwargs):
         id = kwargs.get('id')
@@ -283,13 +323,13 @@ class Query(object):
             issuer = Issuer.objects.get(entity_id=id, archived=False)
             return issuer
 
-    def resolve_badge_classes(self, info, **kwargs):
-        return [bc for bc in BadgeClass.objects.filter(archived=False)
-                if bc.has_permissions(info.context.user, ['may_read'])]
+    def resolve_badge_classes(self, info, first=None, offset=None, **kwargs):
+        badgeclasses = BadgeClass.objects.filter(archived=False).with_permission(info.context.user, 'may_read')
+        return paginate(badgeclasses, first, offset)
 
-    def resolve_badge_classes_to_award(self, info, **kwargs):
-        return [bc for bc in BadgeClass.objects.filter(archived=False)
-                if bc.has_permissions(info.context.user, ['may_award'])]
+    def resolve_badge_classes_to_award(self, info, first=None, offset=None, **kwargs):
+        badgeclasses = BadgeClass.objects.filter(archived=False).with_permission(info.context.user, 'may_award')
+        return paginate(badgeclasses, first, offset)
 
     def resolve_public_badge_classes(self, info, **kwargs):
         return [bc for bc in BadgeClass.objects.filter(archived=False, is_private=False)]
@@ -7,8 +7,9 @@ from itertools import chain
 
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
 from django.core.validators import URLValidator
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.html import strip_tags
@@ -29,7 +30,7 @@ from mainsite.serializers import StripTagsCharField, MarkdownCharField, Original
 from mainsite.utils import OriginSetting, scrub_svg_image, resize_image, verify_svg, add_watermark
 from mainsite.validators import BadgeExtensionValidator
 from . import utils
-from .models import Issuer, BadgeClass, BadgeInstance, BadgeClassExtension, IssuerExtension
+from .models import Issuer, BadgeClass, BadgeClassStats, BadgeInstance, BadgeClassExtension, IssuerExtension
 
 
 class IssuerSlugRelatedField(BaseSlugRelatedField):
@@ -130,10 +131,11 @@ class IssuerSerializer(OriginalJsonSerializerMixin,
             raise BadgrValidationError("You don't have the necessary permissions", 100)
 
     def update(self, instance, validated_data):
-        if instance.assertions and instance.name_english and instance.name_english != validated_data["name_english"]:
+        has_assertions = next(instance.iter_assertions(), None) is not None
+        if has_assertions and instance.name_english and instance.name_english != validated_data["name_english"]:
             raise BadgrValidationError("Cannot change the name, assertions have already been issued within this entity",
                                        214)
-        if instance.assertions and instance.name_dutch and instance.name_dutch != validated_data["name_dutch"]:
+        if has_assertions and instance.name_dutch and instance.name_dutch != validated_data["name_dutch"]:
             raise BadgrValidationError("Cannot change the name, assertions have already been issued within this entity",
                                        214)
         [setattr(instance, attr, validated_data.get(attr)) for attr in validated_data]
@@ -291,7 +293,7 @@ class BadgeClassSerializer(OriginalJsonSerializerMixin, ExtensionsSaverMixin,
             extension.save()
 
     def update(self, instance, validated_data):
-        if instance.assertions and len([ass for ass in instance.assertions if not ass.revoked]) > 0:
+        if any(not ass.revoked for ass in instance.iter_assertions()):
             raise BadgrValidationError(
                 error_code=999,
                 error_message="Cannot change any value, assertions have already been issued")
@@ -374,6 +376,67 @@ class EvidenceItemSerializer(serializers.Serializer):
         return attrs
 
 
+def _get_expires_at(badgeclass):
+    if badgeclass.expiration_period:
+        return datetime.datetime.now().replace(microsecond=0, second=0, minute=0,
+                                               hour=0) + badgeclass.expiration_period
+    return None
+
+
+class BadgeInstanceListSerializer(serializers.ListSerializer):
+
+    def create(self, validated_data):
+        """
+        Awards all enrollments in one batch with BadgeClass.issue_many, signed badges are still issued one by one.
+        The assertions and the awarded enrollments are saved in one transaction, the emails go out after it commits.
+        """
+        request = self.context['request']
+        if request.data.get('issue_signed', False):
+            return super(BadgeInstanceListSerializer, self).create(validated_data)
+        badgeclass = request.data.get('badgeclass')
+        with transaction.atomic():
+            enrollment_entity_ids = [data.get('enrollment_entity_id') for data in validated_data]
+            enrollments_by_entity_id = StudentsEnrolled.objects.select_for_update().select_related('user').in_bulk(
+                enrollment_entity_ids, field_name='entity_id')
+            enrollments, seen = [], set()
+            for entity_id in enrollment_entity_ids:
+                enrollment = enrollments_by_entity_id.get(entity_id)
+                if enrollment is None:
+                    raise StudentsEnrolled.DoesNotExist
+                if enrollment.badge_instance_id or entity_id in seen:
+                    raise BadgrValidationError("Can't award enrollment, it has already been awarded", 213)
+                seen.add(entity_id)
+                enrollments.append(enrollment)
+
+            expires_at = _get_expires_at(badgeclass)
+            assertions = badgeclass.issue_many([
+                {'recipient': enrollment.user,
+                 'allow_uppercase': data.get('allow_uppercase'),
+                 'recipient_type': data.get('recipient_type', BadgeInstance.RECIPIENT_TYPE_EDUID),
+                 'expires_at': expires_at,
+                 'extensions': data.get('extension_items', None),
+                 'evidence': data.get('evidence_items', None),
+                 'narrative': data.get('narrative', None)}
+                for enrollment, data in zip(enrollments, validated_data)
+            ], created_by=request.user)
+
+            date_awarded = timezone.now()
+            for enrollment, assertion in zip(enrollments, assertions):
+                enrollment.date_awarded = date_awarded
+                enrollment.badge_instance = assertion
+            StudentsEnrolled.objects.bulk_update(enrollments, ['date_awarded', 'badge_instance'])
+            recipients = {enrollment.user.pk: enrollment.user for enrollment in enrollments}.values()
+            # delete the pending direct awards for this badgeclass and these users
+            eppns = list(chain.from_iterable(recipient.eppns for recipient in recipients))
+            badgeclass.cached_pending_direct_awards().filter(eppn__in=eppns).delete()
+            BadgeClassStats.objects.rebuild([badgeclass.pk], assertions=False)
+        cache.delete_many([enrollment.publish_key(field) for enrollment in enrollments for field in ('pk', 'entity_id')])
+        badgeclass.remove_cached_data(['cached_enrollments', 'cached_pending_enrollments'])
+        for recipient in recipients:
+            recipient.remove_cached_data(['cached_pending_enrollments'])
+        return assertions
+
+
 class BadgeInstanceSerializer(OriginalJsonSerializerMixin, serializers.Serializer):
     allow_uppercase = serializers.BooleanField(default=False, required=False, write_only=True)
     issue_signed = serializers.BooleanField(required=False)
@@ -384,6 +447,9 @@ class BadgeInstanceSerializer(OriginalJsonSerializerMixin, serializers.Serialize
     narrative = MarkdownCharField(required=False, allow_blank=True, allow_null=True)
     evidence_items = EvidenceItemSerializer(many=True, required=False)
 
+    class Meta:
+        list_serializer_class = BadgeInstanceListSerializer
+
     def get_recipient_email(self, obj):
         return obj.get_email_address()
 
@@ -455,10 +521,7 @@ class BadgeInstanceSerializer(OriginalJsonSerializerMixin, serializers.Serialize
         """
         badgeclass = self.context['request'].data.get('badgeclass')
         enrollment = StudentsEnrolled.objects.get(entity_id=validated_data.get('enrollment_entity_id'))
-        expires_at = None
-        if badgeclass.expiration_period:
-            expires_at = datetime.datetime.now().replace(microsecond=0, second=0, minute=0,
-                                                         hour=0) + badgeclass.expiration_period
+        expires_at = _get_expires_at(badgeclass)
         if enrollment.badge_instance:
             raise BadgrValidationError("Can't award enrollment, it has already been awarded", 213)
         if self.context['request'].data.get('issue_signed', False):
@@ -492,4 +555,5 @@ class BadgeInstanceSerializer(OriginalJsonSerializerMixin, serializers.Serialize
         enrollment.user.remove_cached_data(['cached_pending_enrollments'])
         # delete the pending direct awards for this badgeclass and this user
         badgeclass.cached_pending_direct_awards().filter(eppn__in=enrollment.user.eppns).delete()
+        BadgeClassStats.objects.rebuild([badgeclass.pk], assertions=False, enrollments=False)
         return assertion
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.files.storage import DefaultStorage
+
+from issuer.models import BadgeClass, BadgeInstance
+from mainsite.celery import app
+
+bake_task_queue_name = getattr(settings, 'BAKE_TASK_QUEUE_NAME',
+                               getattr(settings, 'BACKGROUND_TASK_QUEUE_NAME', 'default'))
+email_task_queue_name = getattr(settings, 'EMAIL_TASK_QUEUE_NAME',
+                                getattr(settings, 'BACKGROUND_TASK_QUEUE_NAME', 'default'))
+
+
+@app.task(bind=True, queue=bake_task_queue_name)
+def bake_assertions(self, badgeinstance_ids, replace_image=False):
+    badgeinstances = BadgeInstance.objects.filter(pk__in=badgeinstance_ids,
+                                                  bake_status__in=[BadgeInstance.BAKE_STATUS_PENDING,
+                                                                   BadgeInstance.BAKE_STATUS_FAILED])
+    failed_ids = []
+    for badgeinstance in badgeinstances:
+        badgeinstance.bake(replace_image=replace_image)
+        if badgeinstance.bake_status == BadgeInstance.BAKE_STATUS_FAILED:
+            failed_ids.append(badgeinstance.pk)
+    max_retries = getattr(settings, 'BAKE_TASK_MAX_RETRIES', 3)
+    if failed_ids and self.request.retries < max_retries:
+        # back off, a failure is often a storage hiccup
+        countdown = getattr(settings, 'BAKE_TASK_RETRY_DELAY', 60) * 2 ** self.request.retries
+        raise self.retry(args=[failed_ids], kwargs={'replace_image': replace_image}, countdown=countdown,
+                         max_retries=max_retries)
+
+
+@app.task(bind=True, queue=bake_task_queue_name)
+def delete_images(self, image_names):
+    storage = DefaultStorage()
+    for name in image_names:
+        storage.delete(name)
+
+
+@app.task(bind=True, queue=email_task_queue_name)
+def send_earned_badge_mails(self, badgeclass_id, badgeinstance_ids):
+    badgeinstances = list(BadgeInstance.objects.filter(pk__in=badgeinstance_ids, revoked=False).select_related('user'))
+    if badgeinstances:
+        BadgeClass.objects.get(pk=badgeclass_id).send_earned_badge_mails(badgeinstances)
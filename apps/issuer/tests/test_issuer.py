@@ -1,17 +1,40 @@
 import copy
+import gzip
+import io
 import json
 import os
+import uuid
+from base64 import urlsafe_b64encode
+from unittest import mock
 
-from django.db import IntegrityError
+import requests
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.db.models import ProtectedError
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
+from openbadges_bakery import bake
+from PIL import Image
 
 from directaward.models import DirectAward
 from institution.models import Institution
-from issuer.models import Issuer
+from issuer import baking
+from issuer.models import Issuer, BadgeClass, BadgeClassStats, BadgeInstance, IssuerStatusList
 from issuer.testfiles.helper import issuer_json, badgeclass_json
+from issuer.utils import UNVERSIONED_BAKED_VERSION
+from issuer import validation
+from issuer.validation import validate_assertions
+from issuer.verification import resolve_local_assertion, verify_assertion
 from mainsite.exceptions import BadgrValidationFieldError, BadgrValidationMultipleFieldError
+from mainsite.image_derivatives import generate_derivatives
+from mainsite.models import ImageDerivative
 from mainsite.tests import BadgrTestCase
+from signing.models import PublicKey, PublicKeyIssuer
 
 
 class IssuerAPITest(BadgrTestCase):
@@ -30,6 +53,30 @@ class IssuerAPITest(BadgrTestCase):
                                     json.dumps(post_data), content_type='application/json')
         self.assertEqual(response.status_code, 200)
 
+    def test_assertion_revoking_many(self):
+        teacher1 = self.setup_teacher(authenticate=True)
+        self.setup_staff_membership(teacher1, teacher1.institution, may_award=True)
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclasses = [self.setup_badgeclass(issuer=issuer) for _ in range(2)]
+        assertions = [self.setup_assertion(recipient=student, badgeclass=badgeclass, created_by=teacher1)
+                      for badgeclass in badgeclasses for _ in range(2)]
+        self.assertEqual(len(student.cached_badgeinstances()), 4)
+        post_data = {'revocation_reason': 'revocation_reason',
+                     'assertions': [{'entity_id': assertion.entity_id} for assertion in assertions[1:]]}
+        response = self.client.post('/issuer/revoke-assertions',
+                                    json.dumps(post_data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        revoked = BadgeInstance.objects.filter(revoked=True, revocation_reason='revocation_reason', image='')
+        self.assertEqual(revoked.count(), 3)
+        self.assertEqual(len([a for a in student.cached_badgeinstances() if a.revoked]), 3)
+        self.assertEqual(badgeclasses[1].get_stats().revoked_count, 2)
+        self.assertTrue(all(assertion.revoked for assertion in badgeclasses[1].iter_assertions()))
+        response = self.client.post('/issuer/revoke-assertions',
+                                    json.dumps(post_data), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
     def test_create_issuer(self):
         teacher1 = self.setup_teacher(authenticate=True)
         self.setup_staff_membership(teacher1, teacher1.institution, may_create=True)
@@ -244,6 +291,27 @@ class IssuerAPITest(BadgrTestCase):
         self.assertEqual(award_response.status_code, 201)
         self.assertFalse(DirectAward.objects.filter(pk=direct_award.pk).exists())
 
+    def test_award_duplicate_enrollments(self):
+        teacher1 = self.setup_teacher(authenticate=True)
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        self.setup_staff_membership(teacher1, teacher1.institution, may_award=True, may_read=True)
+        enrollment = self.enroll_user(student, badgeclass)
+        award_body = {"issue_signed": False,
+                      "enrollments": [{"enrollment_entity_id": enrollment.entity_id, "narrative": "Narrative"},
+                                      {"enrollment_entity_id": enrollment.entity_id, "narrative": "Narrative"}]}
+        response = self.client.post('/issuer/badgeclasses/award-enrollments/{}'.format(badgeclass.entity_id),
+                                    json.dumps(award_body), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(BadgeInstance.objects.filter(badgeclass=badgeclass).exists())
+        award_body['enrollments'].pop()
+        response = self.client.post('/issuer/badgeclasses/award-enrollments/{}'.format(badgeclass.entity_id),
+                                    json.dumps(award_body), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(BadgeInstance.objects.filter(badgeclass=badgeclass).count(), 1)
+
     def test_enrollment_denial(self):
         teacher1 = self.setup_teacher(authenticate=True)
         student = self.setup_student(affiliated_institutions=[teacher1.institution])
@@ -266,7 +334,7 @@ class IssuerAPITest(BadgrTestCase):
         faculty = self.setup_faculty(institution=teacher1.institution)
         issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
         badgeclass = self.setup_badgeclass(issuer=issuer)
-        assertion = self.setup_assertion(student, badgeclass, teacher1)
+        assertion = self.reload_from_db(self.setup_assertion(student, badgeclass, teacher1))
         response = self.client.get('/media/uploads/badges/{}'.format(os.path.basename(assertion.image.path)))
         self.assertEqual(response.status_code, 403)
         self.authenticate(outside_teacher)
@@ -304,6 +372,87 @@ class IssuerPublicAPITest(BadgrTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['name'], assertion.get_recipient_name())
 
+    def test_conditional_requests(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student()
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(teacher1, faculty=faculty)
+        badgeclass = self.setup_badgeclass(issuer)
+        assertion = self.setup_assertion(student, badgeclass, teacher1)
+        assertion.public = True
+        assertion.save()
+        url = '/public/assertions/{}'.format(assertion.entity_id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('Accept', response['Vary'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertNotEqual(self.client.get(url + '?expand=badge').get('ETag'), etag)
+        issuer.name = 'Changed issuer'
+        issuer.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        badgeclass_url = '/public/badges/{}'.format(badgeclass.entity_id)
+        response = self.client.get(badgeclass_url)
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(self.client.get(badgeclass_url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        badgeclass.is_private = True
+        badgeclass.save()
+        self.assertEqual(self.client.get(badgeclass_url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+
+    def test_rendered_json_cache(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student()
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(teacher1, faculty=faculty)
+        badgeclass = self.setup_badgeclass(issuer)
+        assertion = self.setup_assertion(student, badgeclass, teacher1)
+        assertion.public = True
+        assertion.save()
+        url = '/public/assertions/{}'.format(assertion.entity_id)
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        content = json.loads(response.content.decode('utf-8'))
+        with mock.patch('public.public_api.BadgeInstanceJson.get_json') as get_json:
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertTrue(response['ETag'].startswith('W/'))
+            self.assertEqual(json.loads(gzip.decompress(response.content).decode('utf-8')), content)
+            response = self.client.get(url)
+            self.assertEqual(json.loads(response.content.decode('utf-8')), content)
+            self.assertFalse(get_json.called)
+        assertion.acceptance = BadgeInstance.ACCEPTANCE_ACCEPTED
+        assertion.save()
+        with mock.patch('public.public_api.BadgeInstanceJson.get_json', return_value={}) as get_json:
+            self.client.get(url)
+            self.assertTrue(get_json.called)
+
+    def test_image_derivatives(self):
+        teacher1 = self.setup_teacher()
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(teacher1, faculty=faculty)
+        badgeclass = self.setup_badgeclass(issuer)
+        url = '/public/badges/{}/image'.format(badgeclass.entity_id)
+        self.assertEqual(self.client.get(url)['Location'], badgeclass.image.url)
+        generate_derivatives([badgeclass.image.name])
+        self.assertEqual(ImageDerivative.objects.filter(source=badgeclass.image.name).count(), 3)
+        with mock.patch('mainsite.image_derivatives.render_derivative') as render_derivative:
+            response = self.client.get(url + '?type=png&fmt=wide')
+            self.assertFalse(render_derivative.called)
+        wide = ImageDerivative.objects.get(source=badgeclass.image.name, key='wide')
+        self.assertEqual(response['Location'], wide.image.url)
+        self.assertEqual(Image.open(wide.image).size, (764, 400))
+        response = self.client.get(url + '?type=png&size=64')
+        square = ImageDerivative.objects.get(source=badgeclass.image.name, key='square-64')
+        self.assertEqual(response['Location'], square.image.url)
+        self.assertEqual(Image.open(square.image).size, (64, 64))
+        self.assertEqual(self.client.get(url + '?type=png&size=4096').status_code, 400)
+
 
 # class IssuerExtensionsTest(BadgrTestCase):
 #
@@ -433,6 +582,318 @@ class IssuerModelsTest(BadgrTestCase):
         self.assertEqual(assertion_data['evidence'][0]['id'], 'http://valid.com')
         self.assertEqual(assertion_data['narrative'], 'assertion narrative')
 
+    def test_issue_many(self):
+        teacher1 = self.setup_teacher()
+        students = [self.setup_student(affiliated_institutions=[teacher1.institution]) for _ in range(3)]
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        evidence_items = [{'evidence_url': 'http://valid.com', 'narrative': 'Some narrative'}]
+        assertions = badgeclass.issue_many([{'recipient': student, 'evidence': evidence_items,
+                                             'narrative': 'assertion narrative'} for student in students],
+                                           created_by=teacher1, send_email=False)
+        self.assertEqual([assertion.user for assertion in assertions], students)
+        self.assertEqual(badgeclass.cached_assertions().__len__(), 3)
+        for student, assertion in zip(students, assertions):
+            self.assertEqual(student.cached_badgeinstances().__len__(), 1)
+            assertion = self.reload_from_db(assertion)
+            self.assertTrue(bool(assertion.image))
+            assertion_data = assertion.get_json()
+            self.assertEqual(assertion_data['evidence'][0]['id'], 'http://valid.com')
+            self.assertEqual(assertion_data['narrative'], 'assertion narrative')
+
+    def test_badgeclass_stats(self):
+        teacher1 = self.setup_teacher()
+        student1 = self.setup_student(affiliated_institutions=[teacher1.institution])
+        student2 = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        enrollment = self.enroll_user(student1, badgeclass)
+        denied_enrollment = self.enroll_user(student2, badgeclass)
+        denied_enrollment.denied = True
+        denied_enrollment.save()
+        self.setup_direct_award(badgeclass, eppn='some_eppn', recipient_email='some@email.com')
+        assertion = self.setup_assertion(recipient=student1, badgeclass=badgeclass, created_by=teacher1)
+        badgeclass.issue_many([{'recipient': student1}, {'recipient': student2}], created_by=teacher1,
+                              send_email=False)
+        assertion.acceptance = BadgeInstance.ACCEPTANCE_ACCEPTED
+        assertion.save()
+        assertion.revoke('revocation reason')
+        enrollment.delete()
+        stats = badgeclass.get_stats()
+        self.assertEqual(stats.assertion_count, 3)
+        self.assertEqual(stats.revoked_count, 1)
+        self.assertEqual(stats.accepted_count, 0)
+        self.assertEqual(stats.recipient_count, 2)
+        self.assertEqual(stats.pending_enrollment_count, 0)
+        self.assertEqual(stats.denied_enrollment_count, 1)
+        self.assertEqual(stats.pending_direct_award_count, 1)
+        self.assertEqual(BadgeClassStats.objects.rebuild([badgeclass.pk]), 0)
+        self.assertEqual(issuer.get_stats()['assertion_count_informal'], 3)
+        self.assertEqual(faculty.get_stats()['revoked_count'], 1)
+        BadgeClassStats.objects.filter(badgeclass=badgeclass).update(assertion_count=0)
+        self.assertEqual(BadgeClassStats.objects.rebuild([badgeclass.pk]), 1)
+        self.assertEqual(badgeclass.get_stats().assertion_count, 3)
+
+    def test_sync_related_items(self):
+        """the related item setters write the difference in bulk and publish the badgeclass once"""
+        teacher1 = self.setup_teacher()
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        alignments = [{'target_name': 'name {}'.format(i), 'target_url': 'https://example.org/{}'.format(i)}
+                      for i in range(3)]
+        badgeclass.alignment_items = alignments
+        badgeclass.tag_items = ['one', 'two']
+        badgeclass.extension_items = {'extensions:LanguageExtension': {'Language': 'en_EN'}}
+        kept_alignment = badgeclass.badgeclassalignment_set.get(target_name='name 0')
+        with mock.patch.object(BadgeClass, 'publish') as publish:
+            with transaction.atomic():
+                badgeclass.alignment_items = alignments[:1] + [{'target_name': 'new',
+                                                                'target_url': 'https://example.org/new'}]
+                badgeclass.tag_items = ['two', 'three']
+                badgeclass.extension_items = {'extensions:LanguageExtension': {'Language': 'nl_NL'}}
+                self.assertEqual(publish.call_count, 0)
+            self.assertEqual(publish.call_count, 1)
+        self.assertEqual(sorted(a.target_name for a in badgeclass.cached_alignments()), ['name 0', 'new'])
+        self.assertTrue(badgeclass.badgeclassalignment_set.filter(pk=kept_alignment.pk).exists())
+        self.assertEqual(sorted(t.name for t in badgeclass.cached_tags()), ['three', 'two'])
+        self.assertEqual(badgeclass.extension_items['extensions:LanguageExtension'], {'Language': 'nl_NL'})
+        with mock.patch.object(BadgeClass, 'publish') as publish:
+            badgeclass.tag_items = ['three', 'two']
+            self.assertEqual(publish.call_count, 0)
+
+    def test_segmented_assertions_cache(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        with self.settings(SEGMENTED_CACHE_CHUNK_SIZE=2):
+            assertions = badgeclass.issue_many([{'recipient': student} for _ in range(3)], created_by=teacher1,
+                                               send_email=False)
+            self.assertEqual([a.pk for a in badgeclass.iter_assertions()], [a.pk for a in assertions])
+            self.assertEqual(len(badgeclass.assertions_cache.get_manifest()['starts']), 2)
+            assertions[0].revoke('revocation reason')
+            self.assertTrue(next(badgeclass.iter_assertions()).revoked)
+            assertions += badgeclass.issue_many([{'recipient': student} for _ in range(3)], created_by=teacher1,
+                                                send_email=False)
+            self.assertEqual([a.pk for a in issuer.iter_assertions()], [a.pk for a in assertions])
+            self.assertEqual(len(badgeclass.assertions_cache.get_manifest()['starts']), 3)
+            assertions[-1].delete()
+            self.assertEqual(len(badgeclass.cached_assertions()), 5)
+            self.assertEqual(len(issuer.cached_assertions()), 5)
+            badgeclass.publish()
+            self.assertIsNone(cache.get(badgeclass.assertions_cache.manifest_key))
+
+    def test_lazy_bake(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        assertion = self.reload_from_db(self.setup_assertion(student, badgeclass, teacher1))
+        self.assertEqual(assertion.bake_status, BadgeInstance.BAKE_STATUS_BAKED)
+        BadgeInstance.objects.filter(pk=assertion.pk).update(image=None, bake_status=BadgeInstance.BAKE_STATUS_PENDING)
+        assertion = self.reload_from_db(assertion)
+        self.assertFalse(bool(assertion.image))
+        self.assertTrue(assertion.entity_id in assertion.image_url())
+        assertion.ensure_baked()
+        assertion = self.reload_from_db(assertion)
+        self.assertEqual(assertion.bake_status, BadgeInstance.BAKE_STATUS_BAKED)
+        self.assertTrue(os.path.exists(assertion.image.path))
+
+    def test_failed_bake(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        assertion = self.setup_assertion(student, badgeclass, teacher1)
+        BadgeInstance.objects.filter(pk=assertion.pk).update(image=None, bake_status=BadgeInstance.BAKE_STATUS_PENDING)
+        assertion = self.reload_from_db(assertion)
+        with mock.patch.object(baking, 'bake', side_effect=ValueError('cannot bake')) as bake_mock:
+            assertion.ensure_baked()
+            self.assertEqual(assertion.bake_status, BadgeInstance.BAKE_STATUS_FAILED)
+            # only the worker retries a failed bake
+            assertion.ensure_baked()
+            self.assertEqual(bake_mock.call_count, 1)
+            self.assertEqual(assertion.get_baked_image_url(obi_version=UNVERSIONED_BAKED_VERSION),
+                             badgeclass.image.url)
+        response = self.client.get('/public/assertions/{}/image'.format(assertion.entity_id))
+        self.assertEqual(response.status_code, 404)
+
+    def test_baking_template_cache(self):
+        teacher1 = self.setup_teacher()
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        for assertion_id in ['https://example.org/1', 'https://example.org/2']:
+            assertion_json_string = json.dumps({'id': assertion_id})
+            expected = io.BytesIO()
+            bake(image_file=badgeclass.image.file, assertion_json_string=assertion_json_string, output_file=expected)
+            self.assertEqual(baking.bake(badgeclass.image, assertion_json_string), expected.getvalue())
+
+    def test_get_json_document_cache_invalidation(self):
+        """cached json documents are rebuilt when an entity they depend on changes"""
+        teacher1 = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        assertion = self.setup_assertion(student, badgeclass, teacher1)
+        assertion_data = assertion.get_json(expand_badgeclass=True, expand_issuer=True)
+        assertion_data['badge']['name'] = 'mutated by caller'
+        self.assertEqual(assertion.get_json(expand_badgeclass=True, expand_issuer=True), assertion.get_json(
+            expand_badgeclass=True, expand_issuer=True))
+        self.assertNotEqual(assertion.get_json(expand_badgeclass=True)['badge']['name'], 'mutated by caller')
+        badgeclass.name = 'Renamed badgeclass'
+        badgeclass.save()
+        self.assertEqual(assertion.get_json(expand_badgeclass=True)['badge']['name'], 'Renamed badgeclass')
+        institution = teacher1.institution
+        institution.brin = 'NEWBRIN'
+        institution.save()
+        issuer_json = assertion.get_json(expand_badgeclass=True, expand_issuer=True)['badge']['issuer']
+        self.assertEqual(issuer_json['extensions:InstitutionIdentifierExtension']['InstitutionIdentifier'], 'NEWBRIN')
+        assertion.revoke('revoked for test')
+        self.assertTrue(assertion.get_json()['revoked'])
+
+    def test_assertion_validation(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        assertions = badgeclass.issue_many([{'recipient': student} for _ in range(3)], created_by=teacher1,
+                                           send_email=False)
+        with mock.patch.object(validation, 'verify_assertion', wraps=verify_assertion) as validate:
+            results = validate_assertions(assertions)
+            self.assertEqual(validate.call_count, 3)
+            self.assertTrue(all(result['report']['valid'] for result in results))
+            self.assertEqual(validate_assertions(assertions), results)
+            self.assertEqual(validate.call_count, 3)
+            assertions[0].revoke('revoked for test')
+            results = validate_assertions(assertions)
+            self.assertEqual(validate.call_count, 4)
+            self.assertFalse(results[0]['report']['valid'])
+            self.assertTrue(results[1]['report']['valid'])
+
+    def test_validator_failure_not_cached(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        assertion = self.setup_assertion(recipient=student, badgeclass=badgeclass, created_by=teacher1)
+        BadgeInstance.objects.filter(pk=assertion.pk).update(source_url='https://example.org/assertions/1')
+        assertion = self.reload_from_db(assertion)
+        response = mock.Mock(**{'raise_for_status.side_effect': requests.HTTPError('503 Service Unavailable')})
+        with override_settings(ASSERTION_VALIDATOR_BACKEND='issuer.validation.RemoteValidatorBackend'), \
+                mock.patch.object(validation.requests, 'post', return_value=response) as post:
+            result = validate_assertions([assertion])[0]
+            self.assertFalse(result['report']['valid'])
+            self.assertEqual(result['report']['messages'][0]['name'], 'VALIDATOR_UNAVAILABLE')
+            validate_assertions([assertion])
+            self.assertEqual(post.call_count, 2)
+
+    def test_local_verification(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        assertion = self.setup_assertion(recipient=student, badgeclass=badgeclass, created_by=teacher1)
+        self.assertEqual(resolve_local_assertion(assertion.jsonld_id), assertion)
+        self.assertEqual(resolve_local_assertion(json.dumps({'id': assertion.jsonld_id})), assertion)
+        result = verify_assertion(assertion, recipient_profile={'id': assertion.recipient_identifier})
+        self.assertTrue(result['report']['valid'])
+        self.assertEqual([node['type'] for node in result['graph']], ['Assertion', 'BadgeClass', 'Issuer'])
+        result = verify_assertion(assertion, recipient_profile={'email': ['someone.else@example.org']})
+        self.assertEqual([m['name'] for m in result['report']['messages']], ['VERIFY_RECIPIENT_IDENTIFIER'])
+
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        public_key_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode('ascii')
+        public_key = PublicKey.objects.create(public_key_pem=public_key_pem, time_created=timezone.now())
+        public_key_issuer = PublicKeyIssuer.objects.create(issuer=issuer, public_key=public_key)
+        identifier = 'urn:uuid:{}'.format(uuid.uuid4())
+
+        def _segment(value):
+            return urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii').rstrip('=')
+
+        signing_input = '{}.{}'.format(_segment({'alg': 'RS256'}), _segment({'id': identifier}))
+        signature = private_key.sign(signing_input.encode('ascii'), padding.PKCS1v15(), hashes.SHA256())
+        jws = '{}.{}'.format(signing_input, urlsafe_b64encode(signature).decode('ascii').rstrip('='))
+        BadgeInstance.objects.filter(pk=assertion.pk).update(identifier=identifier, signature=jws,
+                                                             public_key_issuer=public_key_issuer)
+        assertion.refresh_from_db()
+        self.assertEqual(resolve_local_assertion(jws), assertion)
+        self.assertTrue(verify_assertion(assertion)['report']['valid'])
+        assertion.signature = '{}.{}.{}'.format(_segment({'alg': 'RS256'}), _segment({'id': 'tampered'}),
+                                                jws.split('.')[2])
+        result = verify_assertion(assertion)
+        self.assertEqual([m['name'] for m in result['report']['messages']], ['VERIFY_JWS'])
+        assertion.revoked = True
+        self.assertFalse(verify_assertion(assertion)['report']['valid'])
+
+    def test_recipient_hash(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        assertion = self.setup_assertion(recipient=student, badgeclass=badgeclass, created_by=teacher1)
+        assertions = badgeclass.issue_many([{'recipient': student} for _ in range(2)], created_by=teacher1,
+                                           send_email=False)
+        for instance in [assertion] + assertions:
+            self.assertEqual(instance.recipient_hash, instance.get_json()['recipient']['identity'])
+        BadgeInstance.objects.filter(pk__in=[a.pk for a in assertions]).update(recipient_hash=None)
+        self.assertEqual(BadgeInstance.objects.backfill_recipient_hashes(chunk_size=1), 2)
+        self.assertEqual(BadgeInstance.objects.backfill_recipient_hashes(), 0)
+        by_hash = BadgeInstance.objects.get_by_recipient_hashes([a.get_hashed_identity() for a in assertions])
+        self.assertEqual(sorted(i.pk for i in by_hash.values()), sorted(a.pk for a in assertions))
+
+    def test_revocation_status_list(self):
+        teacher1 = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        assertion = self.setup_assertion(recipient=student, badgeclass=badgeclass, created_by=teacher1)
+        assertions = [assertion] + badgeclass.issue_many([{'recipient': student} for _ in range(3)],
+                                                         created_by=teacher1, send_email=False)
+        self.assertEqual([a.status_index for a in assertions], [0, 1, 2, 3])
+        self.assertEqual(assertion.get_json()['credentialStatus']['statusListIndex'], '0')
+        url = '/public/issuers/{}/status-list'.format(issuer.entity_id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age', response['Cache-Control'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        badgeclass.issue_many([{'recipient': student}], created_by=teacher1, send_email=False)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['size'], 5)
+        etag = response['ETag']
+
+        assertion.revoke('revoked for test')
+        BadgeInstance.objects.revoke_many(assertions[2:], 'revoked for test')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        status_list = IssuerStatusList(encoded_list=response.json()['encodedList'], size=response.json()['size'])
+        self.assertEqual([status_list.is_revoked(index) for index in range(4)], [True, False, True, True])
+        self.assertEqual(len(status_list.get_bitstring()), IssuerStatusList.STATUS_LIST_MIN_BITS // 8)
+
+        BadgeInstance.objects.filter(pk=assertions[1].pk).update(status_index=None)
+        IssuerStatusList.objects.filter(issuer=issuer).update(encoded_list='')
+        self.assertEqual(IssuerStatusList.objects.rebuild([issuer.pk]), 1)
+        self.assertEqual(BadgeInstance.objects.get(pk=assertions[1].pk).status_index, 5)
+        self.assertEqual(IssuerStatusList.objects.rebuild([issuer.pk]), 0)
+        status_list = IssuerStatusList.objects.get(issuer=issuer)
+        self.assertEqual([status_list.is_revoked(index) for index in range(6)],
+                         [True, False, True, True, False, False])
+
 
 class IssuerSchemaTest(BadgrTestCase):
 
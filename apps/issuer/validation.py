@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urljoin
+
+import requests
+from cachemodel.utils import generate_cache_key
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from entity.cache import bump_revisions, get_revisions
+from issuer.utils import generate_sha256_hashstring
+from issuer.verification import verify_assertion
+
+logger = logging.getLogger('Badgr.Debug')
+
+
+class RemoteValidatorBackend(object):
+    """Validates assertions with the Open Badges validator service at VALIDATOR_URL"""
+
+    def validate(self, data):
+        response = requests.post(json=data,
+                                 url=urljoin(settings.VALIDATOR_URL, 'results'),
+                                 headers={'Accept': 'application/json'},
+                                 timeout=getattr(settings, 'ASSERTION_VALIDATION_REQUEST_TIMEOUT', 30))
+        response.raise_for_status()
+        return response.json()
+
+
+class LocalValidatorBackend(object):
+    """
+    Validates the assertion json in process, for tests and offline use. It checks the structure, revocation,
+    expiry and recipient of the assertion and answers with a report in the format of the validator service, but does
+    not fetch or verify the badgeclass and issuer.
+    """
+    REQUIRED_PROPERTIES = ('@context', 'type', 'id', 'recipient', 'issuedOn')
+
+    def validate(self, data):
+        assertion = data['data']
+        errors = []
+        if assertion.get('revoked'):
+            errors.append('Assertion {} has been revoked'.format(assertion.get('id')))
+        else:
+            errors += ['Required property {} not present'.format(name)
+                       for name in self.REQUIRED_PROPERTIES if not assertion.get(name)]
+            if assertion.get('type') != 'Assertion':
+                errors.append('Object is not an Assertion')
+            expires = parse_datetime(assertion['expires']) if assertion.get('expires') else None
+            if expires and expires < timezone.now():
+                errors.append('Assertion expired on {}'.format(assertion['expires']))
+            recipient = assertion.get('recipient') or {}
+            identity = (data.get('profile') or {}).get('id')
+            if identity and recipient.get('identity'):
+                if recipient.get('hashed'):
+                    matches = generate_sha256_hashstring(identity.lower(), recipient.get('salt')) == \
+                        recipient['identity']
+                else:
+                    matches = identity == recipient['identity']
+                if not matches:
+                    errors.append('Recipient {} does not match the assertion'.format(identity))
+        return {
+            'input': {'value': assertion.get('id'), 'input_type': 'id'},
+            'graph': [assertion],
+            'report': {
+                'valid': not errors,
+                'errorCount': len(errors),
+                'warningCount': 0,
+                'messages': [{'messageLevel': 'ERROR', 'result': error} for error in errors],
+                'validationSubject': assertion.get('id'),
+                'openBadgesVersion': '2.0',
+            },
+        }
+
+
+def get_validator_backend():
+    return import_string(getattr(settings, 'ASSERTION_VALIDATOR_BACKEND',
+                                 'issuer.validation.RemoteValidatorBackend'))()
+
+
+def _validation_data(instance):
+    return {'profile': {'id': instance.recipient_identifier}, 'data': instance.get_json()}
+
+
+def _validation_cache_key(instance, data, revision):
+    data_hash = hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+    return generate_cache_key(['AssertionValidation', instance.pk], data=data_hash, revision=revision)
+
+
+def _cache_timeout(instance):
+    """The result of an assertion that expires is not cached beyond the moment it expires"""
+    timeout = getattr(settings, 'ASSERTION_VALIDATION_CACHE_TIMEOUT', 60 * 60 * 24)
+    if instance.expires_at:
+        timeout = max(min(timeout, int((instance.expires_at - timezone.now()).total_seconds())), 0)
+    return timeout
+
+
+def _validate_uncached(backend, data):
+    """
+    :return: tuple of the result of the backend and whether it may be cached. When the validator fails or does not
+    answer with a report, the result is an error report that is not cached, so the next validation tries again.
+    """
+    try:
+        result = backend.validate(data)
+    except (requests.RequestException, ValueError) as e:
+        logger.warning('Validating assertion {} failed: {}'.format(data['data'].get('id'), e))
+    else:
+        if isinstance(result, dict) and isinstance(result.get('report'), dict) and 'valid' in result['report']:
+            return result, True
+        logger.warning('Validating assertion {} returned no report'.format(data['data'].get('id')))
+    return {
+        'input': {'value': data['data'].get('id'), 'input_type': 'id'},
+        'graph': [],
+        'report': {
+            'valid': False,
+            'errorCount': 1,
+            'warningCount': 0,
+            'messages': [{'name': 'VALIDATOR_UNAVAILABLE', 'messageLevel': 'ERROR',
+                          'result': 'The assertion could not be validated, try again later'}],
+            'validationSubject': data['data'].get('id'),
+            'openBadgesVersion': '2.0',
+        },
+    }, False
+
+
+def validate_assertions(instances):
+    """
+    Validates the assertions. Assertions hosted by this server are verified in process, the ones imported from
+    elsewhere with the validator backend. Results are cached by the json of the assertion until it is revoked or
+    baked again, the uncached imported ones are validated concurrently by at most ASSERTION_VALIDATION_MAX_WORKERS
+    threads. A failure of the validator is reported but not cached.
+    :return: list with the validation result of each assertion
+    """
+    instances = list(instances)
+    if not instances:
+        return []
+    revisions = get_revisions([('AssertionValidation', instance.pk) for instance in instances])
+    data = [_validation_data(instance) for instance in instances]
+    keys = [_validation_cache_key(instance, instance_data, revision)
+            for instance, instance_data, revision in zip(instances, data, revisions)]
+    results = cache.get_many(keys)
+
+    missing = [index for index, key in enumerate(keys) if key not in results]
+    hosted = [index for index in missing if not instances[index].source_url]
+    imported = [index for index in missing if instances[index].source_url]
+    validated = [(verify_assertion(instances[index], recipient_profile=data[index]['profile']), True)
+                 for index in hosted]
+    if imported:
+        backend = get_validator_backend()
+        max_workers = min(getattr(settings, 'ASSERTION_VALIDATION_MAX_WORKERS', 8), len(imported))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            validated += list(executor.map(partial(_validate_uncached, backend), [data[index] for index in imported]))
+    for index, (result, cacheable) in zip(hosted + imported, validated):
+        results[keys[index]] = result
+        timeout = _cache_timeout(instances[index])
+        if cacheable and timeout:
+            cache.set(keys[index], result, timeout)
+    return [results[key] for key in keys]
+
+
+def invalidate_validations(pks):
+    """Drops the cached validation results of assertions, e.g. after they are revoked or baked again"""
+    if pks:
+        bump_revisions([('AssertionValidation', pk) for pk in pks])
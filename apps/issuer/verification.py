@@ -0,0 +1,165 @@
+"""
+In process verification of the assertions hosted by this server.
+
+The assertion, badgeclass and issuer nodes are resolved from the database and their materialized json documents
+instead of being fetched over HTTP, signed assertions are verified against the signing.PublicKey of their issuer.
+Only assertions imported from elsewhere go to the validator service or openbadges.verify.
+"""
+import base64
+import binascii
+import json
+import re
+
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from django.utils import timezone
+
+from issuer.utils import generate_sha256_hashstring
+
+COMPACT_JWS = re.compile(r'^[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*$')
+
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def decode_jws_payload(jws):
+    """:return: the payload of a compact JWS without verifying it"""
+    try:
+        return json.loads(_b64decode(jws.split('.')[1]).decode('utf-8'))
+    except (IndexError, binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Not a compact JWS')
+
+
+def verify_jws(jws, public_key_pem):
+    """
+    Verifies a compact JWS signed with RS256 or ES256
+    :return: the payload, raises ValueError when the signature does not verify with the public key
+    """
+    try:
+        header_segment, payload_segment, signature_segment = jws.split('.')
+        header = json.loads(_b64decode(header_segment).decode('utf-8'))
+        signature = _b64decode(signature_segment)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Not a compact JWS')
+    signing_input = '{}.{}'.format(header_segment, payload_segment).encode('ascii')
+    try:
+        public_key = serialization.load_pem_public_key(public_key_pem.encode('ascii'), backend=default_backend())
+    except (UnsupportedAlgorithm, ValueError):
+        raise ValueError('Invalid public key')
+    algorithm = header.get('alg')
+    try:
+        if algorithm == 'RS256' and isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(signature, signing_input, padding.PKCS1v15(), hashes.SHA256())
+        elif algorithm == 'ES256' and isinstance(public_key, ec.EllipticCurvePublicKey):
+            half = len(signature) // 2
+            signature = encode_dss_signature(int.from_bytes(signature[:half], 'big'),
+                                             int.from_bytes(signature[half:], 'big'))
+            public_key.verify(signature, signing_input, ec.ECDSA(hashes.SHA256()))
+        else:
+            raise ValueError('Unsupported signature algorithm {}'.format(algorithm))
+    except InvalidSignature:
+        raise ValueError('Signature does not verify')
+    return decode_jws_payload(jws)
+
+
+def resolve_local_assertion(reference):
+    """
+    :param reference: url, json node or signed JWS of an assertion
+    :return: the BadgeInstance hosted by this server the reference points to, or None
+    """
+    from issuer.models import BadgeInstance
+    if isinstance(reference, bytes):
+        reference = reference.decode('utf-8', 'ignore')
+    if isinstance(reference, str):
+        reference = reference.strip()
+        if reference.startswith('{'):
+            try:
+                reference = json.loads(reference)
+            except ValueError:
+                return None
+        elif COMPACT_JWS.match(reference):
+            try:
+                reference = decode_jws_payload(reference)
+            except ValueError:
+                return None
+    if isinstance(reference, dict):
+        reference = reference.get('id')
+    if not isinstance(reference, str) or not reference:
+        return None
+    if not reference.startswith('http'):
+        # the id of a signed assertion
+        return BadgeInstance.objects.filter(identifier=reference, source_url__isnull=True).first()
+    instance = BadgeInstance.objects.get_local_object(reference)
+    if instance is None or instance.source_url:
+        return None
+    return instance
+
+
+def _recipient_matches(instance, recipient_profile):
+    identities = []
+    for value in recipient_profile.values():
+        identities += value if isinstance(value, (list, tuple)) else [value]
+    hashed_identity = instance.recipient_hash or instance.get_hashed_identity()
+    for identity in identities:
+        if identity and generate_sha256_hashstring(identity.lower(), instance.salt) == hashed_identity:
+            return identity
+    return None
+
+
+def verify_assertion(instance, recipient_profile=None):
+    """
+    Verifies an assertion hosted by this server: the badgeclass and issuer it refers to must exist, it must not be
+    revoked or expired, the signature of a signed assertion must verify with the public key of its issuer, and the
+    recipient must be in the recipient_profile when it is given
+    :param recipient_profile: dict of identity type -> identity or list of identities, e.g. {'email': [...]}
+    :return: the result in the format of the validator service
+    """
+    errors = []
+
+    def _error(name, result):
+        errors.append({'name': name, 'messageLevel': 'ERROR', 'result': result})
+
+    assertion = instance.get_json(expand_badgeclass=False, expand_issuer=False)
+    graph = [assertion]
+    if instance.revoked:
+        _error('VERIFY_SIGNED_ASSERTION_NOT_REVOKED' if instance.signature else 'VERIFY_HOSTED_ASSERTION_NOT_REVOKED',
+               'Assertion {} has been revoked'.format(assertion['id']))
+    else:
+        badgeclass = instance.cached_badgeclass
+        graph += [badgeclass.get_json(), badgeclass.cached_issuer.get_json()]
+        if instance.expires_at and instance.expires_at < timezone.now():
+            _error('VERIFY_EXPIRATION', 'Assertion expired on {}'.format(instance.expires_at.isoformat()))
+        if instance.signature:
+            public_key_issuer = instance.public_key_issuer
+            if public_key_issuer is None or public_key_issuer.public_key is None \
+                    or public_key_issuer.issuer_id != instance.issuer_id:
+                _error('VERIFY_KEY_OWNERSHIP', 'The signing key of assertion {} does not belong to its issuer'.format(
+                    assertion['id']))
+            else:
+                try:
+                    payload = verify_jws(instance.signature, public_key_issuer.public_key.public_key_pem)
+                except ValueError as e:
+                    _error('VERIFY_JWS', str(e))
+                else:
+                    if payload.get('id') != instance.identifier:
+                        _error('VERIFY_JWS', 'The signed assertion is not assertion {}'.format(assertion['id']))
+    report = {
+        'valid': not errors,
+        'errorCount': len(errors),
+        'warningCount': 0,
+        'messages': errors,
+        'validationSubject': assertion['id'],
+        'openBadgesVersion': '2.0',
+    }
+    if recipient_profile and not instance.revoked:
+        identity = _recipient_matches(instance, recipient_profile)
+        if identity is None:
+            _error('VERIFY_RECIPIENT_IDENTIFIER', 'The recipient does not match the assertion')
+            report.update(valid=False, errorCount=len(errors))
+        else:
+            report['recipientProfile'] = {instance.recipient_type: identity}
+    return {'input': {'value': assertion['id'], 'input_type': 'url'}, 'graph': graph, 'report': report}
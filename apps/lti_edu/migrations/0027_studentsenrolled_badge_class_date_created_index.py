@@ -0,0 +1,17 @@
+# Generated by Django 2.2.18 on 2021-07-26 10:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lti_edu', '0026_auto_20191225_0316'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='studentsenrolled',
+            index_together={('badge_class', 'date_created')},
+        ),
+    ]
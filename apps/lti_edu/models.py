@@ -1,11 +1,11 @@
 import random
 
 from django.contrib.auth import user_logged_out
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from entity.models import BaseVersionedEntity
 from ims.models import LTITenant
-from issuer.models import BadgeClass, Issuer
+from issuer.models import BadgeClass, BadgeClassStats, Issuer
 
 
 def get_uuid():
@@ -102,12 +102,39 @@ class StudentsEnrolled(BaseVersionedEntity, models.Model):
     denied = models.BooleanField(default=False)
     badge_class_lti_context = models.ForeignKey(BadgeClassLtiContext, on_delete=models.SET_NULL, null=True)
 
+    class Meta:
+        index_together = (
+            ('badge_class', 'date_created'),
+        )
+
     def __str__(self):
         return self.email
 
     def save(self, *args, **kwargs):
         self.badge_class.remove_cached_data(['cached_enrollments', 'cached_pending_enrollments'])
-        return super(StudentsEnrolled, self).save(*args, **kwargs)
+        with transaction.atomic():
+            previous = StudentsEnrolled.objects.filter(pk=self.pk).first() if self.pk else None
+            result = super(StudentsEnrolled, self).save(*args, **kwargs)
+            self._update_stats(previous, self)
+        return result
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super(StudentsEnrolled, self).delete(*args, **kwargs)
+            self._update_stats(self, None)
+        return result
+
+    @property
+    def is_pending(self):
+        return self.badge_instance_id is None and not self.denied
+
+    def _update_stats(self, previous, current):
+        deltas = {'pending_enrollment_count': 0, 'denied_enrollment_count': 0}
+        for enrollment, sign in ((previous, -1), (current, 1)):
+            if enrollment is not None:
+                deltas['pending_enrollment_count'] += sign * enrollment.is_pending
+                deltas['denied_enrollment_count'] += sign * enrollment.denied
+        BadgeClassStats.objects.add(self.badge_class_id, **deltas)
 
     @property
     def assertion_slug(self):
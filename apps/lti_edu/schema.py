@@ -1,6 +1,8 @@
 import graphene
 from graphene_django.types import DjangoObjectType
 
+from mainsite.graphql_loaders import foreign_key_resolver
+from mainsite.graphql_pagination import CountableConnection
 from .models import StudentsEnrolled
 
 
@@ -10,6 +12,15 @@ class StudentsEnrolledType(DjangoObjectType):
         fields = ('date_created', 'date_consent_given', 'date_awarded', 'badge_class', 'denied',
                   'user', 'badge_instance', 'entity_id')
 
+    resolve_badge_class = foreign_key_resolver('badge_class')
+    resolve_user = foreign_key_resolver('user')
+    resolve_badge_instance = foreign_key_resolver('badge_instance')
+
+
+class StudentsEnrolledConnection(CountableConnection):
+    class Meta:
+        node = StudentsEnrolledType
+
 
 class Query(object):
     enrollments = graphene.List(StudentsEnrolledType)
@@ -0,0 +1,230 @@
+import logging
+import time
+from collections import defaultdict
+
+from cachemodel.utils import generate_cache_key
+from django.conf import settings
+from django.core.cache import cache
+from graphene.utils.str_converters import to_snake_case
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql.type.definition import GraphQLList, get_named_type, get_nullable_type
+
+logger = logging.getLogger('Badgr.Debug')
+
+
+def _is_connection(graphql_type):
+    fields = getattr(graphql_type, 'fields', {})
+    return 'edges' in fields and 'pageInfo' in fields
+
+
+def _is_edge(graphql_type):
+    fields = getattr(graphql_type, 'fields', {})
+    return 'node' in fields and 'cursor' in fields
+
+
+def get_field_annotation(parent_type, field_name):
+    """
+    The cost of a field is annotated on the graphene type in a field_costs dictionary of field name ->
+    {'cost': cost of resolving the field once, 'multiplier': expected number of items of a list}
+    """
+    field_costs = getattr(getattr(parent_type, 'graphene_type', None), 'field_costs', {})
+    return field_costs.get(to_snake_case(field_name), {})
+
+
+class QueryCostAnalyzer(object):
+    """
+    Estimates the cost and depth of a query from its document before it is executed.
+
+    Every field with a selection set costs 1 and a scalar field costs nothing, unless the type annotates otherwise.
+    The cost of the selection set of a list is multiplied with the number of items it is expected to have: the first
+    or last argument when given, the annotated multiplier, or GRAPHQL_COST_DEFAULT_LIST_SIZE. Connections count
+    their page size once, their edges and node levels do not add to the depth.
+    """
+
+    def __init__(self, schema, document, variables=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.fragments = {definition.name.value: definition for definition in document.definitions
+                          if isinstance(definition, ast.FragmentDefinition)}
+        self.operations = [definition for definition in document.definitions
+                           if isinstance(definition, ast.OperationDefinition)]
+        self.default_list_size = getattr(settings, 'GRAPHQL_COST_DEFAULT_LIST_SIZE', 10)
+        self.max_page_size = getattr(settings, 'GRAPHQL_MAX_PAGE_SIZE', 100)
+
+    def analyze(self, operation_name=None):
+        """
+        :return: tuple of the cost and the depth of the operation, or the maximum of all operations when no name is given
+        """
+        cost, depth = 0, 0
+        for operation in self.operations:
+            if operation_name and (operation.name is None or operation.name.value != operation_name):
+                continue
+            root_type = self.schema.get_mutation_type() if operation.operation == 'mutation' \
+                else self.schema.get_query_type()
+            if root_type is None:
+                continue
+            operation_cost, operation_depth = self._selection_set(root_type, operation.selection_set, 0, frozenset())
+            cost, depth = max(cost, operation_cost), max(depth, operation_depth)
+        return cost, depth
+
+    def _argument(self, field_node, name):
+        for argument in field_node.arguments or []:
+            if argument.name.value == name:
+                if isinstance(argument.value, ast.Variable):
+                    value = self.variables.get(argument.value.name.value)
+                elif isinstance(argument.value, ast.IntValue):
+                    value = argument.value.value
+                else:
+                    return None
+                try:
+                    return int(value)
+                except (TypeError, ValueError):
+                    return None
+        return None
+
+    def _list_size(self, field_node, annotation, is_connection):
+        size = self._argument(field_node, 'first')
+        if size is None:
+            size = self._argument(field_node, 'last')
+        if size is not None:
+            return max(size, 0) if not is_connection else min(max(size, 0), self.max_page_size)
+        if 'multiplier' in annotation:
+            return annotation['multiplier']
+        return self.max_page_size if is_connection else self.default_list_size
+
+    def _selection_set(self, parent_type, selection_set, depth, fragment_names):
+        cost, max_depth = 0, depth
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                selection_cost, selection_depth = self._field(parent_type, selection, depth, fragment_names)
+            elif isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in fragment_names:
+                    continue
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value) or parent_type
+                selection_cost, selection_depth = self._selection_set(
+                    fragment_type, fragment.selection_set, depth, fragment_names | {name})
+            elif isinstance(selection, ast.InlineFragment):
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value) or parent_type
+                selection_cost, selection_depth = self._selection_set(
+                    fragment_type, selection.selection_set, depth, fragment_names)
+            else:
+                continue
+            cost += selection_cost
+            max_depth = max(max_depth, selection_depth)
+        return cost, max_depth
+
+    def _field(self, parent_type, field_node, depth, fragment_names):
+        name = field_node.name.value
+        field = getattr(parent_type, 'fields', {}).get(name)
+        if field is None or name.startswith('__'):
+            # unknown fields are reported by the validation of the query, introspection is not counted
+            return 0, depth
+        annotation = get_field_annotation(parent_type, name)
+        named_type = get_named_type(field.type)
+        is_connection = _is_connection(named_type)
+        # the edges and node levels of a connection are part of its page
+        wrapper = (_is_connection(parent_type) and name == 'edges') or (_is_edge(parent_type) and name == 'node')
+        field_depth = depth if wrapper else depth + 1
+        if field_node.selection_set is None:
+            return annotation.get('cost', 0), field_depth
+        child_cost, child_depth = self._selection_set(named_type, field_node.selection_set, field_depth,
+                                                      fragment_names)
+        multiplier = 1
+        if not wrapper and (is_connection or isinstance(get_nullable_type(field.type), GraphQLList)):
+            multiplier = self._list_size(field_node, annotation, is_connection)
+        return annotation.get('cost', 0 if wrapper else 1) + multiplier * child_cost, child_depth
+
+
+def _budget_key(request):
+    user = getattr(request, 'user', None)
+    client = 'user:{}'.format(user.pk) if getattr(user, 'pk', None) else \
+        'ip:{}'.format(request.META.get('REMOTE_ADDR'))
+    return generate_cache_key(['GraphQLCostBudget', client], window=int(time.time() // 60))
+
+
+def check_query_cost(schema, document, variables, operation_name, request):
+    """
+    Admission control of a query: rejects it when it is nested deeper than GRAPHQL_MAX_QUERY_DEPTH, when its
+    estimated cost is over GRAPHQL_MAX_QUERY_COST, or when the client has spent GRAPHQL_COST_BUDGET_PER_MINUTE in
+    the current minute
+    :return: a GraphQLError, or None when the query may be executed
+    """
+    cost, depth = QueryCostAnalyzer(schema, document, variables).analyze(operation_name)
+    max_depth = getattr(settings, 'GRAPHQL_MAX_QUERY_DEPTH', 10)
+    if depth > max_depth:
+        return GraphQLError('Query depth {} exceeds the maximum depth of {}'.format(depth, max_depth))
+    max_cost = getattr(settings, 'GRAPHQL_MAX_QUERY_COST', 20000)
+    if cost > max_cost:
+        return GraphQLError('Query cost {} exceeds the maximum cost of {}'.format(cost, max_cost))
+    budget = getattr(settings, 'GRAPHQL_COST_BUDGET_PER_MINUTE', None)
+    if budget:
+        key = _budget_key(request)
+        cache.add(key, 0, 60)
+        try:
+            spent = cache.incr(key, cost)
+        except ValueError:
+            spent = cost
+        if spent > budget:
+            logger.warning('GraphQL query of cost {} throttled, {} spent this minute'.format(cost, spent))
+            return GraphQLError('Too many expensive queries, try again in a minute')
+    request.graphql_cost = cost
+    return None
+
+
+class QueryCounter(object):
+    """Database execute wrapper that counts the queries, see ExtendedGraphQLView"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class ResolverTimingMiddleware(object):
+    """
+    Graphene middleware that records the wall time and the number of database queries of every resolver, summed per
+    path of the query without the list indices, in the graphql_timings of the request. The time of a resolver that
+    returns a promise runs until the promise is resolved.
+    """
+
+    def resolve(self, next, root, info, **args):
+        timings = getattr(info.context, 'graphql_timings', None)
+        counter = getattr(info.context, 'graphql_query_counter', None)
+        if timings is None or counter is None:
+            return next(root, info, **args)
+        path = '.'.join(key for key in info.path if isinstance(key, str))
+        start, queries = time.perf_counter(), counter.count
+
+        def _record(value):
+            timing = timings[path]
+            timing['calls'] += 1
+            timing['time'] += time.perf_counter() - start
+            timing['queries'] += counter.count - queries
+            return value
+
+        result = next(root, info, **args)
+        if hasattr(result, 'then'):
+            return result.then(_record)
+        return _record(result)
+
+
+def new_timings():
+    return defaultdict(lambda: {'calls': 0, 'time': 0.0, 'queries': 0})
+
+
+def log_timings(request, operation_name, duration, query_count):
+    """Logs the slowest resolver paths of a query that took longer than GRAPHQL_SLOW_QUERY_SECONDS"""
+    if duration < getattr(settings, 'GRAPHQL_SLOW_QUERY_SECONDS', 1.0):
+        return
+    slowest = sorted(request.graphql_timings.items(), key=lambda item: item[1]['time'], reverse=True)[:10]
+    logger.warning('Slow GraphQL query {} cost {} took {:.3f}s and {} queries, slowest fields: {}'.format(
+        operation_name or '', getattr(request, 'graphql_cost', None), duration, query_count,
+        ', '.join('{} {:.3f}s {} queries {} calls'.format(path, timing['time'], timing['queries'], timing['calls'])
+                  for path, timing in slowest)))
@@ -0,0 +1,99 @@
+from collections import defaultdict
+
+from promise import Promise
+from promise.dataloader import DataLoader
+
+
+class ModelLoader(DataLoader):
+    """Loads the instances of a model by primary key, with one query for all keys of a level of the query"""
+
+    def __init__(self, model):
+        super(ModelLoader, self).__init__()
+        self.model = model
+
+    def batch_load_fn(self, keys):
+        instances = self.model.objects.in_bulk(set(keys))
+        return Promise.resolve([instances.get(key) for key in keys])
+
+
+class RelatedLoader(DataLoader):
+    """
+    Loads the instances of a model whose foreign key points to each of the keys, i.e. a reverse foreign key, with one
+    query for all keys of a level of the query
+    """
+
+    def __init__(self, model, field_name, filters):
+        super(RelatedLoader, self).__init__()
+        self.model = model
+        self.field_name = field_name
+        self.attname = model._meta.get_field(field_name).attname
+        self.filters = filters
+
+    def batch_load_fn(self, keys):
+        related = defaultdict(list)
+        queryset = self.model.objects.filter(**{self.field_name + '__in': set(keys)}, **self.filters)
+        for instance in queryset.order_by('pk'):
+            related[getattr(instance, self.attname)].append(instance)
+        return Promise.resolve([related[key] for key in keys])
+
+
+class BatchLoader(DataLoader):
+    """Loads the values of a function that takes a list of keys and returns a list of values, for all keys at once"""
+
+    def __init__(self, batch_function):
+        super(BatchLoader, self).__init__()
+        self.batch_function = batch_function
+
+    def batch_load_fn(self, keys):
+        return Promise.resolve(self.batch_function(keys))
+
+
+class Loaders(object):
+    """The data loaders of one GraphQL request, they cache what they have loaded for the rest of the request"""
+
+    def __init__(self):
+        self._loaders = {}
+
+    def _get_loader(self, key, factory):
+        loader = self._loaders.get(key)
+        if loader is None:
+            loader = self._loaders[key] = factory()
+        return loader
+
+    def load(self, model, pk):
+        """:return: promise of the instance of model with pk, or None"""
+        if pk is None:
+            return Promise.resolve(None)
+        return self._get_loader(model, lambda: ModelLoader(model)).load(pk)
+
+    def load_foreign_key(self, instance, field_name):
+        """:return: promise of the instance the foreign key field_name of instance points to"""
+        field = instance._meta.get_field(field_name)
+        return self.load(field.related_model, getattr(instance, field.attname))
+
+    def load_batched(self, batch_function, key):
+        """:return: promise of the value of batch_function for key"""
+        return self._get_loader(batch_function, lambda: BatchLoader(batch_function)).load(key)
+
+    def load_related(self, model, field_name, pk, **filters):
+        """:return: promise of the list of instances of model whose field_name points to pk, ordered by pk"""
+        key = (model, field_name, tuple(sorted(filters.items())))
+        return self._get_loader(key, lambda: RelatedLoader(model, field_name, filters)).load(pk)
+
+
+def get_loaders(info):
+    """
+    The loaders are created by ExtendedGraphQLView.get_context, contexts that do not come from the view get them on
+    first use
+    """
+    loaders = getattr(info.context, 'loaders', None)
+    if loaders is None:
+        loaders = info.context.loaders = Loaders()
+    return loaders
+
+
+def foreign_key_resolver(field_name):
+    """:return: resolver for a foreign key field that batches the lookups of all objects on the same level"""
+    def resolver(instance, info, **kwargs):
+        return get_loaders(info).load_foreign_key(instance, field_name)
+    return resolver
@@ -0,0 +1,151 @@
+import base64
+import datetime
+import hashlib
+import json
+from functools import partial, reduce
+
+import graphene
+from cachemodel.utils import generate_cache_key
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+from graphene.relay import ConnectionField, PageInfo
+from graphene.relay.connection import IterableConnectionField
+from graphene.types import NonNull
+from graphene.utils.thenables import maybe_thenable
+from graphene_django.types import Connection
+
+from mainsite.exceptions import GraphQLException
+
+
+class CountableConnection(Connection):
+    """Connection with the total number of nodes, which is only computed when it is asked for"""
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(self, info):
+        return self.get_total_count()
+
+
+def cached_count(queryset):
+    """
+    Counts a queryset, the count is cached for GRAPHQL_COUNT_CACHE_TIMEOUT seconds so paging through a large list
+    does not count it again for every page
+    """
+    query_hash = hashlib.md5(str(queryset.query).encode('utf-8')).hexdigest()
+    key = generate_cache_key([queryset.model.__name__, 'count'], query=query_hash)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'GRAPHQL_COUNT_CACHE_TIMEOUT', 60))
+    return count
+
+
+def _cursor_value(value):
+    # DjangoJSONEncoder cuts datetimes down to milliseconds, the keys must be exact to not repeat or skip rows
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(instance, ordering):
+    values = [_cursor_value(getattr(instance, field_name)) for field_name in ordering]
+    return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, model, ordering):
+    """:return: the values of the ordering fields of the row the cursor points to"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError()
+        return [model._meta.get_field(field_name).to_python(value) for field_name, value in zip(ordering, values)]
+    except (ValueError, TypeError, UnicodeError, ValidationError):
+        raise GraphQLException('Invalid cursor {}'.format(cursor))
+
+
+def keyset_filter(ordering, values, lookup):
+    """
+    :return: Q object for the rows after (lookup 'gt') or before (lookup 'lt') the values in the order of the
+    ordering fields, i.e. (a, b) > (x, y) written as a > x OR (a = x AND b > y)
+    """
+    conditions = []
+    for index, field_name in enumerate(ordering):
+        equal = {ordering[i]: values[i] for i in range(index)}
+        conditions.append(Q(**equal, **{'{}__{}'.format(field_name, lookup): values[index]}))
+    return reduce(lambda a, b: a | b, conditions)
+
+
+class KeysetConnectionField(ConnectionField):
+    """
+    Connection field that pages a queryset in the database. Cursors are opaque keys of the ordering fields of a
+    row, the last of which must be unique, so every page is one indexed query however deep it is, instead of
+    slicing a list with all the nodes.
+
+    The resolver returns an unordered queryset. The total count is read from count(root) when given, or else from a
+    cached COUNT query. A page has at most GRAPHQL_MAX_PAGE_SIZE nodes.
+    """
+
+    def __init__(self, type, *args, ordering=('created_at', 'id'), count=None, **kwargs):
+        self.ordering = tuple(ordering)
+        self.count = count
+        super(KeysetConnectionField, self).__init__(type, *args, **kwargs)
+
+    def get_resolver(self, parent_resolver):
+        resolver = super(IterableConnectionField, self).get_resolver(parent_resolver)
+        return partial(self.keyset_connection_resolver, resolver, self.type, self.ordering, self.count)
+
+    @classmethod
+    def keyset_connection_resolver(cls, resolver, connection_type, ordering, count, root, info, **args):
+        resolved = resolver(root, info, **args)
+        if isinstance(connection_type, NonNull):
+            connection_type = connection_type.of_type
+        get_total_count = partial(count, root) if count else None
+        on_resolve = partial(cls.resolve_keyset_connection, connection_type, args, ordering, get_total_count)
+        return maybe_thenable(resolved, on_resolve)
+
+    @classmethod
+    def resolve_keyset_connection(cls, connection_type, args, ordering, get_total_count, resolved):
+        if not isinstance(resolved, QuerySet):
+            connection = cls.resolve_connection(connection_type, args, resolved)
+            connection.get_total_count = get_total_count or partial(len, resolved)
+            return connection
+
+        first, last, after, before = args.get('first'), args.get('last'), args.get('after'), args.get('before')
+        if (first is not None and first < 0) or (last is not None and last < 0):
+            raise GraphQLException('first and last may not be negative')
+        max_page_size = getattr(settings, 'GRAPHQL_MAX_PAGE_SIZE', 100)
+        queryset = resolved
+        if after:
+            queryset = queryset.filter(keyset_filter(ordering, decode_cursor(after, queryset.model, ordering), 'gt'))
+        if before:
+            queryset = queryset.filter(keyset_filter(ordering, decode_cursor(before, queryset.model, ordering), 'lt'))
+
+        if last is not None and first is None:
+            # paging backwards, read the rows in reverse order and turn the page around
+            size = min(last, max_page_size)
+            nodes = list(queryset.order_by(*['-' + field_name for field_name in ordering])[:size + 1])
+            has_previous_page, has_next_page = len(nodes) > size, bool(before)
+            nodes = list(reversed(nodes[:size]))
+        else:
+            size = min(first if first is not None else max_page_size, max_page_size)
+            nodes = list(queryset.order_by(*ordering)[:size + 1])
+            has_previous_page, has_next_page = bool(after), len(nodes) > size
+            nodes = nodes[:size]
+            if last is not None:
+                nodes = nodes[len(nodes) - last:] if last < len(nodes) else nodes
+
+        edges = [connection_type.Edge(node=node, cursor=encode_cursor(node, ordering)) for node in nodes]
+        connection = connection_type(
+            edges=edges,
+            page_info=PageInfo(start_cursor=edges[0].cursor if edges else None,
+                               end_cursor=edges[-1].cursor if edges else None,
+                               has_previous_page=has_previous_page,
+                               has_next_page=has_next_page))
+        connection.get_total_count = get_total_count or partial(cached_count, resolved)
+        return connection
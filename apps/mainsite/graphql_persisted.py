@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from graphql import GraphQLError, parse
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.error import GraphQLSyntaxError
+from graphql.execution import execute
+from graphql.validation import validate
+
+logger = logging.getLogger('Badgr.Debug')
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+class PersistedQueryRegistry(object):
+    """
+    Parsed and validated GraphQL documents by the sha256 hash of their text, so a persisted query is executed
+    without parsing or validating it again. Documents come from the GRAPHQL_PERSISTED_QUERIES_MANIFEST, read on
+    first use, or are registered by clients with the automatic persisted queries protocol, of which the least
+    recently used are dropped beyond GRAPHQL_PERSISTED_QUERIES_MAX_SIZE.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = OrderedDict()  # hash -> document, registered by clients
+        self._manifest = None  # hash -> document, never dropped
+        self._by_text = {}  # query text -> document
+
+    def _load_manifest(self, schema):
+        documents = {}
+        path = getattr(settings, 'GRAPHQL_PERSISTED_QUERIES_MANIFEST', None)
+        if path:
+            with open(path) as manifest_file:
+                manifest = json.load(manifest_file)
+            queries = manifest.values() if isinstance(manifest, dict) else manifest
+            for query in queries:
+                document, errors = self.compile(schema, query)
+                if errors:
+                    logger.error('Persisted query in {} is invalid: {}'.format(path, errors))
+                else:
+                    documents[query_hash(query)] = document
+        return documents
+
+    def _get_manifest(self, schema):
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    manifest = self._load_manifest(schema)
+                    self._by_text.update({document.document_string: document for document in manifest.values()})
+                    self._manifest = manifest
+        return self._manifest
+
+    @staticmethod
+    def compile(schema, query):
+        """
+        Parses and validates a query once
+        :return: tuple of the document, which executes without validating again, and the validation errors
+        """
+        try:
+            document_ast = parse(query)
+        except GraphQLSyntaxError as e:
+            return None, [e]
+        errors = validate(schema, document_ast)
+        if errors:
+            return None, errors
+        return GraphQLDocument(schema=schema, document_string=query, document_ast=document_ast,
+                               execute=partial(execute, schema, document_ast)), []
+
+    def get(self, schema, persisted_hash):
+        document = self._get_manifest(schema).get(persisted_hash)
+        if document is None:
+            with self._lock:
+                document = self._documents.get(persisted_hash)
+                if document is not None:
+                    self._documents.move_to_end(persisted_hash)
+        return document
+
+    def get_by_text(self, schema, query):
+        self._get_manifest(schema)
+        return self._by_text.get(query)
+
+    def register(self, schema, query):
+        """:return: tuple of the document of the query and the validation errors"""
+        document, errors = self.compile(schema, query)
+        if document is not None:
+            with self._lock:
+                self._documents[query_hash(query)] = document
+                self._by_text[query] = document
+                while len(self._documents) > getattr(settings, 'GRAPHQL_PERSISTED_QUERIES_MAX_SIZE', 1000):
+                    _, dropped = self._documents.popitem(last=False)
+                    self._by_text.pop(dropped.document_string, None)
+        return document, errors
+
+
+registry = PersistedQueryRegistry()
+
+
+def get_persisted_query_hash(request, data):
+    """:return: the sha256Hash of the persistedQuery extension of the request, or None"""
+    extensions = request.GET.get('extensions') or data.get('extensions')
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            return None
+    if not isinstance(extensions, dict):
+        return None
+    persisted_query = extensions.get('persistedQuery')
+    if isinstance(persisted_query, dict):
+        return persisted_query.get('sha256Hash')
+    return None
+
+
+def get_persisted_document(schema, persisted_hash, query):
+    """
+    Looks up the document of a persisted query, the query text is only needed the first time
+    :return: tuple of the document, or None, and a list of errors
+    """
+    document = registry.get(schema, persisted_hash)
+    if document is not None:
+        return document, []
+    if not query:
+        # the client sends the query text with the hash again to register it
+        return None, [GraphQLError('PersistedQueryNotFound')]
+    if query_hash(query) != persisted_hash:
+        return None, [GraphQLError('provided sha does not match query')]
+    return registry.register(schema, query)
+
+
+class PersistedQueryBackend(GraphQLCoreBackend):
+    """Backend that executes the text of a registered query with its precompiled document"""
+
+    def document_from_string(self, schema, document_string):
+        document = registry.get_by_text(schema, document_string) if isinstance(document_string, str) else None
+        if document is not None:
+            return document
+        return super(PersistedQueryBackend, self).document_from_string(schema, document_string)
+
+
+backend = PersistedQueryBackend()
@@ -6,8 +6,12 @@ from graphene_django.types import DjangoObjectType
 
 from badgeuser.models import UserProvisionment
 from mainsite.exceptions import GraphQLException
+from mainsite.graphql_loaders import get_loaders
+from staff.models import STAFF_MODELS
 from staff.schema import PermissionType
 
+STAFF_BY_LEVEL = {level: (staff_model, field_name) for staff_model, level, field_name in STAFF_MODELS}
+
 
 def resolver_blocker_for_students(f):
     """Decorator to block students from using graphql resolver functions"""
@@ -30,6 +34,15 @@ def resolver_blocker_only_for_current_user(f):
     return wrapper
 
 
+def paginate(queryset, first=None, offset=None):
+    """Slices a queryset in the database with the optional first and offset arguments of a list field"""
+    queryset = queryset.order_by('pk')
+    offset = offset or 0
+    if first is not None:
+        return queryset[offset:offset + first]
+    return queryset[offset:]
+
+
 class JSONType(JSONString):
     @staticmethod
     def serialize(dt):
@@ -105,6 +118,21 @@ class StaffResolverMixin(object):
     @resolver_blocker_for_students
     def resolve_staff(self, info):
         if self.has_permissions(info.context.user, ['may_read']):
-            return self.staff_items
+            staff_model, field_name = STAFF_BY_LEVEL[self.__class__.__name__]
+            return get_loaders(info).load_related(staff_model, field_name, self.pk)
         else:
             return []
+
+    @resolver_blocker_for_students
+    def resolve_staff_paginated(self, info, **kwargs):
+        staff_model, field_name = STAFF_BY_LEVEL[self.__class__.__name__]
+        if self.has_permissions(info.context.user, ['may_read']):
+            return staff_model.objects.filter(**{field_name: self})
+        return staff_model.objects.none()
+
+
+def permitted(user, permissions):
+    """:return: function that keeps the entities of a list the user has all permissions on, to chain to a loader"""
+    def _filter(entities):
+        return [entity for entity in entities if entity.has_permissions(user, permissions)]
+    return _filter
@@ -1,15 +1,54 @@
 import logging
+import time
 
+from django.db import connection
 from graphene_django.views import GraphQLView
+from graphql import parse
+from graphql.error import GraphQLSyntaxError
+from graphql.execution import ExecutionResult
+
+from mainsite.graphql_cost import check_query_cost, QueryCounter, new_timings, log_timings
+from mainsite.graphql_loaders import Loaders
+from mainsite.graphql_persisted import backend, registry, get_persisted_query_hash, get_persisted_document
 
 logger = logging.getLogger('Badgr.Debug')
 
 
 class ExtendedGraphQLView(GraphQLView):
 
+    def get_backend(self, request):
+        return backend
+
+    def get_context(self, request):
+        request.loaders = Loaders()
+        return request
+
     def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
-        res = super().execute_graphql_request(request, data, query, variables, operation_name,
-                                              show_graphiql=show_graphiql)
+        document = None
+        persisted_hash = get_persisted_query_hash(request, data)
+        if persisted_hash:
+            persisted_document, errors = get_persisted_document(self.schema, persisted_hash, query)
+            if errors:
+                return ExecutionResult(errors=errors, invalid=persisted_document is None and bool(query))
+            # the backend executes the text of a persisted query with its precompiled document
+            query, document = persisted_document.document_string, persisted_document.document_ast
+        elif query:
+            known_document = registry.get_by_text(self.schema, query)
+            try:
+                document = known_document.document_ast if known_document else parse(query)
+            except GraphQLSyntaxError:
+                pass  # reported by the execution below
+        if document is not None:
+            error = check_query_cost(self.schema, document, variables, operation_name, request)
+            if error:
+                return ExecutionResult(errors=[error], invalid=True)
+        request.graphql_timings = new_timings()
+        request.graphql_query_counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(request.graphql_query_counter):
+            res = super().execute_graphql_request(request, data, query, variables, operation_name,
+                                                  show_graphiql=show_graphiql)
+        log_timings(request, operation_name, time.perf_counter() - start, request.graphql_query_counter.count)
         if res.errors:
             logger.exception(str(res.errors))
             res.invalid = True
@@ -0,0 +1,115 @@
+# encoding: utf-8
+import threading
+
+from cachemodel.utils import generate_cache_key
+from django.core.cache import cache
+from django.core.cache.backends.memcached import MemcachedCache
+
+_local = threading.local()
+_MISSING = object()
+
+
+def activate():
+    """Starts a new identity map for the current thread, see IdentityMapMiddleware"""
+    _local.objects = {}
+
+
+def deactivate():
+    _local.objects = None
+
+
+def get_identity_map():
+    """
+    :return: dictionary of full cache key -> value for the current request, or None outside of a request
+    """
+    return getattr(_local, 'objects', None)
+
+
+class IdentityMapCacheMixin(object):
+    """
+    Cache backend mixin that remembers every value it has read or missed while an identity map is active. Within a
+    request the same key then always returns the same Python object, at the cost of one round trip for the first
+    access only. Writes go straight to the backend and drop the key from the identity map, so the next read sees
+    what is stored. Outside of a request the backend behaves as usual.
+    """
+
+    def get(self, key, default=None, version=None):
+        objects = get_identity_map()
+        if objects is None:
+            return super(IdentityMapCacheMixin, self).get(key, default=default, version=version)
+        full_key = self.make_key(key, version=version)
+        value = objects.get(full_key, None)
+        if value is None:
+            value = super(IdentityMapCacheMixin, self).get(key, default=_MISSING, version=version)
+            objects[full_key] = value
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        objects = get_identity_map()
+        if objects is None:
+            return super(IdentityMapCacheMixin, self).get_many(keys, version=version)
+        full_keys = {key: self.make_key(key, version=version) for key in keys}
+        cold = [key for key, full_key in full_keys.items() if full_key not in objects]
+        if cold:
+            found = super(IdentityMapCacheMixin, self).get_many(cold, version=version)
+            for key in cold:
+                objects[full_keys[key]] = found.get(key, _MISSING)
+        return {key: objects[full_key] for key, full_key in full_keys.items() if objects[full_key] is not _MISSING}
+
+    def _forget(self, keys, version=None):
+        objects = get_identity_map()
+        if objects:
+            for key in keys:
+                objects.pop(self.make_key(key, version=version), None)
+
+    def set(self, key, value, timeout=None, version=None):
+        self._forget([key], version=version)
+        return super(IdentityMapCacheMixin, self).set(key, value, timeout=timeout, version=version)
+
+    def add(self, key, value, timeout=None, version=None):
+        self._forget([key], version=version)
+        return super(IdentityMapCacheMixin, self).add(key, value, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=None, version=None):
+        self._forget(data.keys(), version=version)
+        return super(IdentityMapCacheMixin, self).set_many(data, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._forget([key], version=version)
+        return super(IdentityMapCacheMixin, self).delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        self._forget(keys, version=version)
+        return super(IdentityMapCacheMixin, self).delete_many(keys, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._forget([key], version=version)
+        return super(IdentityMapCacheMixin, self).incr(key, delta=delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._forget([key], version=version)
+        return super(IdentityMapCacheMixin, self).decr(key, delta=delta, version=version)
+
+    def touch(self, key, timeout=None, version=None):
+        self._forget([key], version=version)
+        return super(IdentityMapCacheMixin, self).touch(key, timeout=timeout, version=version)
+
+    def clear(self):
+        objects = get_identity_map()
+        if objects:
+            objects.clear()
+        return super(IdentityMapCacheMixin, self).clear()
+
+
+class IdentityMapMemcachedCache(IdentityMapCacheMixin, MemcachedCache):
+    pass
+
+
+def prefetch_cached_gets(model, pks):
+    """
+    Loads the objects that Model.cached.get(pk=...) returns for all pks into the identity map in one round trip
+    """
+    if get_identity_map() is None:
+        return
+    cache.get_many([generate_cache_key([model.__name__, 'get'], pk=pk) for pk in set(pks)])
+
@@ -0,0 +1,134 @@
+"""
+PNG derivatives of the images of institutions, issuers and badgeclasses in standard formats.
+
+The derivatives are generated in the background when an image is saved and recorded in ImageDerivative, so the
+public image endpoints redirect to a static file without a round trip to the storage. Derivatives that are not there
+yet, or have a size other than the standard one, are rendered on request by a bounded number of threads per process.
+"""
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import cairosvg
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+
+from mainsite.utils import batched, schedule_task_on_commit
+
+logger = logging.getLogger('Badgr.Debug')
+
+DERIVATIVE_FORMATS = OrderedDict([
+    ('square', {'aspect_ratio': (1, 1), 'height': 400}),
+    ('wide', {'aspect_ratio': (1.91, 1), 'height': 400}),
+    ('favicon', {'aspect_ratio': (1, 1), 'height': 32}),
+])
+
+_render_slots = threading.BoundedSemaphore(getattr(settings, 'IMAGE_DERIVATIVE_MAX_CONCURRENT_RENDERS', 2))
+
+
+def derivative_key(fmt, height=None):
+    """The key of a derivative in ImageDerivative, a height other than the standard one is part of it"""
+    if height is None or height == DERIVATIVE_FORMATS[fmt]['height']:
+        return fmt
+    return '{}-{}'.format(fmt, height)
+
+
+def derivative_name(source_name, key):
+    filename, ext = os.path.splitext(source_name)
+    return '{dirname}/converted{version}/{basename}{key_suffix}.png'.format(
+        dirname=os.path.dirname(filename),
+        basename=os.path.basename(filename),
+        version=getattr(settings, 'CAIROSVG_VERSION_SUFFIX', '1'),
+        key_suffix='-{}'.format(key) if key != 'square' else ''
+    )
+
+
+def fit_to_height(image, aspect_ratio, height):
+    """Scales the image down to fit a square of height and centers it on a transparent canvas of the aspect ratio"""
+    image = image.convert('RGBA')
+    image.thumbnail((height, height))
+    size = (int(aspect_ratio[0] * height), int(aspect_ratio[1] * height))
+    canvas = Image.new('RGBA', size)
+    canvas.paste(image, ((size[0] - image.size[0]) // 2, (size[1] - image.size[1]) // 2))
+    return canvas
+
+
+def render_derivative(source_name, fmt, height):
+    """:return: the png bytes of the derivative of the image in storage"""
+    with default_storage.open(source_name, 'rb') as source:
+        if os.path.splitext(source_name)[1].lower() == '.svg':
+            image = Image.open(io.BytesIO(cairosvg.svg2png(file_obj=source)))
+        else:
+            image = Image.open(source)
+        image.load()
+    out = io.BytesIO()
+    fit_to_height(image, DERIVATIVE_FORMATS[fmt]['aspect_ratio'], height).save(out, format='png')
+    return out.getvalue()
+
+
+def create_derivative(source_name, fmt, height=None):
+    from mainsite.models import ImageDerivative
+    height = height or DERIVATIVE_FORMATS[fmt]['height']
+    key = derivative_key(fmt, height)
+    content = render_derivative(source_name, fmt, height)
+    name = default_storage.save(derivative_name(source_name, key), ContentFile(content))
+    try:
+        with transaction.atomic():
+            return ImageDerivative.objects.create(source=source_name, key=key, image=name)
+    except IntegrityError:
+        # rendered by another process at the same time
+        default_storage.delete(name)
+        return ImageDerivative.objects.get(source=source_name, key=key)
+
+
+def get_derivative(source_name, fmt, height=None):
+    """:return: the ImageDerivative of the image, or None when it has not been generated"""
+    from mainsite.models import ImageDerivative
+    try:
+        return ImageDerivative.cached.get(source=source_name, key=derivative_key(fmt, height))
+    except ImageDerivative.DoesNotExist:
+        return None
+
+
+def get_or_render_derivative(source_name, fmt, height=None):
+    """
+    Renders a derivative that has not been generated on request, unless IMAGE_DERIVATIVE_MAX_CONCURRENT_RENDERS
+    derivatives are being rendered by this process already
+    :return: the ImageDerivative, or None
+    """
+    derivative = get_derivative(source_name, fmt, height)
+    if derivative is None and _render_slots.acquire(blocking=False):
+        try:
+            derivative = create_derivative(source_name, fmt, height)
+        finally:
+            _render_slots.release()
+    return derivative
+
+
+def generate_derivatives(source_names):
+    """Creates the missing derivatives in the standard formats of the images"""
+    from mainsite.models import ImageDerivative
+    existing = set(ImageDerivative.objects.filter(source__in=source_names).values_list('source', 'key'))
+    for source_name in source_names:
+        for fmt in DERIVATIVE_FORMATS:
+            if (source_name, fmt) in existing:
+                continue
+            try:
+                create_derivative(source_name, fmt)
+            except Exception:
+                logger.exception('Creating the {} derivative of {} failed'.format(fmt, source_name))
+
+
+def schedule_derivatives(source_names):
+    """
+    Generates the derivatives of the images in the background once the current transaction is committed
+    """
+    from mainsite.tasks import generate_image_derivatives
+    batch_size = getattr(settings, 'IMAGE_DERIVATIVE_TASK_BATCH_SIZE', 20)
+    schedule_task_on_commit(generate_image_derivatives,
+                            [(names,) for names in batched(sorted(name for name in source_names if name), batch_size)])
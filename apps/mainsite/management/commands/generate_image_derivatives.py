@@ -0,0 +1,27 @@
+# encoding: utf-8
+from django.core.management import BaseCommand
+
+from institution.models import Institution
+from issuer.models import Issuer, BadgeClass
+from mainsite.image_derivatives import schedule_derivatives
+from mainsite.models import ImageDerivative
+
+
+class Command(BaseCommand):
+    """Generates the missing image derivatives of all institutions, issuers and badgeclasses in the background."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regenerate', action='store_true',
+                            help='Replace the existing derivatives, e.g. after CAIROSVG_VERSION_SUFFIX changed')
+
+    def handle(self, *args, **options):
+        source_names = set()
+        for model in (Institution, Issuer, BadgeClass):
+            for names in model.objects.values_list(*model.derivative_image_fields):
+                source_names.update(names)
+        source_names -= {None, ''}
+        if options['regenerate']:
+            for derivative in ImageDerivative.objects.filter(source__in=source_names):
+                derivative.delete()
+        schedule_derivatives(source_names)
+        self.stdout.write("Scheduled the derivatives of {} images".format(len(source_names)))
@@ -1,34 +1,62 @@
+import gzip
+import io
+import os
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.core.mail import EmailMessage
 from django.core.management.base import BaseCommand
-from django.conf import settings
+
 from institution.models import Institution
-from datetime import datetime
-import pandas
+from institution.reports import REPORT_FORMATS, iter_report_rows, write_report
 
 
 class Command(BaseCommand):
     """A command to create and send the application report."""
 
-    def handle(self, *args, **kwargs):
-        institutions = Institution.objects.all()
-        reports = []
-        for institution in institutions:
-            all_institution_entities = institution.get_all_entities_in_branch()
-            for entity in all_institution_entities:
-                report = {'institution': institution.name}
-                report.update(entity.get_report())
-                reports.append(report)
-        report = pandas.DataFrame(reports)
-        csv_string = report.to_csv(sep=',')
-        filename = 'edubadges_report_{}.csv'.format(datetime.today().strftime('%Y-%m-%d'))
-        body = 'Dear sir/madam, \n\n' \
-               'In the attached csv file you will find your Edubadges report. \n\n' \
-               'Regards \n\n' \
-               'The Edubadges team'
-        if settings.REPORT_RECEIVER_EMAIL:
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=REPORT_FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the report')
+        parser.add_argument('--workers', type=int, default=settings.REPORT_WORKERS,
+                            help='Number of institutions reported on in parallel')
+        parser.add_argument('--output', help='Write the report to this file instead of the default storage')
+        parser.add_argument('--no-email', action='store_true', help='Do not email the report')
+
+    def handle(self, *args, **options):
+        report_format = options['format']
+        filename = 'edubadges_report_{}.{}'.format(datetime.today().strftime('%Y-%m-%d'), report_format)
+        if options['gzip']:
+            filename += '.gz'
+
+        rows = iter_report_rows(Institution.objects.iterator(), workers=options['workers'])
+        with open(options['output'], 'w+b') if options['output'] else tempfile.TemporaryFile() as report_file:
+            # rows are written as they are generated, the report is never held in memory as a whole
+            binary_file = gzip.GzipFile(filename=filename, fileobj=report_file, mode='wb') \
+                if options['gzip'] else report_file
+            text_file = io.TextIOWrapper(binary_file, encoding='utf-8', newline='')
+            count = write_report(rows, text_file, report_format)
+            text_file.detach()
+            if binary_file is not report_file:
+                binary_file.close()
+
+            send_email = settings.REPORT_RECEIVER_EMAIL and not options['no_email']
+            report_file.seek(0)
+            storage_name = None
+            if not options['output'] or send_email:
+                # the email links to the report in the storage, an attachment would be built in memory as a whole
+                storage_name = default_storage.save(os.path.join(settings.REPORT_STORAGE_PATH, filename),
+                                                    File(report_file))
+            self.stdout.write('Wrote {} rows to {}'.format(count, options['output'] or storage_name))
+
+        if send_email:
+            body = 'Dear sir/madam, \n\n' \
+                   'Your Edubadges report in {} format can be downloaded from {} \n\n' \
+                   'Regards \n\n' \
+                   'The Edubadges team'.format(report_format, default_storage.url(storage_name))
             email = EmailMessage(subject='Your Edubadges report is here!',
                                  body=body,
-                                 to=[settings.REPORT_RECEIVER_EMAIL],
-                                 # attachments=[(filename, report_file.getvalue(), 'text/csv')])
-                                 attachments=[(filename, csv_string, 'text/csv')])
+                                 to=[settings.REPORT_RECEIVER_EMAIL])
             email.send()
@@ -5,6 +5,7 @@ from django import http
 from django.utils.deprecation import MiddlewareMixin
 from json.decoder import JSONDecodeError
 from mainsite import settings
+from mainsite.identity_map import activate, deactivate
 
 logger = logging.getLogger('Badgr.Debug')
 
@@ -31,6 +32,20 @@ class TrailingSlashMiddleware(MiddlewareMixin):
         return None
 
 
+class IdentityMapMiddleware(object):
+    """Gives every request its own identity map of cached objects, see mainsite.identity_map"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        activate()
+        try:
+            return self.get_response(request)
+        finally:
+            deactivate()
+
+
 class ExceptionHandlerMiddleware(object):
 
     def __init__(self, get_response):
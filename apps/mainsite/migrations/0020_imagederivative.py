@@ -0,0 +1,26 @@
+# Generated by Django 2.2.18 on 2021-08-02 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainsite', '0019_auto_20210416_1512'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=254)),
+                ('key', models.CharField(max_length=64)),
+                ('image', models.FileField(max_length=512, upload_to='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('source', 'key')},
+            },
+        ),
+    ]
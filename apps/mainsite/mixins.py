@@ -19,6 +19,34 @@ class ImageUrlGetterMixin(object):
         return generate_image_url(self.image)
 
 
+class ImageDerivativesMixin(object):
+    """
+    Model mixin that generates the derivatives of newly saved images in the background, see mainsite.image_derivatives
+    """
+    derivative_image_fields = ('image',)
+
+    def _get_derivative_sources(self):
+        # read from __dict__, so deferred fields are not loaded
+        values = [self.__dict__.get(field) for field in self.derivative_image_fields]
+        return {getattr(value, 'name', value) for value in values} - {None, ''}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ImageDerivativesMixin, cls).from_db(db, field_names, values)
+        instance._saved_derivative_sources = instance._get_derivative_sources()
+        return instance
+
+    def save(self, *args, **kwargs):
+        result = super(ImageDerivativesMixin, self).save(*args, **kwargs)
+        sources = self._get_derivative_sources()
+        new_sources = sources - getattr(self, '_saved_derivative_sources', set())
+        if new_sources:
+            from mainsite.image_derivatives import schedule_derivatives
+            schedule_derivatives(new_sources)
+        self._saved_derivative_sources = sources
+        return result
+
+
 class DefaultLanguageMixin(object):
     """
     Model mixin to get default language
@@ -199,15 +199,13 @@ class ArchiveMixin(cachemodel.CacheModel):
 
     @property
     def may_archive(self):
-        if not self.assertions:
-            return True
-        return all([assertion.revoked for assertion in self.assertions])
+        return all(assertion.revoked for assertion in self.iter_assertions())
 
     @transaction.atomic
     def archive(self, **kwargs):
         """
-        Recursive archive function that
-            - archives all children
+        Archive function that
+            - archives all children, the deepest first
             - only publishes the parent of the initially archived entity
             - removes all associated staff memberships without publishing the associated object (the one that is archived)
         """
@@ -215,15 +213,34 @@ class ArchiveMixin(cachemodel.CacheModel):
         if not self.may_archive:
             raise ProtectedError(
                 "{} may only be deleted if there are no awarded Assertions.".format(self.__class__.__name__), self)
-        if hasattr(self, 'children'):
-            for child in self.children:
-                child.archive(publish_parent=False)
-        for membership in self.staff_items:
-            membership.delete(publish_object=False)
-        self.archived = True
-        self.save()
+        for entity in list(reversed(self.get_descendants())) + [self]:
+            for membership in entity.staff_items:
+                membership.delete(publish_object=False)
+            entity.archived = True
+            entity.save()
         if publish_parent:
             try:
                 self.parent.publish()
             except AttributeError:  # no parent
-                pass
\ No newline at end of file
+                pass
+
+
+class ImageDerivative(cachemodel.CacheModel):
+    """
+    A png rendition of an uploaded image in one of the formats of mainsite.image_derivatives
+    """
+    source = models.CharField(max_length=254)  # the name of the image in storage
+    key = models.CharField(max_length=64)
+    image = models.FileField(max_length=512)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('source', 'key')
+
+    def publish(self):
+        super(ImageDerivative, self).publish()
+        self.publish_by('source', 'key')
+
+    def delete(self, *args, **kwargs):
+        self.publish_delete('source', 'key')
+        return super(ImageDerivative, self).delete(*args, **kwargs)
@@ -71,6 +71,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'mainsite.middleware.IdentityMapMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'oauth2_provider.middleware.OAuth2TokenMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -330,11 +331,20 @@ LOGGING = {
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'BACKEND': 'mainsite.identity_map.IdentityMapMemcachedCache',
         'LOCATION': os.environ['MEMCACHED_HOST'] + ':11211',
     }
 }
 
+# Materialized Open Badges JSON documents, see entity.cache
+JSON_DOCUMENT_CACHE_ENABLED = True
+JSON_DOCUMENT_CACHE_TIMEOUT = 60 * 60 * 24
+# maximum number of objects in one cache item of a SegmentedQuerysetCache, e.g. the assertions of a badgeclass
+SEGMENTED_CACHE_CHUNK_SIZE = 200
+SEGMENTED_CACHE_TIMEOUT = 60 * 60 * 24
+# effective permissions of a user on all entities, see staff.permission_matrix
+PERMISSION_MATRIX_CACHE_TIMEOUT = 60 * 60 * 24
+
 ##
 #
 #  Maintenance Mode
@@ -495,6 +505,21 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULTS_SERIALIZER = 'json'
 CELERY_ACCEPT_CONTENT = ['json']
 
+# number of assertions per background bake task, see issuer.tasks
+BAKE_TASK_BATCH_SIZE = 50
+# a failed bake is retried by the worker this many times, after BAKE_TASK_RETRY_DELAY seconds doubled every retry
+BAKE_TASK_MAX_RETRIES = 3
+BAKE_TASK_RETRY_DELAY = 60
+# number of earned badge mails per background mail task, see issuer.tasks
+EARNED_BADGE_MAIL_TASK_BATCH_SIZE = 100
+# number of decoded badgeclass images kept in memory per process, see issuer.baking
+BAKERY_TEMPLATE_CACHE_SIZE = 32
+# png derivatives of uploaded images, see mainsite.image_derivatives
+IMAGE_DERIVATIVE_TASK_BATCH_SIZE = 20
+# derivatives rendered on request at the same time per process, beyond that the original image is served
+IMAGE_DERIVATIVE_MAX_CONCURRENT_RENDERS = 2
+IMAGE_DERIVATIVE_MAX_SIZE = 1024
+
 from cryptography.fernet import Fernet
 
 PAGINATION_SECRET_KEY = Fernet.generate_key()
@@ -505,8 +530,22 @@ AUTHCODE_EXPIRES_SECONDS = 600  # needs to be long enough to fetch information f
 SESSION_COOKIE_SAMESITE = None
 
 GRAPHENE = {
-    'SCHEMA': 'apps.mainsite.schema.schema'
+    'SCHEMA': 'apps.mainsite.schema.schema',
+    'MIDDLEWARE': ['mainsite.graphql_cost.ResolverTimingMiddleware'],
 }
+# connection fields of the GraphQL schema, see mainsite.graphql_pagination
+GRAPHQL_MAX_PAGE_SIZE = 100
+GRAPHQL_COUNT_CACHE_TIMEOUT = 60
+# admission control and timing of GraphQL queries, see mainsite.graphql_cost
+GRAPHQL_MAX_QUERY_DEPTH = 10
+GRAPHQL_MAX_QUERY_COST = 20000
+GRAPHQL_COST_DEFAULT_LIST_SIZE = 10
+GRAPHQL_COST_BUDGET_PER_MINUTE = 200000
+GRAPHQL_SLOW_QUERY_SECONDS = 1.0
+# JSON file with the persisted queries of the frontend, a list of queries or a dictionary of sha256 hash -> query
+GRAPHQL_PERSISTED_QUERIES_MANIFEST = None
+# maximum number of persisted queries registered by clients that are kept in each process
+GRAPHQL_PERSISTED_QUERIES_MAX_SIZE = 1000
 
 # Database
 DATABASES = {
@@ -558,6 +597,26 @@ LOCAL_DEVELOPMENT_MODE = legacy_boolean_parsing('LOCAL_DEVELOPMENT_MODE', '0')
 SUPERUSER_LOGIN_WITH_SURFCONEXT = legacy_boolean_parsing('SUPERUSER_LOGIN_WITH_SURFCONEXT', '0')
 
 VALIDATOR_URL = os.environ.get('VALIDATOR_URL', 'http://localhost:5000')
+# assertion validation, see issuer.validation. Hosted assertions are verified in process (issuer.verification),
+# the backend validates the ones imported from elsewhere
+ASSERTION_VALIDATOR_BACKEND = 'issuer.validation.RemoteValidatorBackend'
+ASSERTION_VALIDATION_MAX_WORKERS = 8
+ASSERTION_VALIDATION_REQUEST_TIMEOUT = 30
+ASSERTION_VALIDATION_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Cache-Control of the public Open Badges endpoints by policy, see public.public_api.CacheControlMixin. Assertions
+# are revalidated on every use so a revocation is seen right away, baked images never change at their url.
+PUBLIC_API_CACHE_CONTROL = {
+    'json': {'public': True, 'max_age': 300},
+    'assertion': {'public': True, 'no_cache': True},
+    'image': {'public': True, 'max_age': 60 * 60},
+    'baked_image': {'max_age': 60 * 60 * 24 * 365, 'immutable': True},
+    # a revocation shows up in the cached revocation status list of an issuer at most max_age seconds late
+    'status_list': {'public': True, 'max_age': 60 * 5},
+}
+# rendered and gzipped json of the public endpoints, items larger than the maximum size in bytes are not cached
+PUBLIC_JSON_RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+PUBLIC_JSON_RESPONSE_CACHE_MAX_SIZE = 1000000
 EXTENSIONS_ROOT_URL = os.environ.get('EXTENSIONS_ROOT_URL', 'http://127.0.0.1:8000/static')
 
 
@@ -565,3 +624,7 @@ MAX_IMAGE_UPLOAD_SIZE = 256000  # 256Kb
 MAX_IMAGE_UPLOAD_SIZE_LABEL = '256 kB'  # used in error messaging
 
 REPORT_RECEIVER_EMAIL = os.environ.get('REPORT_RECEIVER_EMAIL', '')
+# number of institutions send_app_report reports on in parallel
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', '4'))
+# default storage directory the reports of send_app_report are written to
+REPORT_STORAGE_PATH = 'reports'
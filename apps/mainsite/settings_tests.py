@@ -17,6 +17,7 @@ DATABASES = {
 }
 
 CELERY_ALWAYS_EAGER = True
+ASSERTION_VALIDATOR_BACKEND = 'issuer.validation.LocalValidatorBackend'
 SECRET_KEY = 'aninsecurekeyusedfortesting'
 UNSUBSCRIBE_SECRET_KEY = str(SECRET_KEY)
 PAGINATION_SECRET_KEY = Fernet.generate_key()
@@ -12,7 +12,7 @@ DATABASES = {
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'BACKEND': 'mainsite.identity_map.IdentityMapMemcachedCache',
         'LOCATION': '127.0.0.1:11211',
         'KEY_PREFIX': 'test_badgr_',
         'VERSION': 1,
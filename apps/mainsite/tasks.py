@@ -0,0 +1,12 @@
+from django.conf import settings
+
+from mainsite.celery import app
+from mainsite.image_derivatives import generate_derivatives
+
+image_derivative_task_queue_name = getattr(settings, 'IMAGE_DERIVATIVE_TASK_QUEUE_NAME',
+                                           getattr(settings, 'BACKGROUND_TASK_QUEUE_NAME', 'default'))
+
+
+@app.task(bind=True, queue=image_derivative_task_queue_name)
+def generate_image_derivatives(self, source_names):
+    generate_derivatives(source_names)
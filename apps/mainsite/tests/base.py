@@ -12,6 +12,8 @@ from rest_framework.test import APITransactionTestCase
 from allauth.socialaccount.models import SocialAccount
 from badgeuser.models import BadgeUser, Terms, TermsUrl, StudentAffiliation
 from directaward.models import DirectAward, DirectAwardBundle
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from institution.models import Institution, Faculty
 from issuer.models import Issuer, BadgeClass
@@ -42,6 +44,17 @@ class SetupHelper(object):
         client = GrapheneClient(schema)
         return client.execute(query, context_value=GrapheneMockContext(user))
 
+    def graphene_post_query_count(self, user, query):
+        """
+        Executes the query twice, to fill the caches, and counts the database queries of the second run
+        :return: tuple of the response and the number of queries
+        """
+        self.graphene_post(user, query)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.graphene_post(user, query)
+        self.assertNotIn('errors', response)
+        return response, len(queries)
+
     def get_testfiles_path(self, *args):
         return os.path.join(TOP_DIR, 'apps', 'issuer', 'testfiles', *args)
 
@@ -1,4 +1,16 @@
+import datetime
+
+from django.test import RequestFactory, override_settings
+from graphql import parse
+
+from issuer.models import Issuer, BadgeInstance
+from lti_edu.models import StudentsEnrolled
+from mainsite.graphql_cost import QueryCostAnalyzer, check_query_cost
+from mainsite.graphql_persisted import backend, get_persisted_document, query_hash
+from mainsite.identity_map import activate, deactivate, prefetch_cached_gets
+from mainsite.schema import schema
 from mainsite.tests import BadgrTestCase
+from mainsite.tests.base import GrapheneMockContext
 
 
 class MainGrapheneTest(BadgrTestCase):
@@ -47,3 +59,159 @@ class MainGrapheneTest(BadgrTestCase):
                                    response['data']['badgeClass']['assertionsPaginated']['edges']]
         self.assertEqual(assertions_entity_ids_2.__len__(), 3)
         self.assertFalse(all(entity_id in assertions_entity_ids_1 for entity_id in assertions_entity_ids_2))
+
+    def test_keyset_pagination(self):
+        teacher1 = self.setup_teacher(authenticate=True)
+        self.setup_staff_membership(teacher1, teacher1.institution, may_read=True)
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        for x in range(7):
+            self.setup_assertion(recipient=student, badgeclass=badgeclass, created_by=teacher1)
+        expected = list(badgeclass.badgeinstances.order_by('created_at', 'id').values_list('entity_id', flat=True))
+        query = 'query foo{badgeClass(id: "%s") {assertionsPaginated(%s) {totalCount ' \
+                'pageInfo {endCursor hasNextPage hasPreviousPage} edges {cursor node {entityId}}}}}'
+        entity_ids = []
+        arguments = 'first: 3'
+        while True:
+            response = self.graphene_post(teacher1, query % (badgeclass.entity_id, arguments))
+            connection = response['data']['badgeClass']['assertionsPaginated']
+            self.assertEqual(connection['totalCount'], 7)
+            entity_ids += [edge['node']['entityId'] for edge in connection['edges']]
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            arguments = 'first: 3, after: "{}"'.format(connection['pageInfo']['endCursor'])
+        self.assertEqual(entity_ids, expected)
+        response = self.graphene_post(teacher1, query % (badgeclass.entity_id, 'last: 2'))
+        connection = response['data']['badgeClass']['assertionsPaginated']
+        self.assertEqual([edge['node']['entityId'] for edge in connection['edges']], expected[-2:])
+        self.assertTrue(connection['pageInfo']['hasPreviousPage'])
+        response = self.graphene_post(teacher1, query % (badgeclass.entity_id, 'first: 2, after: "nonsense"'))
+        self.assertIn('errors', response)
+
+    def test_keyset_pagination_within_millisecond(self):
+        teacher1 = self.setup_teacher(authenticate=True)
+        self.setup_staff_membership(teacher1, teacher1.institution, may_read=True)
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        created_at = datetime.datetime(2021, 8, 1, 12, 0, 0, 100, tzinfo=datetime.timezone.utc)
+        for x in range(5):
+            assertion = self.setup_assertion(recipient=student, badgeclass=badgeclass, created_by=teacher1)
+            # all in the same millisecond, in the reverse order of the primary keys
+            BadgeInstance.objects.filter(pk=assertion.pk).update(
+                created_at=created_at + datetime.timedelta(microseconds=100 * (5 - x)))
+        expected = list(badgeclass.badgeinstances.order_by('created_at', 'id').values_list('entity_id', flat=True))
+        query = 'query foo{badgeClass(id: "%s") {assertionsPaginated(%s) {' \
+                'pageInfo {endCursor startCursor hasNextPage} edges {node {entityId}}}}}'
+        entity_ids = []
+        arguments = 'first: 2'
+        while True:
+            response = self.graphene_post(teacher1, query % (badgeclass.entity_id, arguments))
+            connection = response['data']['badgeClass']['assertionsPaginated']
+            entity_ids += [edge['node']['entityId'] for edge in connection['edges']]
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            arguments = 'first: 2, after: "{}"'.format(connection['pageInfo']['endCursor'])
+        self.assertEqual(entity_ids, expected)
+        response = self.graphene_post(teacher1, query % (badgeclass.entity_id, 'last: 2, before: "{}"'.format(
+            connection['pageInfo']['startCursor'])))
+        connection = response['data']['badgeClass']['assertionsPaginated']
+        self.assertEqual([edge['node']['entityId'] for edge in connection['edges']], expected[2:4])
+
+    def test_graphql_query_count_independent_of_size(self):
+        teacher1 = self.setup_teacher()
+        self.setup_staff_membership(teacher1, teacher1.institution, may_read=True, may_award=True)
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+
+        def extend_tree():
+            faculty = self.setup_faculty(institution=teacher1.institution)
+            issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+            self.setup_staff_membership(self.setup_teacher(institution=teacher1.institution), issuer, may_read=True)
+            for _ in range(2):
+                badgeclass = self.setup_badgeclass(issuer=issuer)
+                badgeclass.tag_items = ['tag']
+                StudentsEnrolled.objects.create(badge_class=badgeclass, user=student)
+                self.setup_direct_award(badgeclass)
+
+        queries = [
+            'query foo {issuers {entityId faculty {entityId institution {entityId}} staff {user {entityId}} '
+            'badgeclasses {entityId tags {name} enrollments {user {entityId}} pendingEnrollments {entityId}}}}',
+            'query foo {currentInstitution {faculties {entityId staff {user {entityId}} '
+            'issuers {entityId badgeclasses {entityId issuer {entityId}}}}}}',
+            'query foo {badgeClassesToAward {entityId issuer {faculty {entityId}} directAwards {entityId} '
+            'directAwardBundles {entityId directAwards {badgeclass {entityId}}}}}',
+        ]
+        extend_tree()
+        counts = [self.graphene_post_query_count(teacher1, query)[1] for query in queries]
+        extend_tree()
+        extend_tree()
+        for query, count in zip(queries, counts):
+            response, new_count = self.graphene_post_query_count(teacher1, query)
+            self.assertEqual(new_count, count, query)
+        self.assertEqual(len(response['data']['badgeClassesToAward']), 6)
+
+    def test_query_cost(self):
+        def analyze(query):
+            return QueryCostAnalyzer(schema, parse(query)).analyze()
+        self.assertEqual(analyze('query foo {issuers(first: 5) {entityId badgeclasses {entityId}}}'), (6, 3))
+        self.assertEqual(analyze('query foo {badgeClass(id: "x") {assertionsPaginated(first: 20) '
+                                 '{edges {node {entityId user {entityId}}}}}}'), (22, 4))
+        self.assertEqual(analyze('query foo {badgeInstances {validation}}'), (501, 2))
+        self.assertEqual(analyze('query foo {issuers {...issuerFields}} '
+                                 'fragment issuerFields on IssuerType {badgeclasses {entityId}}'), (11, 3))
+
+        request = RequestFactory().post('/graphql')
+        request.user = self.setup_teacher()
+        query = parse('query foo {issuers(first: 5) {entityId badgeclasses {entityId}}}')
+        self.assertIsNone(check_query_cost(schema, query, {}, None, request))
+        with override_settings(GRAPHQL_MAX_QUERY_DEPTH=2):
+            self.assertIsNotNone(check_query_cost(schema, query, {}, None, request))
+        with override_settings(GRAPHQL_MAX_QUERY_COST=5):
+            self.assertIsNotNone(check_query_cost(schema, query, {}, None, request))
+        with override_settings(GRAPHQL_COST_BUDGET_PER_MINUTE=10):
+            request.user = self.setup_teacher()
+            self.assertIsNone(check_query_cost(schema, query, {}, None, request))
+            self.assertIsNotNone(check_query_cost(schema, query, {}, None, request))
+
+    def test_persisted_queries(self):
+        teacher1 = self.setup_teacher()
+        query = 'query persisted {currentUser {entityId}}'
+        document, errors = get_persisted_document(schema, query_hash(query), None)
+        self.assertIsNone(document)
+        self.assertEqual(errors[0].message, 'PersistedQueryNotFound')
+        document, errors = get_persisted_document(schema, query_hash('query other {currentUser {email}}'), query)
+        self.assertIsNone(document)
+        document, errors = get_persisted_document(schema, query_hash('query foo {unknownField}'),
+                                                  'query foo {unknownField}')
+        self.assertIsNone(document)
+        self.assertTrue(errors)
+        document, errors = get_persisted_document(schema, query_hash(query), query)
+        self.assertEqual(errors, [])
+        self.assertIs(get_persisted_document(schema, query_hash(query), None)[0], document)
+        self.assertIs(backend.document_from_string(schema, query), document)
+        result = document.execute(context=GrapheneMockContext(teacher1))
+        self.assertEqual(result.data['currentUser']['entityId'], teacher1.entity_id)
+
+
+class IdentityMapTest(BadgrTestCase):
+
+    def test_identity_map(self):
+        teacher1 = self.setup_teacher()
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        other_issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        activate()
+        try:
+            prefetch_cached_gets(Issuer, [issuer.pk, other_issuer.pk])
+            cached_issuer = Issuer.cached.get(pk=issuer.pk)
+            self.assertIs(Issuer.cached.get(pk=issuer.pk), cached_issuer)
+            self.assertIs(Issuer.cached.get(pk=other_issuer.pk), Issuer.cached.get(pk=other_issuer.pk))
+            issuer.name_english = 'Renamed issuer'
+            issuer.save()
+            self.assertEqual(Issuer.cached.get(pk=issuer.pk).name_english, 'Renamed issuer')
+        finally:
+            deactivate()
+        self.assertIsNot(Issuer.cached.get(pk=issuer.pk), Issuer.cached.get(pk=issuer.pk))
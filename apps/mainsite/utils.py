@@ -25,6 +25,7 @@ from django.core import mail
 from django.core.exceptions import ValidationError
 from django.core.files.storage import DefaultStorage, default_storage
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import transaction
 from django.template.loader import render_to_string
 from django.urls import get_callable, reverse
 from django.utils.html import format_html
@@ -254,10 +255,11 @@ class EmailMessageMaker:
         return render_to_string(template, email_vars)
 
     @staticmethod
-    def create_earned_badge_mail(assertion):
+    def create_earned_badge_mail(assertion, badgeclass_image=None):
         badgeclass = assertion.badgeclass
         template = 'email/earned_badge.html'
-        badgeclass_image = EmailMessageMaker._create_example_image(badgeclass)
+        if badgeclass_image is None:
+            badgeclass_image = EmailMessageMaker._create_example_image(badgeclass)
         email_vars = {
             'badgeclass_image': badgeclass_image,
             'issuer_image': badgeclass.issuer.image_url(),
@@ -293,6 +295,31 @@ class EmailMessageMaker:
         return render_to_string(template, email_vars)
 
 
+def schedule_task_on_commit(task, args_list, **kwargs):
+    """
+    Queues a celery task for every tuple of positional arguments once the current transaction is committed,
+    so the workers see the committed rows
+    :param kwargs: keyword arguments passed to every task
+    """
+    args_list = list(args_list)
+    if not args_list:
+        return
+
+    def _schedule():
+        for args in args_list:
+            task.delay(*args, **kwargs)
+
+    transaction.on_commit(_schedule)
+
+
+def batched(items, batch_size):
+    """
+    :return: the items in lists of at most batch_size
+    """
+    items = list(items)
+    return [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+
+
 def send_mail(subject, message, recipient_list=None, html_message=None, bcc=None):
     if settings.LOCAL_DEVELOPMENT_MODE:
         open_mail_in_browser(html_message)
@@ -305,6 +332,23 @@ def send_mail(subject, message, recipient_list=None, html_message=None, bcc=None
         mail.send_mail(subject, message, from_email=None, recipient_list=recipient_list, html_message=html_message)
 
 
+def send_mass_html_mail(subject, messages):
+    """
+    Sends html mails over a single connection
+    :param messages: list of (html_message, recipient_list) tuples
+    """
+    connection = mail.get_connection()
+    emails = []
+    for html_message, recipient_list in messages:
+        if settings.LOCAL_DEVELOPMENT_MODE:
+            open_mail_in_browser(html_message)
+        msg = mail.EmailMessage(subject=subject, body=transform(html_message), from_email=None, to=recipient_list,
+                                connection=connection)
+        msg.content_subtype = "html"
+        emails.append(msg)
+    return connection.send_messages(emails)
+
+
 def admin_list_linkify(field_name, label_param=None):
     """
     Converts a foreign key value into clickable links for the admin list view.
@@ -1,4 +1,5 @@
 import base64
+import os
 import time
 
 from django import forms
@@ -6,10 +7,11 @@ from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.db import IntegrityError
 from django.http import HttpResponse, HttpResponseServerError, HttpResponseNotFound
-from django.http import HttpResponseForbidden
+from django.http import HttpResponseForbidden, Http404
 from django.shortcuts import redirect
 from django.template import loader, TemplateDoesNotExist
 from django.urls import reverse_lazy
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.generic import FormView, RedirectView
@@ -113,14 +115,36 @@ class SitewideActionFormView(FormView):
         return super(SitewideActionFormView, self).form_valid(form)
 
 
+def _serve_baked_image(request, path, document_root, public, requested_path):
+    """
+    Baked images named assertion-{entity_id}.{hash}{ext} never change, so they are cached as immutable when they are
+    served at their own url, see BadgeInstance.bake_image
+    """
+    response = serve(request, path, document_root)
+    if response.status_code == 200 and path == requested_path and '.' in os.path.splitext(os.path.basename(path))[0]:
+        policy = getattr(settings, 'PUBLIC_API_CACHE_CONTROL', {}).get('baked_image', {})
+        patch_cache_control(response, **dict(policy, **{'public' if public else 'private': True}))
+    return response
+
+
 def serve_protected_document(request, path, document_root):
     if 'assertion-' in path:
-        assertion = BadgeInstance.objects.get(image=path)
+        requested_path = path
+        try:
+            assertion = BadgeInstance.objects.get(image=path)
+        except BadgeInstance.DoesNotExist:
+            # requested before the image was baked, the name of the image is assertion-{entity_id}{ext}
+            entity_id = os.path.splitext(os.path.basename(path))[0][len('assertion-'):].split('.')[0]
+            assertion = BadgeInstance.objects.get(entity_id=entity_id)
+            assertion.ensure_baked()
+            if not assertion.image:
+                raise Http404
+            path = assertion.image.name
         if assertion.public:
-            return serve(request, path, document_root)
+            return _serve_baked_image(request, path, document_root, True, requested_path)
         else:
             if request.user.is_authenticated:
                 if request.user is assertion.user or request.user.get_permissions(assertion)['may_read']:
-                    return serve(request, path, document_root)
+                    return _serve_baked_image(request, path, document_root, False, requested_path)
         return HttpResponseForbidden()
     return serve(request, path, document_root)
@@ -1,32 +1,41 @@
-import io
-import os
+import gzip
+import hashlib
 import re
+from calendar import timegm
 
 import badgrlog
-import cairosvg
-from PIL import Image
+from cachemodel.utils import generate_cache_key
 from django.conf import settings
-from django.core.files.storage import DefaultStorage
-from django.http import Http404, HttpResponseRedirect
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import redirect, render_to_response
 from django.urls import resolve, reverse, Resolver404, NoReverseMatch
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.utils.text import compress_string
 from django.views.generic import RedirectView
 from entity.api import VersionedObjectMixin, BaseEntityDetailView
+from entity.cache import get_revisions
 from mainsite.exceptions import BadgrApiException400
+from mainsite.image_derivatives import DERIVATIVE_FORMATS, get_or_render_derivative, schedule_derivatives
 from mainsite.models import BadgrApp
 from mainsite.utils import OriginSetting
 from rest_framework import status, permissions
 from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from signing.models import PublicKeyIssuer
 
-from institution.models import Institution
+from institution.models import Institution, Faculty
 from issuer import utils
-from issuer.models import Issuer, BadgeClass, BadgeInstance
+from issuer.models import Issuer, BadgeClass, BadgeInstance, IssuerStatusList
 
 logger = badgrlog.BadgrLogger()
 
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
 
 class AssertionValidate(BaseEntityDetailView):
     """
@@ -75,14 +84,45 @@ class SlugToEntityIdRedirectMixin(object):
             raise Http404
 
 
-class JSONComponentView(VersionedObjectMixin, APIView, SlugToEntityIdRedirectMixin):
+class CacheControlMixin(object):
+    """
+    Sets the Cache-Control policy named cache_control_policy in PUBLIC_API_CACHE_CONTROL on the successful responses
+    of a view, and the Vary headers of the request headers the response depends on
+    """
+    cache_control_policy = 'json'
+    vary_headers = ()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(CacheControlMixin, self).finalize_response(request, response, *args, **kwargs)
+        if response.status_code < 400:
+            policy = getattr(settings, 'PUBLIC_API_CACHE_CONTROL', {}).get(self.cache_control_policy)
+            if policy:
+                patch_cache_control(response, **policy)
+        if self.vary_headers:
+            patch_vary_headers(response, self.vary_headers)
+        return response
+
+
+def _issuer_objects(issuer):
+    """the issuer and the faculty and institution it belongs to, resolved from cache"""
+    faculty = Faculty.cached.get(pk=issuer.faculty_id)
+    return [issuer, faculty, Institution.cached.get(pk=faculty.institution_id)]
+
+
+class JSONComponentView(CacheControlMixin, VersionedObjectMixin, APIView, SlugToEntityIdRedirectMixin):
     """
     Abstract Component Class
+
+    The json responses carry a strong ETag, built from the revisions of the entities the json is built from, and a
+    Last-Modified. A conditional request that matches them is answered with 304 Not Modified without building the json.
+    The rendered json is cached gzipped by its ETag, see get_rendered_response.
     """
     permission_classes = (permissions.AllowAny,)
     authentication_classes = ()
     html_renderer_class = None
     template_name = 'public/bot_openbadge.html'
+    # bots get html and browsers a redirect instead of the json
+    vary_headers = ('Accept', 'Accept-Encoding', 'User-Agent')
 
     def log(self, obj):
         pass
@@ -91,6 +131,66 @@ class JSONComponentView(VersionedObjectMixin, APIView, SlugToEntityIdRedirectMix
         json = self.current_object.get_json(obi_version=self._get_request_obi_version(request), **kwargs)
         return json
 
+    def get_source_objects(self, request):
+        """
+        :return: the objects the json is built from, for the requested expands
+        """
+        return [self.current_object]
+
+    def get_dependencies(self, request):
+        """
+        :return: the (class_name, pk) tuples whose revisions make up the ETag, see entity.cache
+        """
+        return [(obj.__class__.__name__, obj.pk) for obj in self.get_source_objects(request)]
+
+    def get_etag(self, request):
+        dependencies = self.get_dependencies(request)
+        revisions = get_revisions(dependencies)
+        parts = [self.__class__.__name__, self._get_request_obi_version(request),
+                 repr(sorted(request.GET.lists())), repr(dependencies)] + revisions
+        return quote_etag(hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest())
+
+    def get_last_modified(self, request):
+        updated = [obj.updated_at for obj in self.get_source_objects(request) if getattr(obj, 'updated_at', None)]
+        return max(updated) if updated else None
+
+    def get_json_response(self, request):
+        etag, last_modified = self.get_etag(request), self.get_last_modified(request)
+        last_modified_timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified_timestamp)
+        if response is None:
+            response = self.get_rendered_response(request, etag)
+        # the gzipped bytes are a different representation of the same json
+        response['ETag'] = 'W/' + etag if response.has_header('Content-Encoding') else etag
+        if last_modified_timestamp is not None:
+            response['Last-Modified'] = http_date(last_modified_timestamp)
+        return response
+
+    def get_rendered_response(self, request, etag):
+        """
+        The rendered bytes of the json are cached gzipped by the ETag and media type. The ETag changes whenever an
+        entity the json is built from is saved or published, so cached bytes are never stale and a hit skips building
+        and rendering the json. Clients that accept gzip get the cached bytes as they are.
+        """
+        renderer, media_type = request.accepted_renderer, request.accepted_media_type
+        if not isinstance(renderer, JSONRenderer):
+            return Response(self.get_json(request=request))
+        content_type = '{}; charset={}'.format(media_type, renderer.charset) if renderer.charset else media_type
+        key = generate_cache_key(['PublicJsonResponse'], etag=etag, media_type=media_type)
+        compressed, content = cache.get(key), None
+        if compressed is None:
+            content = renderer.render(self.get_json(request=request), media_type, self.get_renderer_context())
+            compressed = compress_string(content)
+            if len(compressed) <= getattr(settings, 'PUBLIC_JSON_RESPONSE_CACHE_MAX_SIZE', 1000000):
+                cache.set(key, compressed, getattr(settings, 'PUBLIC_JSON_RESPONSE_CACHE_TIMEOUT', 60 * 60 * 24))
+        if re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            response = HttpResponse(compressed, content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(content if content is not None else gzip.decompress(compressed),
+                                    content_type=content_type)
+        return response
+
     def get(self, request, **kwargs):
         try:
             self.current_object = self.get_object(request, **kwargs)
@@ -115,8 +215,7 @@ class JSONComponentView(VersionedObjectMixin, APIView, SlugToEntityIdRedirectMix
         if self.is_requesting_html():
             return HttpResponseRedirect(redirect_to=self.get_badgrapp_redirect())
 
-        json = self.get_json(request=request)
-        return Response(json)
+        return self.get_json_response(request)
 
     def is_bot(self):
         """
@@ -178,8 +277,9 @@ class JSONComponentView(VersionedObjectMixin, APIView, SlugToEntityIdRedirectMix
         return request.query_params.get('v', utils.CURRENT_OBI_VERSION)
 
 
-class ImagePropertyDetailView(APIView, SlugToEntityIdRedirectMixin):
+class ImagePropertyDetailView(CacheControlMixin, APIView, SlugToEntityIdRedirectMixin):
     permission_classes = (permissions.AllowAny,)
+    cache_control_policy = 'image'
 
     def get_object(self, entity_id):
         try:
@@ -212,63 +312,28 @@ class ImagePropertyDetailView(APIView, SlugToEntityIdRedirectMixin):
         if image_type not in ['original', 'png']:
             raise ValidationError("invalid image type: {}".format(image_type))
 
-        supported_fmts = {
-            'square': (1, 1),
-            'wide': (1.91, 1)
-        }
         image_fmt = request.query_params.get('fmt', 'square').lower()
-        if image_fmt not in list(supported_fmts.keys()):
+        if image_fmt not in DERIVATIVE_FORMATS:
             raise ValidationError("invalid image format: {}".format(image_fmt))
 
-        image_url = image_prop.url
-        filename, ext = os.path.splitext(image_prop.name)
-        basename = os.path.basename(filename)
-        dirname = os.path.dirname(filename)
-        version_suffix = getattr(settings, 'CAIROSVG_VERSION_SUFFIX', '1')
-        new_name = '{dirname}/converted{version}/{basename}{fmt_suffix}.png'.format(
-            dirname=dirname,
-            basename=basename,
-            version=version_suffix,
-            fmt_suffix="-{}".format(image_fmt) if image_fmt != 'square' else ""
-        )
-        storage = DefaultStorage()
-
-        def _fit_to_height(img, ar, height=400):
-            img.thumbnail((height,height))
-            new_size = (int(ar[0]*height), int(ar[1]*height))
-            new_img = Image.new("RGBA", new_size)
-            new_img.paste(img, ((new_size[0] - height)/2, (new_size[1] - height)/2))
-            new_img.show()
-            return new_img
-
-        if image_type == 'original' and image_fmt == 'square':
-            image_url = image_prop.url
-        elif ext == '.svg':
-            if not storage.exists(new_name):
-                with storage.open(image_prop.name, 'rb') as input_svg:
-                    svg_buf = io.StringIO()
-                    out_buf = io.StringIO()
-                    cairosvg.svg2png(file_obj=input_svg, write_to=svg_buf)
-                    img = Image.open(svg_buf)
-
-                    img = _fit_to_height(img, supported_fmts[image_fmt])
-
-                    img.save(out_buf, format='png')
-                    storage.save(new_name, out_buf)
-            image_url = storage.url(new_name)
-        else:
-            if not storage.exists(new_name):
-                with storage.open(image_prop.name, 'rb') as input_svg:
-                    out_buf = io.StringIO()
-                    img = Image.open(input_svg)
-
-                    img = _fit_to_height(img, supported_fmts[image_fmt])
+        height = request.query_params.get('size')
+        if height is not None:
+            max_height = getattr(settings, 'IMAGE_DERIVATIVE_MAX_SIZE', 1024)
+            if not height.isdigit() or not 16 <= int(height) <= max_height:
+                raise ValidationError("invalid image size: {}, must be between 16 and {}".format(height, max_height))
+            height = int(height)
 
-                    img.save(out_buf, format='png')
-                    storage.save(new_name, out_buf)
-            image_url = storage.url(new_name)
+        if image_type == 'original' and image_fmt == 'square' and height is None:
+            return redirect(image_prop.url)
 
-        return redirect(image_url)
+        derivative = get_or_render_derivative(image_prop.name, image_fmt, height)
+        if derivative is None:
+            # too many derivatives are rendered right now, the original will do until they are generated
+            schedule_derivatives([image_prop.name])
+            response = redirect(image_prop.url)
+            patch_cache_control(response, no_cache=True)
+            return response
+        return redirect(derivative.image.url)
 
 
 class InstitutionJson(JSONComponentView):
@@ -317,6 +382,9 @@ class IssuerJson(JSONComponentView):
 
         return json
 
+    def get_source_objects(self, request):
+        return _issuer_objects(self.current_object)
+
     def get_context_data(self, **kwargs):
         image_url = "{}{}?type=png".format(
             OriginSetting.HTTP,
@@ -360,6 +428,36 @@ class IssuerBadgesJson(JSONComponentView):
 
         return [b.get_json(obi_version=obi_version) for b in self.current_object.cached_badgeclasses()]
 
+    def get_source_objects(self, request):
+        return [self.current_object] + list(self.current_object.cached_badgeclasses())
+
+
+class IssuerStatusListJson(JSONComponentView):
+    """
+    The revocation status list of the assertions of an issuer, see IssuerStatusList. The ETag changes whenever a bit
+    changes, so a conditional request is answered without touching the database.
+    """
+    permission_classes = (permissions.AllowAny,)
+    model = Issuer
+    cache_control_policy = 'status_list'
+
+    def get(self, request, **kwargs):
+        self.current_object = self.get_object(request, **kwargs)
+        return self.get_json_response(request)
+
+    def get_json(self, request):
+        try:
+            status_list = IssuerStatusList.objects.get(issuer=self.current_object)
+        except IssuerStatusList.DoesNotExist:
+            raise Http404
+        return status_list.get_json()
+
+    def get_dependencies(self, request):
+        return [('Issuer', self.current_object.pk), ('IssuerStatusList', self.current_object.pk)]
+
+    def get_last_modified(self, request):
+        return None
+
 
 class IssuerImage(ImagePropertyDetailView):
     model = Issuer
@@ -378,10 +476,12 @@ class BadgeClassJson(JSONComponentView):
     def log(self, obj):
         logger.event(badgrlog.BadgeClassRetrievedEvent(obj, self.request))
 
-    def get_json(self, request):
+    def get_json_response(self, request):
         if self.current_object.is_private:
             raise Http404
+        return super(BadgeClassJson, self).get_json_response(request)
 
+    def get_json(self, request):
         expands = request.GET.getlist('expand', [])
         json = super(BadgeClassJson, self).get_json(request)
         obi_version = self._get_request_obi_version(request)
@@ -397,6 +497,18 @@ class BadgeClassJson(JSONComponentView):
 
         return json
 
+    def get_source_objects(self, request):
+        if 'issuer' in request.GET.getlist('expand', []):
+            return [self.current_object] + _issuer_objects(self.current_object.cached_issuer)
+        return [self.current_object, self.current_object.cached_issuer]
+
+    def get_dependencies(self, request):
+        dependencies = super(BadgeClassJson, self).get_dependencies(request)
+        if 'awards' in request.GET.getlist('expand', []):
+            # the names of the institutions awards are allowed to
+            dependencies.append(('Institution', '*'))
+        return dependencies
+
     def get_context_data(self, **kwargs):
         image_url = "{}{}?type=png".format(
             OriginSetting.HTTP,
@@ -456,6 +568,7 @@ class BadgeInstanceJson(JSONComponentView):
     """
     permission_classes = (permissions.AllowAny,)
     model = BadgeInstance
+    cache_control_policy = 'assertion'
 
     def get_json(self, request):
         if self.object.signature:
@@ -469,6 +582,12 @@ class BadgeInstanceJson(JSONComponentView):
             )
         return json
 
+    def get_source_objects(self, request):
+        badgeclass = self.current_object.cached_badgeclass
+        if 'badge.issuer' in request.GET.getlist('expand', []):
+            return [self.current_object, badgeclass] + _issuer_objects(badgeclass.cached_issuer)
+        return [self.current_object, badgeclass, badgeclass.cached_issuer]
+
     def get_context_data(self, **kwargs):
         image_url = "{}{}?type=png".format(
             OriginSetting.HTTP,
@@ -495,12 +614,15 @@ class BadgeInstanceImage(ImagePropertyDetailView):
         obj = super(BadgeInstanceImage, self).get_object(slug)
         if obj and obj.revoked:
             return None
+        if obj:
+            obj.ensure_baked()
         return obj
 
 
-class BakedBadgeInstanceImage(VersionedObjectMixin, APIView, SlugToEntityIdRedirectMixin):
+class BakedBadgeInstanceImage(CacheControlMixin, VersionedObjectMixin, APIView, SlugToEntityIdRedirectMixin):
     permission_classes = (permissions.AllowAny,)
     model = BadgeInstance
+    cache_control_policy = 'image'
 
     def get(self, request, **kwargs):
         try:
@@ -531,8 +653,10 @@ class AssertionRecipientName(APIView):
         salt = kwargs.get('salt', None)
         if not identity or not salt:
             raise BadgrApiException400('Cannot query name: salt and identity needed', 0)
-        instance = BadgeInstance.objects.get(salt=salt)
-        if instance.public:
-            if identity == instance.get_hashed_identity():
+        # assertions that are not backfilled yet have no recipient_hash and are matched by recomputing it
+        instance = BadgeInstance.objects.filter(Q(recipient_hash=identity) | Q(recipient_hash__isnull=True),
+                                                salt=salt).first()
+        if instance is not None and instance.public:
+            if identity == (instance.recipient_hash or instance.get_hashed_identity()):
                 return Response({'name': instance.get_recipient_name()})
         return Response(status=status.HTTP_404_NOT_FOUND)
@@ -2,7 +2,8 @@ from django.conf.urls import url
 from django.views.decorators.clickjacking import xframe_options_exempt
 from rest_framework.urlpatterns import format_suffix_patterns
 
-from .public_api import (InstitutionJson, InstitutionImage, IssuerJson, IssuerBadgesJson, IssuerImage, BadgeClassJson,
+from .public_api import (InstitutionJson, InstitutionImage, IssuerJson, IssuerBadgesJson, IssuerStatusListJson,
+                         IssuerImage, BadgeClassJson,
                          BadgeClassImage, BadgeClassCriteria, BadgeInstanceJson,
                          BadgeInstanceImage, BakedBadgeInstanceImage,
                          BadgeClassPublicKeyJson, IssuerPublicKeyJson, AssertionValidate, AssertionRecipientName)
@@ -12,6 +13,7 @@ json_patterns = [
     url(r'^issuers/(?P<entity_id>[^/.]+)$', xframe_options_exempt(IssuerJson.as_view(slugToEntityIdRedirect=True)), name='issuer_json'),
     url(r'^issuers/(?P<entity_id>[^/.]+)/pubkey/(?P<public_key_id>[^/.]+)$', xframe_options_exempt(IssuerPublicKeyJson.as_view(slugToEntityIdRedirect=True)), name='issuer_public_key_json'),
     url(r'^issuers/(?P<entity_id>[^/.]+)/badges$', xframe_options_exempt(IssuerBadgesJson.as_view(slugToEntityIdRedirect=True)), name='issuer_badges_json'),
+    url(r'^issuers/(?P<entity_id>[^/.]+)/status-list$', xframe_options_exempt(IssuerStatusListJson.as_view(slugToEntityIdRedirect=True)), name='issuer_status_list_json'),
     url(r'^badges/(?P<entity_id>[^/.]+)$', xframe_options_exempt(BadgeClassJson.as_view(slugToEntityIdRedirect=True)), name='badgeclass_json'),
     url(r'^badges/(?P<entity_id>[^/.]+)/pubkey/(?P<public_key_id>[^/.]+)$', xframe_options_exempt(BadgeClassPublicKeyJson.as_view(slugToEntityIdRedirect=True)), name='badgeclass_public_key_json'),
     url(r'^assertions/(?P<entity_id>[^/.]+)$', xframe_options_exempt(BadgeInstanceJson.as_view(slugToEntityIdRedirect=True)), name='badgeinstance_json'),
@@ -3,6 +3,7 @@ import json
 from django.conf import settings
 from django.db import models
 from django.urls import reverse
+from entity.cache import bump_revision
 from entity.models import BaseVersionedEntity
 from mainsite.utils import OriginSetting
 from signing import timestamping
@@ -128,6 +129,17 @@ class PublicKeyIssuer(BaseVersionedEntity, models.Model):
     issuer = models.ForeignKey('issuer.Issuer', on_delete=models.PROTECT)
     public_key = models.ForeignKey('signing.PublicKey', on_delete=models.PROTECT, null=True, default=None)
 
+    def save(self, *args, **kwargs):
+        super(PublicKeyIssuer, self).save(*args, **kwargs)
+        # the cached json documents of the signed assertions embed the key
+        bump_revision(self.__class__.__name__, self.pk)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        ret = super(PublicKeyIssuer, self).delete(*args, **kwargs)
+        bump_revision(self.__class__.__name__, pk)
+        return ret
+
     def get_absolute_url(self):
         return reverse('signing_public_key_json', kwargs={'entity_id': self.entity_id})
 
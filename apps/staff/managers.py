@@ -0,0 +1,198 @@
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import models
+from django.db.models import Q
+
+from staff.permission_matrix import STAFF_LEVELS
+
+LEVELS = ('Institution', 'Faculty', 'Issuer', 'BadgeClass')
+ENTITY_MODELS = {'Institution': ('institution', 'Institution'),
+                 'Faculty': ('institution', 'Faculty'),
+                 'Issuer': ('issuer', 'Issuer'),
+                 'BadgeClass': ('issuer', 'BadgeClass')}
+# the level of the parent and the attribute that holds its pk
+PARENTS = {'Faculty': ('Institution', 'institution_id'),
+           'Issuer': ('Faculty', 'faculty_id'),
+           'BadgeClass': ('Issuer', 'issuer_id')}
+
+
+def _node(entity):
+    return entity.__class__.__name__, entity.pk
+
+
+def _nodes_filter(prefix, nodes):
+    """Q object that matches any of the (type, pk) nodes on either the ancestor or the descendant side"""
+    by_type = defaultdict(list)
+    for node_type, pk in nodes:
+        by_type[node_type].append(pk)
+    q = Q(pk__in=[])
+    for node_type, pks in by_type.items():
+        q |= Q(**{prefix + '_type': node_type, prefix + '_id__in': pks})
+    return q
+
+
+class EntityClosureManager(models.Manager):
+    use_in_migrations = True
+
+    def _get_model(self, node_type):
+        return self.model._meta.apps.get_model(*ENTITY_MODELS[node_type])
+
+    def sync(self, entity):
+        """
+        Updates the rows of an entity after it has been saved: adds them for a new entity, moves the branch under
+        the entity when its parent has changed and copies its archived flag.
+        """
+        node_type, pk = _node(entity)
+        parent_type, parent_field = PARENTS.get(node_type, (None, None))
+        parent_id = getattr(entity, parent_field) if parent_field else None
+        archived = getattr(entity, 'archived', False)
+        rows = {row.depth: row for row in self.filter(descendant_type=node_type, descendant_id=pk, depth__lte=1)}
+        if 0 not in rows:
+            new_rows = [self.model(ancestor_type=node_type, ancestor_id=pk, descendant_type=node_type,
+                                   descendant_id=pk, depth=0, archived=archived)]
+            if parent_type:
+                new_rows += [self.model(ancestor_type=row.ancestor_type, ancestor_id=row.ancestor_id,
+                                        descendant_type=node_type, descendant_id=pk, depth=row.depth + 1,
+                                        archived=archived)
+                             for row in self.filter(descendant_type=parent_type, descendant_id=parent_id)]
+            self.bulk_create(new_rows)
+            return
+        if parent_type and (1 not in rows or rows[1].ancestor_id != parent_id):
+            self._move(node_type, pk, parent_type, parent_id)
+        if rows[0].archived != archived:
+            self.filter(descendant_type=node_type, descendant_id=pk).update(archived=archived)
+
+    def _move(self, node_type, pk, parent_type, parent_id):
+        branch = list(self.filter(ancestor_type=node_type, ancestor_id=pk))
+        branch_filter = _nodes_filter('descendant', [(row.descendant_type, row.descendant_id) for row in branch])
+        old_ancestors = self.filter(descendant_type=node_type, descendant_id=pk, depth__gt=0) \
+            .values_list('ancestor_type', 'ancestor_id')
+        if old_ancestors:
+            self.filter(branch_filter).filter(_nodes_filter('ancestor', old_ancestors)).delete()
+        self.bulk_create([self.model(ancestor_type=ancestor.ancestor_type, ancestor_id=ancestor.ancestor_id,
+                                     descendant_type=row.descendant_type, descendant_id=row.descendant_id,
+                                     depth=ancestor.depth + row.depth + 1, archived=row.archived)
+                          for ancestor in self.filter(descendant_type=parent_type, descendant_id=parent_id)
+                          for row in branch])
+
+    def remove(self, entity):
+        """
+        Removes the rows of an entity and of everything in the branch under it, archived or not
+        """
+        node_type, pk = _node(entity)
+        branch = self.filter(ancestor_type=node_type, ancestor_id=pk).values_list('descendant_type', 'descendant_id')
+        if branch:
+            self.filter(_nodes_filter('descendant', branch)).delete()
+
+    def ancestor_ids(self, entity, node_type):
+        return self.filter(descendant_type=entity.__class__.__name__, descendant_id=entity.pk, depth__gt=0,
+                           ancestor_type=node_type).values('ancestor_id')
+
+    def descendant_ids(self, nodes, node_type, include_self=False, include_archived=False):
+        """
+        :param nodes: entities or (type, pk) tuples
+        :return: queryset of the pks of the entities of node_type under any of the nodes
+        """
+        nodes = [node if isinstance(node, tuple) else _node(node) for node in nodes]
+        queryset = self.filter(_nodes_filter('ancestor', nodes), descendant_type=node_type)
+        if not include_self:
+            queryset = queryset.filter(depth__gt=0)
+        if not include_archived:
+            queryset = queryset.filter(archived=False)
+        return queryset.values('descendant_id')
+
+    def get_ancestors(self, entity):
+        """
+        :return: the ancestors of an entity, nearest first
+        """
+        node_type = entity.__class__.__name__
+        ancestors = []
+        for level in reversed(LEVELS[:LEVELS.index(node_type)]):
+            ancestors += list(self._get_model(level).objects.filter(pk__in=self.ancestor_ids(entity, level)))
+        return ancestors
+
+    def get_descendants(self, entity, include_archived=False):
+        """
+        :return: the entities in the branch under entity in depth first order, with one query per level
+        """
+        node_type = entity.__class__.__name__
+        children = defaultdict(list)
+        for level in LEVELS[LEVELS.index(node_type) + 1:]:
+            parent_type, parent_field = PARENTS[level]
+            for child in self._get_model(level).objects.filter(
+                    pk__in=self.descendant_ids([entity], level, include_archived=include_archived)).order_by('pk'):
+                children[(parent_type, getattr(child, parent_field))].append(child)
+
+        def _walk(node):
+            for child in children[node]:
+                yield child
+                yield from _walk(_node(child))
+        return list(_walk(_node(entity)))
+
+    def rebuild(self):
+        """
+        Rebuilds all rows from the entity tables
+        :return: the number of rows
+        """
+        self.all().delete()
+        ancestors = {}
+        rows = []
+        for level in LEVELS:
+            model = self._get_model(level)
+            parent_type, parent_field = PARENTS.get(level, (None, None))
+            has_archived = any(field.name == 'archived' for field in model._meta.fields)
+            fields = ['pk'] + ([parent_field] if parent_field else []) + (['archived'] if has_archived else [])
+            for values in model.objects.values(*fields):
+                node = (level, values['pk'])
+                node_ancestors = [(node, 0)]
+                if parent_field:
+                    node_ancestors += [(ancestor, depth + 1)
+                                       for ancestor, depth in ancestors.get((parent_type, values[parent_field]), [])]
+                ancestors[node] = node_ancestors
+                rows += [self.model(ancestor_type=ancestor[0], ancestor_id=ancestor[1], descendant_type=level,
+                                    descendant_id=values['pk'], depth=depth,
+                                    archived=values.get('archived', False))
+                         for ancestor, depth in node_ancestors]
+        self.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+
+class PermissionedQuerySet(models.QuerySet):
+
+    def with_permission(self, user, *permissions):
+        """
+        Limits the queryset to the entities the user has all of the given permissions on. Like get_permissions a
+        permission is inherited from a staff membership on the entity or on any of its ancestors, and every teacher may
+        read the tree of their own institution. The rules are expressed as subqueries on the staff and closure tables.
+        """
+        if getattr(user, 'pk', None) is None:
+            return self.none()
+        node_type = self.model.__name__
+        closure = apps.get_model('staff', 'EntityClosure').objects.filter(descendant_type=node_type)
+        queryset = self
+        for permission in permissions:
+            condition = Q(pk__in=[])
+            for level, staff_model, field, institution_path in STAFF_LEVELS[:LEVELS.index(node_type) + 1]:
+                memberships = apps.get_model('staff', staff_model).objects.filter(user=user, **{permission: True})
+                condition |= Q(pk__in=closure.filter(ancestor_type=level,
+                                                     ancestor_id__in=memberships.values(field)).values('descendant_id'))
+            if permission == 'may_read' and user.is_teacher and user.institution_id:
+                condition |= Q(pk__in=closure.filter(ancestor_type='Institution',
+                                                     ancestor_id=user.institution_id).values('descendant_id'))
+            queryset = queryset.filter(condition)
+        return queryset
+
+
+class PermissionedManagerMixin(object):
+    """Manager mixin for the entities that have staff memberships, adds with_permission"""
+
+    def get_queryset(self):
+        return PermissionedQuerySet(self.model, using=self._db)
+
+    def with_permission(self, user, *permissions):
+        return self.get_queryset().with_permission(user, *permissions)
+
+
+class PermissionedManager(PermissionedManagerMixin, models.Manager):
+    pass
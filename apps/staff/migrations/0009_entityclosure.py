@@ -0,0 +1,40 @@
+# Generated by Django 2.2.18 on 2021-07-19 10:12
+
+from django.db import migrations, models
+import staff.managers
+
+
+def rebuild_closure(apps, schema_editor):
+    apps.get_model('staff', 'EntityClosure').objects.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('institution', '0042_auto_20210512_1538'),
+        ('issuer', '0095_badgeclassstats'),
+        ('staff', '0008_auto_20200526_1536'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntityClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor_type', models.CharField(max_length=32)),
+                ('ancestor_id', models.PositiveIntegerField()),
+                ('descendant_type', models.CharField(max_length=32)),
+                ('descendant_id', models.PositiveIntegerField()),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('archived', models.BooleanField(default=False)),
+            ],
+            options={
+                'unique_together': {('ancestor_type', 'ancestor_id', 'descendant_type', 'descendant_id')},
+                'index_together': {('descendant_type', 'descendant_id', 'depth')},
+            },
+            managers=[
+                ('objects', staff.managers.EntityClosureManager()),
+            ],
+        ),
+        migrations.RunPython(rebuild_closure, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,11 @@
+from django.apps import apps
 from django.db import models, transaction
-from django.db.models import ProtectedError
+from django.db.models import ProtectedError, Q
 
-from staff.models import PermissionedRelationshipBase
+from mainsite.identity_map import prefetch_cached_gets
+from staff.managers import LEVELS
+from staff.models import PermissionedRelationshipBase, EntityClosure, STAFF_MODELS
+from staff.permission_matrix import get_permission_matrix, invalidate_permission_matrices
 
 
 class PermissionedModelMixin(object):
@@ -45,51 +49,55 @@ class PermissionedModelMixin(object):
         :param check_children: bool
         :return: required_permissions: a list of staff memberships
         """
-        all_entities_in_my_branch = self.get_all_entities_in_branch(check_parents=check_parents,
-                                                                    check_children=check_children)
-        all_staff_memberships_in_my_branch = []
-        for entity in all_entities_in_my_branch:
-            all_staff_memberships_in_my_branch += entity.cached_staff()
-        return [staff for staff in all_staff_memberships_in_my_branch if staff.user == user]
+        own_level = LEVELS.index(self.__class__.__name__)
+        memberships = []
+        for staff_model, level, field in STAFF_MODELS:
+            if LEVELS.index(level) == own_level:
+                branch = Q(**{field: self})
+            elif LEVELS.index(level) < own_level and check_parents:
+                branch = Q(**{field + '__in': EntityClosure.objects.ancestor_ids(self, level)})
+            elif LEVELS.index(level) > own_level and check_children:
+                branch = Q(**{field + '__in': EntityClosure.objects.descendant_ids([self], level)})
+            else:
+                continue
+            memberships += list(staff_model.objects.filter(branch, user=user))
+        return memberships
 
     def get_all_entities_in_branch(self, check_parents=True, check_children=True):
         """
-        Recursively walks the tree up and down to get all the entities of the current branch (where self is a node).
+        Gets all the entities of the current branch (where self is a node) from the closure table.
         returns self, all the parents and all the children
         """
         entities = [self]
         if check_parents:
-            try:
-                entities += self.parent.get_all_entities_in_branch(check_children=False)
-            except AttributeError:
-                if not check_children:
-                    return entities
+            entities += EntityClosure.objects.get_ancestors(self)
         if check_children:
-            try:
-                for child in self.children:
-                    entities += child.get_all_entities_in_branch(check_parents=False)
-            except AttributeError:
-                return entities
+            entities += self.get_descendants()
         return entities
 
+    def get_descendants(self):
+        """
+        :return: all the entities below this one that are not archived, in depth first order
+        """
+        return EntityClosure.objects.get_descendants(self)
+
     def get_permissions(self, user):
         """
-        This method returns (inherited or local) permissions for the instance by climbing the permission tree.
+        This method returns (inherited or local) permissions for the instance from the permission matrix of the user,
+        which is computed for the whole permission tree at once.
         :param user: BadgeUser (teacher)
         :return: a permissions dictionary
         """
-        try:
-            parent_perms = self.parent.get_permissions(user)
-            local_perms = self._get_local_permissions(user)
-            combined_perms = {}
-            for key in local_perms:
-                combined_perms[key] = local_perms[key] if local_perms[key] > parent_perms[key] else parent_perms[key]
-            return combined_perms
-        except AttributeError:  # recursive base case (reached root of permission tree, i.e. the Institution)
-            perms = self._get_local_permissions(user)
-            if user.is_teacher and self == user.institution:  # if at the recursive base case the institution is the same as user's institution
-                perms['may_read'] = True  # then add may_read, everyone in institution is a reader
-            return perms
+        return get_permission_matrix(user).get_permissions(self)
+
+    def get_institution_id(self):
+        """
+        :return: the pk of the institution at the root of the permission tree this entity is part of
+        """
+        if self.__class__.__name__ == 'Institution':
+            return self.pk
+        institution = self.institution
+        return institution.pk if institution else None
 
     def has_permissions(self, user, permissions):
         """
@@ -145,11 +153,18 @@ class PermissionedModelMixin(object):
 
     def publish(self, *args, **kwargs):
         super(PermissionedModelMixin, self).publish(*args, **kwargs)
-        for member in self.cached_staff():
+        members = self.cached_staff()
+        prefetch_cached_gets(apps.get_model('badgeuser', 'BadgeUser'), [member.user_id for member in members])
+        for member in members:
             member.cached_user.publish()
 
     def save(self, *args, **kwargs):
+        # an entity moved to another institution leaves the permission tree of the previous one
+        previous = self.__class__.objects.filter(pk=self.pk).first() if self.pk else None
+        previous_institution_id = previous.get_institution_id() if previous else None
         super(PermissionedModelMixin, self).save(*args, **kwargs)
+        EntityClosure.objects.sync(self)
+        invalidate_permission_matrices(institution_ids={previous_institution_id, self.get_institution_id()})
         try:
             self.parent.publish()
         except AttributeError:
@@ -158,31 +173,33 @@ class PermissionedModelMixin(object):
     @transaction.atomic
     def delete(self, *args, **kwargs):
         """
-        Recursive delete function that
-            - deletes all children
+        Delete function that
+            - deletes all children, the deepest first
             - only publishes the parent of the initially deleted entity
             - removes all associated staff memberships without publishing the associated object (the one that is deleted)
         """
         publish_parent = kwargs.pop('publish_parent', True)
-        if self.assertions:
+        if next(self.iter_assertions(), None) is not None:
             raise ProtectedError(
                 "{} may only be deleted if there are no awarded Assertions.".format(self.__class__.__name__), self)
-        try:  # first the children
-            kids = self.children
-            for child in kids:
-                child.delete(publish_parent=False)
-        except AttributeError:  # no kids
-            pass
-        for membership in self.staff_items:
-            membership.delete(publish_object=False)
-        ret = super(PermissionedModelMixin, self).delete(*args, **kwargs)
+        for descendant in reversed(self.get_descendants()):
+            descendant._delete_node()
+        institution_id = self.get_institution_id()
+        ret = self._delete_node(*args, **kwargs)
         if publish_parent:
+            invalidate_permission_matrices(institution_ids=[institution_id])
             try:
                 self.parent.publish()
             except AttributeError:  # no parent
                 pass
         return ret
 
+    def _delete_node(self, *args, **kwargs):
+        for membership in self.staff_items:
+            membership.delete(publish_object=False)
+        EntityClosure.objects.remove(self)
+        return super(PermissionedModelMixin, self).delete(*args, **kwargs)
+
     def return_value_according_to_language(self, attribute_english, attribute_dutch):
         """Convenience function that returns the right attribute according to the
         language selection of its parent institution"""
@@ -8,6 +8,8 @@ from rest_framework import serializers
 from entity.models import BaseVersionedEntity
 from mainsite.exceptions import BadgrValidationError
 from signing.models import SymmetricKey
+from staff.managers import EntityClosureManager
+from staff.permission_matrix import invalidate_permission_matrices
 
 
 class PermissionedRelationshipBase(BaseVersionedEntity):
@@ -101,6 +103,7 @@ class PermissionedRelationshipBase(BaseVersionedEntity):
         super(PermissionedRelationshipBase, self).save()
         self.object.remove_cached_data(['cached_staff'])
         self._empty_user_cached_staff()
+        invalidate_permission_matrices(user_ids=[self.user_id])
 
     def delete(self, *args, **kwargs):
         publish_object = kwargs.pop('publish_object', True)
@@ -108,6 +111,7 @@ class PermissionedRelationshipBase(BaseVersionedEntity):
         if publish_object:
             self.object.remove_cached_data(['cached_staff'])  # update permissions instantly
         self._empty_user_cached_staff()
+        invalidate_permission_matrices(user_ids=[self.user_id])
 
     @property
     def cached_user(self):
@@ -199,3 +203,34 @@ class BadgeClassStaff(PermissionedRelationshipBase):
     @property
     def object(self):
         return self.badgeclass
+
+
+# staff model, level of the entity it is a membership of and the field that points to that entity
+STAFF_MODELS = (
+    (InstitutionStaff, 'Institution', 'institution'),
+    (FacultyStaff, 'Faculty', 'faculty'),
+    (IssuerStaff, 'Issuer', 'issuer'),
+    (BadgeClassStaff, 'BadgeClass', 'badgeclass'),
+)
+
+
+class EntityClosure(models.Model):
+    """
+    Closure table of the Institution > Faculty > Issuer > BadgeClass tree. There is a row for every ancestor and
+    descendant pair, and a row with depth 0 for every entity itself, so a branch can be queried with a single join.
+    Kept in sync by PermissionedModelMixin when an entity is saved, archived or deleted.
+    """
+    ancestor_type = models.CharField(max_length=32)
+    ancestor_id = models.PositiveIntegerField()
+    descendant_type = models.CharField(max_length=32)
+    descendant_id = models.PositiveIntegerField()
+    depth = models.PositiveSmallIntegerField()
+    archived = models.BooleanField(default=False)  # the archived flag of the descendant
+
+    objects = EntityClosureManager()
+
+    class Meta:
+        unique_together = ('ancestor_type', 'ancestor_id', 'descendant_type', 'descendant_id')
+        index_together = (
+            ('descendant_type', 'descendant_id', 'depth'),
+        )
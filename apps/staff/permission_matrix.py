@@ -0,0 +1,145 @@
+# encoding: utf-8
+import threading
+import weakref
+
+from cachemodel.utils import generate_cache_key
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+from entity.cache import bump_revisions, get_revisions
+
+PERMISSIONS = ('may_create', 'may_read', 'may_update', 'may_delete', 'may_award', 'may_sign',
+               'may_administrate_users')
+BITS = {permission: 1 << index for index, permission in enumerate(PERMISSIONS)}
+
+# level, staff model, field of the staff model that points to the entity, lookup path to the institution
+STAFF_LEVELS = (
+    ('Institution', 'InstitutionStaff', 'institution', 'institution'),
+    ('Faculty', 'FacultyStaff', 'faculty', 'faculty__institution'),
+    ('Issuer', 'IssuerStaff', 'issuer', 'issuer__faculty__institution'),
+    ('BadgeClass', 'BadgeClassStaff', 'badgeclass', 'badgeclass__issuer__faculty__institution'),
+)
+
+# level, app, parent level, field that points to the parent, lookup path to the institution
+TREE_LEVELS = (
+    ('Faculty', 'institution', 'Institution', 'institution', 'institution'),
+    ('Issuer', 'issuer', 'Faculty', 'faculty', 'faculty__institution'),
+    ('BadgeClass', 'issuer', 'Issuer', 'issuer', 'issuer__faculty__institution'),
+)
+
+_lock = threading.Lock()
+_generation = 0  # changes whenever a matrix is invalidated in this process
+_memo = {}  # id(user) -> (weak reference to user, generation, matrix)
+
+
+def to_bits(permissions):
+    return sum(BITS[permission] for permission in PERMISSIONS if permissions.get(permission))
+
+
+def to_permissions(bits):
+    return {permission: bool(bits & BITS[permission]) for permission in PERMISSIONS}
+
+
+class PermissionMatrix(object):
+    """
+    The effective permissions of one user on every Institution, Faculty, Issuer and BadgeClass the user has any
+    permission on, computed in one pass over the staff memberships of the user and the entity trees they are in.
+    Permissions are inherited down the tree like PermissionedModelMixin has always done, and every teacher may
+    read the whole tree of their own institution.
+    """
+
+    def __init__(self, entries):
+        """
+        :param entries: dictionary of (class name, pk) -> bitmask of permissions, entities without any
+        permission are left out
+        """
+        self.entries = entries
+
+    def get_permissions(self, entity):
+        return to_permissions(self.entries.get((entity.__class__.__name__, entity.pk), 0))
+
+    @classmethod
+    def build(cls, user):
+        """
+        :return: tuple of the matrix and the ids of the institutions whose trees it was built from
+        """
+        local = {}
+        institution_ids = set()
+        if user.is_teacher and user.institution_id:
+            institution_ids.add(user.institution_id)
+        for level, staff_model, field, institution_path in STAFF_LEVELS:
+            staff = apps.get_model('staff', staff_model).objects.filter(user=user)
+            for row in staff.values(*{field, institution_path}.union(PERMISSIONS)):
+                local[(level, row[field])] = to_bits(row)
+                if row[institution_path]:
+                    institution_ids.add(row[institution_path])
+
+        entries = {}
+        for institution_id in institution_ids:
+            bits = local.get(('Institution', institution_id), 0)
+            if user.is_teacher and institution_id == user.institution_id:
+                bits |= BITS['may_read']
+            entries[('Institution', institution_id)] = bits
+        for level, app_label, parent_level, parent_field, institution_path in TREE_LEVELS:
+            model = apps.get_model(app_label, level)
+            for pk, parent_id in model.objects.filter(**{institution_path + '__in': institution_ids}) \
+                    .values_list('pk', parent_field):
+                entries[(level, pk)] = entries.get((parent_level, parent_id), 0) | local.get((level, pk), 0)
+        for key, bits in local.items():
+            # memberships outside of an institution tree only have their local permissions
+            entries.setdefault(key, bits)
+        return cls({key: bits for key, bits in entries.items() if bits}), institution_ids
+
+
+def _matrix_cache_key(user, revision):
+    return generate_cache_key(['PermissionMatrix', user.pk], revision=revision, institution=user.institution_id,
+                              teacher=user.is_teacher)
+
+
+def _load_matrix(user):
+    user_revision, = get_revisions([('PermissionMatrix', user.pk)])
+    key = _matrix_cache_key(user, user_revision)
+    cached = cache.get(key)
+    if cached is not None:
+        tree_ids = sorted(cached['trees'])
+        if get_revisions([('PermissionTree', pk) for pk in tree_ids]) == [cached['trees'][pk] for pk in tree_ids]:
+            return PermissionMatrix(cached['entries'])
+    matrix, institution_ids = PermissionMatrix.build(user)
+    tree_ids = sorted(institution_ids)
+    trees = dict(zip(tree_ids, get_revisions([('PermissionTree', pk) for pk in tree_ids])))
+    cache.set(key, {'trees': trees, 'entries': matrix.entries},
+              getattr(settings, 'PERMISSION_MATRIX_CACHE_TIMEOUT', 60 * 60 * 24))
+    return matrix
+
+
+def get_permission_matrix(user):
+    """
+    Returns the permission matrix of a user. It is kept on the user instance for as long as nothing is
+    invalidated in this process, and in the cache until a staff membership of the user or an entity in one of
+    its trees changes.
+    """
+    if getattr(user, 'pk', None) is None:
+        return PermissionMatrix({})
+    memo = _memo.get(id(user))
+    if memo is not None and memo[0]() is user and memo[1] == _generation:
+        return memo[2]
+    generation = _generation
+    matrix = _load_matrix(user)
+    user_id = id(user)
+    _memo[user_id] = (weakref.ref(user, lambda ref: _memo.pop(user_id, None)), generation, matrix)
+    return matrix
+
+
+def invalidate_permission_matrices(user_ids=(), institution_ids=()):
+    """
+    Invalidates the permission matrices of the given users and of everyone with permissions in the trees of the
+    given institutions
+    """
+    global _generation
+    dependencies = [('PermissionMatrix', pk) for pk in user_ids] + \
+                   [('PermissionTree', pk) for pk in institution_ids if pk]
+    if dependencies:
+        bump_revisions(dependencies)
+    with _lock:
+        _generation += 1
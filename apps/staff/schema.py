@@ -1,6 +1,8 @@
 import graphene
 from graphene_django.types import DjangoObjectType
 
+from mainsite.graphql_loaders import foreign_key_resolver
+from mainsite.graphql_pagination import CountableConnection
 from staff.models import InstitutionStaff, FacultyStaff, IssuerStaff, BadgeClassStaff
 
 
@@ -10,26 +12,50 @@ class StaffTypeMeta(object):
                   'may_administrate_users')
 
 
-class InstitutionStaffType(DjangoObjectType):
+class StaffUserResolverMixin(object):
+    resolve_user = foreign_key_resolver('user')
+
+
+class InstitutionStaffType(StaffUserResolverMixin, DjangoObjectType):
     class Meta(StaffTypeMeta):
         model = InstitutionStaff
 
 
-class FacultyStaffType(DjangoObjectType):
+class FacultyStaffType(StaffUserResolverMixin, DjangoObjectType):
     class Meta(StaffTypeMeta):
         model = FacultyStaff
 
 
-class IssuerStaffType(DjangoObjectType):
+class IssuerStaffType(StaffUserResolverMixin, DjangoObjectType):
     class Meta(StaffTypeMeta):
         model = IssuerStaff
 
 
-class BadgeClassStaffType(DjangoObjectType):
+class BadgeClassStaffType(StaffUserResolverMixin, DjangoObjectType):
     class Meta(StaffTypeMeta):
         model = BadgeClassStaff
 
 
+class InstitutionStaffConnection(CountableConnection):
+    class Meta:
+        node = InstitutionStaffType
+
+
+class FacultyStaffConnection(CountableConnection):
+    class Meta:
+        node = FacultyStaffType
+
+
+class IssuerStaffConnection(CountableConnection):
+    class Meta:
+        node = IssuerStaffType
+
+
+class BadgeClassStaffConnection(CountableConnection):
+    class Meta:
+        node = BadgeClassStaffType
+
+
 class PermissionType(graphene.ObjectType):
     may_create = graphene.Boolean()
     may_read = graphene.Boolean()
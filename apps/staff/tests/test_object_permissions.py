@@ -1,6 +1,8 @@
 import json
 import collections
 from mainsite.tests import BadgrTestCase
+from issuer.models import BadgeClass, Issuer
+from staff.models import EntityClosure
 
 
 class ObjectPermissionTests(BadgrTestCase):
@@ -279,3 +281,72 @@ class ObjectPermissionTests(BadgrTestCase):
         self.assertEqual(response_empty['data']['faculty'], None)
         response_empty = self.graphene_post(student, query)
         self.assertEqual(response_empty['data']['faculty'], None)
+
+    def test_permission_matrix(self):
+        teacher1 = self.setup_teacher()
+        outside_teacher = self.setup_teacher()
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        other_badgeclass = self.setup_badgeclass(issuer=issuer)
+        self.setup_staff_membership(teacher1, faculty, may_read=True, may_update=True)
+        staff = self.setup_staff_membership(teacher1, badgeclass, may_award=True)
+        self.assertTrue(badgeclass.has_permissions(teacher1, ['may_read', 'may_update', 'may_award']))
+        self.assertFalse(other_badgeclass.has_permissions(teacher1, ['may_award']))
+        self.assertFalse(teacher1.institution.has_permissions(teacher1, ['may_update']))
+        self.assertTrue(teacher1.institution.has_permissions(teacher1, ['may_read']))
+        self.assertFalse(badgeclass.has_permissions(outside_teacher, ['may_read']))
+        with self.assertNumQueries(0):
+            self.assertTrue(issuer.has_permissions(teacher1, ['may_update']))
+        staff.delete()
+        self.assertFalse(badgeclass.has_permissions(teacher1, ['may_award']))
+        new_badgeclass = self.setup_badgeclass(issuer=issuer)
+        self.assertTrue(new_badgeclass.has_permissions(teacher1, ['may_update']))
+        # moved to another institution, out of the permission tree of the previous one
+        issuer.faculty = self.setup_faculty(institution=outside_teacher.institution)
+        issuer.save()
+        self.assertFalse(issuer.has_permissions(teacher1, ['may_update']))
+
+    def test_entity_closure(self):
+        teacher1 = self.setup_teacher()
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        other_faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        self.assertEqual(faculty.get_all_entities_in_branch(), [faculty, teacher1.institution, issuer, badgeclass])
+        issuer.faculty = other_faculty
+        issuer.save()
+        self.assertEqual(faculty.get_descendants(), [])
+        self.assertEqual(other_faculty.get_descendants(), [issuer, badgeclass])
+        self.assertEqual(EntityClosure.objects.get_ancestors(badgeclass), [issuer, other_faculty, teacher1.institution])
+        badgeclass.archive()
+        self.assertEqual(other_faculty.get_descendants(), [issuer])
+        rows = set(EntityClosure.objects.values_list('ancestor_type', 'ancestor_id', 'descendant_type',
+                                                      'descendant_id', 'depth', 'archived'))
+        EntityClosure.objects.rebuild()
+        self.assertEqual(rows, set(EntityClosure.objects.values_list('ancestor_type', 'ancestor_id', 'descendant_type',
+                                                                     'descendant_id', 'depth', 'archived')))
+        other_faculty.delete()
+        self.assertFalse(EntityClosure.objects.filter(descendant_type='BadgeClass', descendant_id=badgeclass.pk).exists())
+
+    def test_with_permission(self):
+        teacher1 = self.setup_teacher()
+        outside_teacher = self.setup_teacher()
+        student = self.setup_student(affiliated_institutions=[teacher1.institution])
+        faculty = self.setup_faculty(institution=teacher1.institution)
+        issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        other_issuer = self.setup_issuer(faculty=faculty, created_by=teacher1)
+        badgeclass = self.setup_badgeclass(issuer=issuer)
+        other_badgeclass = self.setup_badgeclass(issuer=other_issuer)
+        self.setup_staff_membership(teacher1, issuer, may_read=True, may_award=True)
+        self.assertEqual(list(BadgeClass.objects.with_permission(teacher1, 'may_award')), [badgeclass])
+        self.assertEqual(list(BadgeClass.objects.with_permission(teacher1, 'may_read', 'may_award')), [badgeclass])
+        self.assertEqual(set(BadgeClass.objects.with_permission(teacher1, 'may_read')), {badgeclass, other_badgeclass})
+        self.assertEqual(list(Issuer.objects.with_permission(outside_teacher, 'may_read')), [])
+        self.assertEqual(list(Issuer.objects.with_permission(student, 'may_read')), [])
+        for bc in BadgeClass.objects.all():
+            self.assertEqual(BadgeClass.objects.with_permission(teacher1, 'may_award').filter(pk=bc.pk).exists(),
+                             bc.has_permissions(teacher1, ['may_award']))
+        query = 'query foo {badgeClassesToAward(first: 1) {entityId}}'
+        response = self.graphene_post(teacher1, query)
+        self.assertEqual([bc['entityId'] for bc in response['data']['badgeClassesToAward']], [badgeclass.entity_id])